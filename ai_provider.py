@@ -1,53 +1,135 @@
+import os
 import json
-import google.generativeai as genai
+import asyncio
 import logging
+import importlib
+import threading
+from collections import OrderedDict
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Rate limits (enforced by rate_limit.py): requestsPerMinute and maxConcurrent cap what this
+# deployment sends to the model in total, userRequestsPerMinute and userBurst what one user can.
+# Pro models are slower and pricier, so they get tighter limits than Flash ones.
 GEMINI_MODELS = {
     "gemini-2.0-flash-001": {
         "id": "gemini-2.0-flash-001", "name": "Gemini 2.0 Flash",
-        "inputPrice": 0.1, "outputPrice": 0.4
+        "inputPrice": 0.1, "outputPrice": 0.4,
+        "requestsPerMinute": 60, "maxConcurrent": 8, "userRequestsPerMinute": 6, "userBurst": 3
     },
     "gemini-1.5-flash-002": {
         "id": "gemini-1.5-flash-002", "name": "Gemini 1.5 Flash (128k+)",
-        "inputPrice": 0.075, "outputPrice": 0.3 # Using first tier pricing
+        "inputPrice": 0.075, "outputPrice": 0.3, # Using first tier pricing
+        "requestsPerMinute": 60, "maxConcurrent": 8, "userRequestsPerMinute": 6, "userBurst": 3
     },
     "gemini-2.5-pro-preview-06-05": {
         "id": "gemini-2.5-pro-preview-06-05", "name": "Gemini 2.5 Pro Preview (200k+)",
-        "inputPrice": 1.25, "outputPrice": 10 # Using first tier pricing
+        "inputPrice": 1.25, "outputPrice": 10, # Using first tier pricing
+        "requestsPerMinute": 20, "maxConcurrent": 4, "userRequestsPerMinute": 2, "userBurst": 2
     },
     "gemini-2.5-flash-preview-05-20": {
         "id": "gemini-2.5-flash-preview-05-20", "name": "Gemini 2.5 Flash Preview",
-        "inputPrice": 0.15, "outputPrice": 0.6
+        "inputPrice": 0.15, "outputPrice": 0.6,
+        "requestsPerMinute": 60, "maxConcurrent": 8, "userRequestsPerMinute": 6, "userBurst": 3
     },
     # Adding a few more for variety, focusing on priced models
     "gemini-1.5-pro-latest": {
 		"id": "gemini-1.5-pro-latest", "name": "Gemini 1.5 Pro",
-		"inputPrice": 3.5, "outputPrice": 10.5
+		"inputPrice": 3.5, "outputPrice": 10.5,
+		"requestsPerMinute": 20, "maxConcurrent": 4, "userRequestsPerMinute": 2, "userBurst": 2
 	},
     "gemini-1.5-flash-latest": {
 		"id": "gemini-1.5-flash-latest", "name": "Gemini 1.5 Flash",
-		"inputPrice": 0.35, "outputPrice": 0.70
+		"inputPrice": 0.35, "outputPrice": 0.70,
+		"requestsPerMinute": 60, "maxConcurrent": 8, "userRequestsPerMinute": 6, "userBurst": 3
 	},
 }
 DEFAULT_MODEL_ID = "gemini-2.0-flash-001"
 
+# The Gemini SDK takes most of a second to import, so it is only loaded when the first provider
+# is created; importing this module (and the app) stays fast.
+genai = None
+
+# Each user generates with their own key. genai.configure() sets one process-wide key, which a
+# model only reads when its first request creates its client, so two users generating at once
+# could both be billed to whichever key was configured last. Every model gets the client for its
+# own key instead. Clients are kept for the most recently used keys (async ones per event loop,
+# which they are tied to); the least recently used is closed once there are more than
+# CLIENT_CACHE_SIZE, so keep it above the number of keys generating at the same time.
+CLIENT_CACHE_SIZE = int(os.getenv("GEMINI_CLIENT_CACHE_SIZE", 32))
+_clients = OrderedDict() # (api key, event loop or None) -> GenerativeService client
+_clients_lock = threading.Lock()
+
+def _load_sdk():
+    global genai
+    if genai is None:
+        genai = importlib.import_module("google.generativeai")
+    return genai
+
+def check_provider_options(options):
+    """Raises ValueError unless options name a key and a supported model. Creates no client."""
+    if not options.get("gemini_api_key"):
+        raise ValueError("Gemini API key is required.")
+    model_id = options.get("model_id", DEFAULT_MODEL_ID)
+    if model_id not in GEMINI_MODELS:
+        raise ValueError(f"Unsupported model ID: {model_id}")
+
+def _generative_client(api_key, async_client=False):
+    """
+    The GenerativeService client that sends requests with api_key. The async one belongs to the
+    running event loop, so it must be requested on that loop.
+    """
+    key = (api_key, asyncio.get_running_loop() if async_client else None)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+        glm = importlib.import_module("google.ai.generativelanguage")
+        client_class = glm.GenerativeServiceAsyncClient if async_client else glm.GenerativeServiceClient
+        client = _clients[key] = client_class(client_options={"api_key": api_key})
+        for stale_key in [cached_key for cached_key in _clients if cached_key[1] is not None and cached_key[1].is_closed()]:
+            del _clients[stale_key] # Their loop is gone, and with it any way to use or close them
+        evicted = []
+        while len(_clients) > CLIENT_CACHE_SIZE:
+            evicted.append(_clients.popitem(last=False))
+    for (_, loop), old_client in evicted:
+        _close_client(old_client, loop)
+    return client
+
+def _close_client(client, loop):
+    try:
+        if loop is None:
+            client.transport.close()
+        elif not loop.is_closed():
+            # Async transports close with a coroutine, which has to run on the client's own loop
+            asyncio.run_coroutine_threadsafe(client.transport.close(), loop)
+    except Exception as e:
+        logger.warning(f"Closing an evicted Gemini client failed: {e}")
+
+def _bind_client(model, client, async_client=False):
+    """
+    Makes model send its requests through client. google-generativeai (0.8) has no per-model key
+    or client option: a GenerativeModel creates its clients from the global configuration on first
+    use unless _client / _async_client are already set, so this is the one place setting them.
+    """
+    attribute = "_async_client" if async_client else "_client"
+    if not hasattr(model, attribute):
+        raise RuntimeError(f"This google-generativeai version has no GenerativeModel.{attribute}; "
+                           "per-key clients need an update.")
+    setattr(model, attribute, client)
+
 class SimpleGeminiProvider:
     def __init__(self, options):
-        if not options.get("gemini_api_key"):
-            raise ValueError("Gemini API key is required.")
+        check_provider_options(options)
         
         self.options = options
-        genai.configure(api_key=options["gemini_api_key"])
+        genai = _load_sdk()
         
         self.model_id = options.get("model_id", DEFAULT_MODEL_ID)
-        self.model_info = GEMINI_MODELS.get(self.model_id)
-        if not self.model_info:
-            raise ValueError(f"Unsupported model ID: {self.model_id}")
+        self.model_info = GEMINI_MODELS[self.model_id]
+        self._async_loop = None
             
         self.model = genai.GenerativeModel(
             self.model_id,
@@ -57,6 +139,15 @@ class SimpleGeminiProvider:
                 "response_mime_type": "application/json",
             }
         )
+        _bind_client(self.model, _generative_client(options["gemini_api_key"]))
+
+    async def generate_content_async(self, prompt):
+        """self.model.generate_content_async with this provider's key, on the running loop's client."""
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            _bind_client(self.model, _generative_client(self.options["gemini_api_key"], async_client=True), async_client=True)
+            self._async_loop = loop
+        return await self.model.generate_content_async(prompt)
 
     def create_message_stream(self, system_instruction, user_prompt):
         full_prompt = f"{system_instruction}\n\n{user_prompt}"
@@ -80,4 +171,11 @@ class SimpleGeminiProvider:
     def calculate_cost(self, input_tokens, output_tokens):
         input_cost = (input_tokens / 1_000_000) * self.model_info["inputPrice"]
         output_cost = (output_tokens / 1_000_000) * self.model_info["outputPrice"]
-        return input_cost + output_cost
\ No newline at end of file
+        return input_cost + output_cost
+
+def _reset_after_fork():
+    global _clients_lock
+    _clients_lock = threading.Lock()
+    _clients.clear() # gRPC channels are not usable across fork; each process makes its own
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -2,40 +2,306 @@
 Main Flask application for the MVP Workout Generator.
 Handles user input for workout preferences and generates a workout plan
 using the Google Gemini API.
+
+create_app() builds the application from an explicit configuration (see default_config);
+wsgi.py and gunicorn.conf.py are the production entry point, `python app.py` runs the
+development server.
 """
 import os
 import json
-from datetime import date, timedelta # Added
-from flask import Flask, request, jsonify, render_template
+import logging
+import threading
+import contextlib
+from time import perf_counter
+from datetime import date, datetime, time, timedelta, timezone # Added
+from flask import Flask, Blueprint, current_app, request, jsonify, render_template, g
+from werkzeug.http import quote_etag
+from werkzeug.local import LocalProxy
 from dotenv import load_dotenv
-import database as db
-from weekly_planner import generate_and_save_weekly_plan
-from ai_provider import SimpleGeminiProvider
+import storage as storage_backends
+from storage import get_storage
+import credentials
+from credentials import get_credential_store
+import database
+import query_stats
+import response_encoding
+import rate_limit
+import metrics
+import tracing
+import logging_config
+from logging_config import log_payload
+from weekly_planner import get_or_create_current_plan, changed_plan_settings, replan_scheduler
+from ai_provider import check_provider_options, DEFAULT_MODEL_ID
 from workout_generator import generate_workout_plan
 
 # Load environment variables from .env file for local development
 load_dotenv()
 
-app = Flask(__name__)
-
-# API Key Configuration
-USER_CONFIG_FILE = "user_config.json"
-
-def load_gemini_api_key():
-    """Loads the Gemini API key from config file or environment variable."""
-    try:
-        with open(USER_CONFIG_FILE, "r", encoding="utf-8") as f:
-            config = json.load(f)
-            return config.get("GEMINI_API_KEY")
-    except FileNotFoundError:
-        return os.getenv("GEMINI_API_KEY")
-    except json.JSONDecodeError:
-        app.logger.error(f"Error decoding {USER_CONFIG_FILE}. Using environment variable for API key.")
-        return os.getenv("GEMINI_API_KEY")
-
-# Initialize the database
-with app.app_context():
-    db.setup_database()
+# The same logger as app.logger (Flask names it after the import name), usable outside a request
+logger = logging.getLogger(__name__)
+bp = Blueprint("workouts", __name__)
+
+# API Key Configuration (cached; see credentials.py)
+def load_gemini_api_key(user_id=None):
+    """The Gemini API key for user_id: their own key if they saved one, else the deployment-wide key."""
+    return get_credential_store().api_key_for(user_id)
+
+# The process-wide storage backend that create_app() configured
+storage = LocalProxy(get_storage)
+
+# Per-request query capture: send "X-Debug-Queries: 1" (or set DEBUG_QUERIES=1 for every
+# request) to get the request's database time in a Server-Timing header and each query logged.
+DEBUG_QUERIES = os.getenv("DEBUG_QUERIES", "0") == "1"
+
+# First page load: settings, this week's plan and recent history in one read, also inlined
+# into index.html (INLINE_BOOTSTRAP_STATE=0 leaves the page to fetch /bootstrap instead)
+INLINE_BOOTSTRAP_STATE = os.getenv("INLINE_BOOTSTRAP_STATE", "1") == "1"
+BOOTSTRAP_HISTORY_DAYS = 14 # The history window the page shows
+
+# How long shutdown() waits for in-flight workout generations (each is a Gemini call)
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 60))
+DRAIN_RETRY_AFTER = 5 # Seconds a client refused during shutdown should wait (another worker will take it)
+
+# --- Configuration ---
+
+def default_config():
+    """
+    create_app()'s configuration unless overridden, from the environment and module defaults:
+    DB_FILE, DB_SHARD_COUNT, DB_WRITE_BATCHING, DB_BATCH_MAX_SIZE, DB_BATCH_MAX_DELAY_MS and
+    DB_SETTINGS_CACHE (see database.py), STORAGE_BACKEND and USER_CONFIG_FILE
+    (see credentials.py), RATE_LIMITING, RATE_LIMIT_WAIT_SECONDS and RATE_LIMIT_PROCESSES (see
+    rate_limit.py), TRACING, TRACE_SAMPLE_RATE and TRACE_FILE (see tracing.py),
+    METRICS_MULTIPROC_DIR and METRICS_SNAPSHOT_INTERVAL (see metrics.py), DEBUG_QUERIES,
+    INLINE_BOOTSTRAP_STATE and DRAIN_TIMEOUT. GENERATE_WORKOUT is the generator function, i.e.
+    the AI provider. CONFIGURE_LOGGING=False leaves the logging setup to the caller (see
+    logging_config.py).
+    """
+    return {
+        "DB_FILE": os.getenv("DB_FILE", database.DB_FILE),
+        "DB_SHARD_COUNT": database.SHARD_COUNT,
+        "DB_WRITE_BATCHING": database.WRITE_BATCHING,
+        "DB_BATCH_MAX_SIZE": database.BATCH_MAX_SIZE,
+        "DB_BATCH_MAX_DELAY_MS": database.BATCH_MAX_DELAY_MS,
+        "DB_SETTINGS_CACHE": database.SETTINGS_CACHE,
+        "STORAGE_BACKEND": storage_backends.STORAGE_BACKEND,
+        "USER_CONFIG_FILE": credentials.USER_CONFIG_FILE,
+        "SETUP_DATABASE": True, # Create/migrate the schema when the app is created
+        "GENERATE_WORKOUT": generate_workout_plan,
+        "RATE_LIMITING": rate_limit.RATE_LIMITING,
+        "RATE_LIMIT_WAIT_SECONDS": rate_limit.RATE_LIMIT_WAIT_SECONDS,
+        "RATE_LIMIT_PROCESSES": rate_limit.RATE_LIMIT_PROCESSES,
+        "TRACING": tracing.TRACING,
+        "TRACE_SAMPLE_RATE": tracing.TRACE_SAMPLE_RATE,
+        "TRACE_FILE": tracing.TRACE_FILE,
+        "METRICS_MULTIPROC_DIR": metrics.MULTIPROC_DIR,
+        "METRICS_SNAPSHOT_INTERVAL": metrics.SNAPSHOT_INTERVAL,
+        "DEBUG_QUERIES": DEBUG_QUERIES,
+        "INLINE_BOOTSTRAP_STATE": INLINE_BOOTSTRAP_STATE,
+        "DRAIN_TIMEOUT": DRAIN_TIMEOUT,
+        "CONFIGURE_LOGGING": True,
+    }
+
+class DrainingError(Exception):
+    """Raised when new work is refused because the worker is shutting down."""
+
+class InFlightTracker:
+    """Counts requests doing long-running work (workout generations) so shutdown can wait for them."""
+
+    def __init__(self):
+        self._count = 0
+        self._draining = False
+        self._condition = threading.Condition()
+
+    @property
+    def in_flight(self):
+        return self._count
+
+    @contextlib.contextmanager
+    def track(self):
+        """Holds one slot for the duration of the block. Raises DrainingError once draining has begun."""
+        with self._condition:
+            if self._draining:
+                raise DrainingError()
+            self._count += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._count -= 1
+                self._condition.notify_all()
+
+    def drain(self, timeout=None):
+        """Refuses new work, then waits up to timeout seconds for the current work. True if it all finished."""
+        with self._condition:
+            self._draining = True
+            return self._condition.wait_for(lambda: self._count == 0, timeout)
+
+def create_app(config=None):
+    """
+    Builds the Flask app. config overrides keys of default_config(). The database module and
+    the process-wide storage are configured from it, so there is one app per process.
+    """
+    app = Flask(__name__)
+    app.config.update(default_config())
+    app.config.update(config or {})
+    if app.config["CONFIGURE_LOGGING"]:
+        logging_config.configure_logging()
+
+    database.configure(
+        db_file=app.config["DB_FILE"],
+        shard_count=app.config["DB_SHARD_COUNT"],
+        write_batching=app.config["DB_WRITE_BATCHING"],
+        batch_max_size=app.config["DB_BATCH_MAX_SIZE"],
+        batch_max_delay_ms=app.config["DB_BATCH_MAX_DELAY_MS"],
+        settings_cache=app.config["DB_SETTINGS_CACHE"],
+    )
+    storage_backends.set_storage(storage_backends.create_storage(app.config["STORAGE_BACKEND"]))
+    tracing.configure(enabled=app.config["TRACING"], sample_rate=app.config["TRACE_SAMPLE_RATE"],
+                      trace_file=app.config["TRACE_FILE"])
+    metrics.configure(multiproc_dir=app.config["METRICS_MULTIPROC_DIR"],
+                      snapshot_interval=app.config["METRICS_SNAPSHOT_INTERVAL"])
+    credentials.set_credential_store(credentials.CredentialStore(app.config["USER_CONFIG_FILE"]))
+    if app.config["SETUP_DATABASE"]:
+        with app.app_context():
+            get_storage().setup()
+
+    # orjson/msgspec for jsonify when installed (JSON_ENCODER), see response_encoding.py
+    app.json = response_encoding.FastJSONProvider(app)
+    # after_request hooks run in reverse order: the request is timed including compression,
+    # which runs after every other hook, on the final body
+    app.before_request(start_request_timer)
+    app.after_request(record_request_metrics)
+    app.after_request(compress_response)
+    app.before_request(start_trace)
+    app.after_request(add_trace_header)
+    app.teardown_request(end_trace)
+    app.before_request(start_query_capture)
+    app.after_request(report_captured_queries)
+    app.teardown_request(end_query_capture)
+    app.register_blueprint(bp)
+
+    app.extensions["generations"] = InFlightTracker()
+    app.extensions["rate_limiter"] = rate_limit.RateLimiter(wait_budget=app.config["RATE_LIMIT_WAIT_SECONDS"],
+                                                            processes=app.config["RATE_LIMIT_PROCESSES"],
+                                                            enabled=app.config["RATE_LIMITING"])
+    register_metrics_collector(app)
+    app.logger.info(f"App created: {app.config['STORAGE_BACKEND']} storage, database {database.DB_FILE}.")
+    return app
+
+def shutdown(app, timeout=None):
+    """
+    Graceful shutdown for a worker: stops accepting generations (they get 503 + Retry-After),
+    waits up to timeout (DRAIN_TIMEOUT) seconds for the ones in flight, then runs the queued
+    replans, flushes batched history writes and hands this worker's counters to the metrics
+    directory (see metrics.retire_process). Safe to call more than once.
+    """
+    timeout = app.config["DRAIN_TIMEOUT"] if timeout is None else timeout
+    generations = app.extensions["generations"]
+    if not generations.drain(timeout):
+        logger.warning(f"Shutting down with {generations.in_flight} workout generation(s) still in flight after {timeout}s.")
+    replan_scheduler.wait()
+    database.close_history_writer()
+    metrics.retire_process()
+
+_metrics_collector = None
+
+def register_metrics_collector(app):
+    """Adds this app's scrape-time metrics to /metrics, replacing those of an app created earlier."""
+    global _metrics_collector
+    metrics.REGISTRY.unregister_collector(_metrics_collector)
+    _metrics_collector = lambda: collect_metrics(app)
+    metrics.REGISTRY.register_collector(_metrics_collector)
+
+def collect_metrics(app):
+    """Metric families for numbers kept elsewhere (see metrics.Registry.register_collector)."""
+    families = []
+
+    db_samples = []
+    for operation, (counts, total_ms) in sorted(query_stats.get_operation_histograms().items()):
+        bounds = [bound / 1000 for bound in query_stats.HISTOGRAM_BUCKETS_MS]
+        db_samples.extend(metrics.histogram_samples("db_operation_duration_seconds", {"operation": operation},
+                                                    bounds, counts, total_ms / 1000))
+    families.append(("db_operation_duration_seconds", "histogram",
+                     "Database operation latency, by operation (see query_stats.py).", db_samples))
+
+    families.append(("sqlite_lock_errors_total", "counter", "\"database is locked\" errors, by database operation.",
+                     [("sqlite_lock_errors_total", {"operation": operation}, count)
+                      for operation, count in sorted(query_stats.get_lock_errors().items())]))
+
+    caches = {**get_storage().get_cache_stats(), "credentials": get_credential_store().get_cache_stats()}
+    cache_samples = []
+    for cache, stats in sorted(caches.items()):
+        cache_samples.append(("cache_lookups_total", {"cache": cache, "result": "hit"}, stats.get("hits", 0)))
+        cache_samples.append(("cache_lookups_total", {"cache": cache, "result": "miss"}, stats.get("misses", 0)))
+    families.append(("cache_lookups_total", "counter", "In-process cache lookups, by cache and result.", cache_samples))
+
+    limiter_stats = app.extensions["rate_limiter"].get_stats()
+    decisions = [("rate_limit_decisions_total", {"result": "allowed"}, limiter_stats["allowed"]),
+                 ("rate_limit_decisions_total", {"result": "delayed"}, limiter_stats["delayed"])]
+    decisions += [("rate_limit_decisions_total", {"result": f"rejected_{scope}"}, count)
+                  for scope, count in sorted(limiter_stats["rejected"].items())]
+    families.append(("rate_limit_decisions_total", "counter",
+                     "Rate limiter decisions; delayed requests are also counted as allowed.", decisions))
+
+    writer_stats = database.get_history_writer_stats()
+    queues = {
+        "workout_generations_in_flight": ("Workout generations in progress.", app.extensions["generations"].in_flight),
+        "rate_limit_waiting": ("Generations waiting for their turn in the rate limiter.", limiter_stats["waiting"]),
+        "replan_queue_depth": ("Weekly replans queued and not yet started.", replan_scheduler.pending),
+        "history_write_queue_depth": ("Batched history writes not yet committed.", writer_stats["pending"] if writer_stats else 0),
+    }
+    for name, (documentation, value) in queues.items():
+        families.append((name, "gauge", documentation, [(name, {}, value)]))
+    return families
+
+def start_request_timer():
+    g.request_started = perf_counter()
+
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # The route template, not the path, so /delete_workout/<int:workout_id> is one series
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        metrics.HTTP_REQUEST_DURATION.labels(route, request.method, str(response.status_code)).observe(perf_counter() - started)
+    return response
+
+def start_trace():
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    g.trace = tracing.begin_trace(f"{request.method} {route}", request.headers.get("traceparent"),
+                                  **{"http.method": request.method, "http.route": route})
+
+def add_trace_header(response):
+    root, _ = g.get("trace", (None, None))
+    if root is not None:
+        response.headers[tracing.TRACE_ID_HEADER] = root.trace_id
+        root.set_attribute("http.status_code", response.status_code)
+    return response
+
+def end_trace(exc):
+    root, token = g.pop("trace", (None, None))
+    tracing.end_trace(root, token, exc)
+
+def compress_response(response):
+    return response_encoding.compress_response(response, request)
+
+def start_query_capture():
+    if current_app.config["DEBUG_QUERIES"] or request.headers.get("X-Debug-Queries") == "1":
+        g.query_capture = query_stats.capture_queries()
+        g.captured_queries = g.query_capture.__enter__()
+
+def report_captured_queries(response):
+    captured_queries = g.pop("captured_queries", None)
+    if captured_queries is not None:
+        total_ms = sum(query["ms"] for query in captured_queries)
+        response.headers["Server-Timing"] = f'db;dur={total_ms:.3f};desc="{len(captured_queries)} queries"'
+        for query in captured_queries:
+            logger.info(f"[{request.path}] {query['operation']} {query['ms']:.3f}ms: {query['sql']}")
+    return response
+
+def end_query_capture(exc):
+    query_capture = g.pop("query_capture", None)
+    if query_capture is not None:
+        query_capture.__exit__(None, None, None)
 
 # Helper function
 def get_current_week_start_date():
@@ -43,50 +309,166 @@ def get_current_week_start_date():
     today = date.today()
     return today - timedelta(days=today.weekday()) # Monday is 0, Sunday is 6
 
-@app.route("/")
+# --- Conditional GET ---
+# Read endpoints send a weak ETag built from the user's data version counters (see
+# database.data_versions) plus the date window the payload covers, and a Last-Modified.
+# A client that already holds that version gets 304 after one primary-key lookup; the
+# data itself is never loaded or serialized.
+
+def data_validators(versions, kinds, scope, scope_start=None):
+    """
+    (etag, last_modified) for a payload built from `kinds` of data over `scope` (e.g. a week).
+    scope_start, if given, is when the window began; it counts as a modification so clients revalidating
+    with If-Modified-Since alone still pick up a new day or week.
+    """
+    etag = ",".join(f"{kind}.{versions[kind][0]}" for kind in kinds) + f";{scope}"
+    changed_at = [versions[kind][1] for kind in kinds if versions[kind][1] is not None] + [scope_start]
+    changed_at = [moment for moment in changed_at if moment is not None]
+    return etag, max(changed_at) if changed_at else None
+
+def is_not_modified(req, etag, last_modified):
+    if req.if_none_match: # Takes precedence over If-Modified-Since
+        return req.if_none_match.contains_weak(etag)
+    return None not in (req.if_modified_since, last_modified) and last_modified <= req.if_modified_since
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True # Cache, but revalidate every time
+    return response
+
+def day_start(day):
+    """Local midnight of day, as an aware UTC datetime."""
+    return datetime.combine(day, time.min).astimezone(timezone.utc)
+
+def conditional_json(user_id, kinds, scope, scope_start, load):
+    """Returns 304 when the client is current, else jsonify(load()); both with validators."""
+    # Versions are read before the payload: a write in between makes the ETag older than the
+    # data, which costs one extra full response later instead of hiding the write
+    etag, last_modified = data_validators(storage.get_data_versions(user_id), kinds, scope, scope_start)
+    if is_not_modified(request, etag, last_modified):
+        return set_validators(current_app.response_class(status=304), etag, last_modified)
+    return set_validators(jsonify(load()), etag, last_modified)
+
+def load_bootstrap_state(user_id):
+    """
+    The page's initial state from one storage read: settings, the current week's plan and the
+    last BOOTSTRAP_HISTORY_DAYS of history, plus the ETags the matching read endpoints would
+    send so the frontend can revalidate them later with If-None-Match.
+    """
+    today = date.today()
+    week_start_date = get_current_week_start_date()
+    state = storage.get_bootstrap_state(user_id, week_start_date, BOOTSTRAP_HISTORY_DAYS)
+    versions = state.pop("versions")
+    etags = {
+        "/get_user_settings": data_validators(versions, ("settings",), "")[0],
+        f"/get_workout_history?days={BOOTSTRAP_HISTORY_DAYS}": data_validators(versions, ("history",), f"{BOOTSTRAP_HISTORY_DAYS}d@{today}")[0],
+        "/get_current_weekly_plan": data_validators(versions, ("plan",), week_start_date)[0],
+    }
+    if not state["weekly_plan"]:
+        # The plan horizon ran out; this writes a new one, so the plan ETag read above is stale
+        state["weekly_plan"] = get_or_create_current_plan(user_id, storage) or []
+        del etags["/get_current_weekly_plan"]
+    state["etags"] = {url: quote_etag(etag, weak=True) for url, etag in etags.items()}
+    return state
+
+@bp.route("/")
 def index():
     """Renders the main workout configuration page."""
-    return render_template("index.html")
+    bootstrap_state = None
+    if current_app.config["INLINE_BOOTSTRAP_STATE"]:
+        user_id = 1 # Hardcoded for now
+        try:
+            bootstrap_state = load_bootstrap_state(user_id)
+        except Exception as e:
+            # The page still works: it fetches /bootstrap when no state is inlined
+            logger.error(f"Error loading bootstrap state for index page: {e}", exc_info=True)
+    return render_template("index.html", bootstrap_state=bootstrap_state)
+
+@bp.route("/bootstrap", methods=["GET"])
+def bootstrap():
+    """Initial page state (see load_bootstrap_state) in one response."""
+    user_id = 1 # Hardcoded for now
+    try:
+        today = date.today()
+        return conditional_json(user_id, ("settings", "history", "plan"), f"bootstrap@{today}", day_start(today),
+                                lambda: load_bootstrap_state(user_id))
+    except Exception as e:
+        logger.error(f"Error loading bootstrap state: {e}", exc_info=True)
+        return jsonify({"error": "Could not load the initial page state."}), 500
+
+def store_gemini_api_key(gemini_key, user_id=None):
+    """
+    Validates the key, then saves it as user_id's own key, or as the deployment-wide key when
+    user_id is None. Raises ValueError for an invalid key.
+    """
+    # Checked without creating a client: a rejected or soon rotated key leaves nothing open
+    try:
+        check_provider_options({"gemini_api_key": gemini_key})
+        logger.info("Gemini provider validated with new key.")
+    except Exception as e:
+        logger.error(f"Failed to initialize Gemini provider with new key: {e}")
+        raise ValueError("Invalid Gemini API Key.")
 
-@app.route("/save_settings", methods=["POST"])
+    if user_id is None:
+        get_credential_store().save_global_api_key(gemini_key)
+    else:
+        get_credential_store().save_user_api_key(user_id, gemini_key)
+        logger.info(f"Gemini API Key saved for user_id {user_id}.")
+
+@bp.route("/save_settings", methods=["POST"])
 def save_settings():
     try:
         data = request.get_json()
         gemini_key = data.get("geminiApiKey")
         if not gemini_key:
             return jsonify({"error": "API key is required."}), 400
+        # "scope": "user" keeps the key for this user only; by default it is the deployment-wide key
+        user_id = 1 if data.get("scope") == "user" else None # Hardcoded user for now
 
-        config_data = {"GEMINI_API_KEY": gemini_key}
-
-        with open(USER_CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config_data, f, indent=4)
-
-        # Test the new key by initializing the provider
         try:
-            SimpleGeminiProvider({"gemini_api_key": gemini_key})
-            app.logger.info("Gemini provider validated with new key.")
-        except Exception as e:
-            app.logger.error(f"Failed to initialize Gemini provider with new key: {e}")
-            return jsonify({"error": "Invalid Gemini API Key."}), 400
+            store_gemini_api_key(gemini_key, user_id)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        app.logger.info(f"Gemini API Key saved to {USER_CONFIG_FILE}.")
         return jsonify({"message": "API Key saved successfully!"}), 200
     except Exception as e:
-        app.logger.error(f"Error saving settings: {e}", exc_info=True)
+        logger.error(f"Error saving settings: {e}", exc_info=True)
         return jsonify({"error": "An unexpected error occurred while saving settings."}), 500
 
-@app.route("/get_user_settings", methods=["GET"])
+@bp.route("/get_user_settings", methods=["GET"])
 def get_user_settings():
     # For now, we'll use a hardcoded user_id. In a real app, you'd get this from the session.
     user_id = 1
     try:
-        settings = db.get_user_settings(user_id)
-        return jsonify(settings)
+        return conditional_json(user_id, ("settings",), "", None, lambda: storage.get_user_settings(user_id))
     except Exception as e:
-        app.logger.error(f"Error getting user settings: {e}", exc_info=True)
+        logger.error(f"Error getting user settings: {e}", exc_info=True)
         return jsonify({"error": "Could not retrieve user settings."}), 500
 
-@app.route("/save_user_settings", methods=["POST"])
+@bp.route("/get_cache_stats", methods=["GET"])
+def get_cache_stats():
+    """Reports hit/miss counters for the in-process caches of this worker."""
+    return jsonify({**storage.get_cache_stats(), "credentials": get_credential_store().get_cache_stats()})
+
+@bp.route("/get_query_stats", methods=["GET"])
+def get_query_stats():
+    """Per-operation query counts and latency histograms for this worker, plus recent slow queries."""
+    return jsonify(query_stats.get_query_stats())
+
+@bp.route("/get_rate_limit_stats", methods=["GET"])
+def get_rate_limit_stats():
+    """Generations allowed, delayed and rejected (by limit) by this worker's rate limiter."""
+    return jsonify(current_app.extensions["rate_limiter"].get_stats())
+
+@bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    """The metrics in the Prometheus text format, of every worker with METRICS_MULTIPROC_DIR (see metrics.py)."""
+    return current_app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@bp.route("/save_user_settings", methods=["POST"])
 def save_user_settings():
     # For now, we'll use a hardcoded user_id.
     user_id = 1
@@ -95,52 +477,85 @@ def save_user_settings():
         if not data:
             return jsonify({"error": "Invalid request: No data provided or data is not valid JSON."}), 400
 
-        db.save_user_settings(user_id, data)
-        app.logger.info(f"User settings saved for user_id {user_id}.")
-
-        # After saving settings, generate and save the weekly plan
-        try:
-            # Ensure 'data' contains all necessary fields for generate_and_save_weekly_plan
-            # It should, as it's coming directly from the frontend settings form
-            app.logger.info(f"Attempting to generate weekly plan for user_id {user_id} with settings: {data}")
-            generate_and_save_weekly_plan(user_id, data, db.get_db_connection)
-            app.logger.info(f"Weekly plan generated and saved for user_id {user_id} after settings update.")
-        except Exception as e_plan:
-            app.logger.error(f"Error generating weekly plan after saving settings for user_id {user_id}: {e_plan}", exc_info=True)
-            # Do not fail the entire settings save if plan generation fails, but log it.
-            # Could return a partial success or a warning if desired.
-
-        return jsonify({"message": "Settings saved successfully! Weekly plan updated."}), 200
+        previous_settings = storage.get_user_settings(user_id)
+        storage.save_user_settings(user_id, data)
+        logger.info(f"User settings saved for user_id {user_id}.")
+
+        # Only frequency, goal and focus rotation changes affect the plan. Those replan in the
+        # background once the response is sent, changing just the days that differ.
+        settings = storage.get_user_settings(user_id)
+        changed = changed_plan_settings(previous_settings, settings)
+        if not changed:
+            return jsonify({"message": "Settings saved successfully!", "replan_scheduled": False}), 200
+
+        logger.info(f"Plan settings changed for user_id {user_id} ({', '.join(changed)}); scheduling a replan.")
+        response = jsonify({"message": "Settings saved successfully! Weekly plan is being updated.", "replan_scheduled": True})
+        # Bound now: by the time the response closes, the request's span is no longer current
+        response.call_on_close(tracing.bind(lambda: replan_scheduler.schedule(user_id, settings, storage)))
+        return response, 200
     except Exception as e:
-        app.logger.error(f"Error saving user settings or generating plan: {e}", exc_info=True)
+        logger.error(f"Error saving user settings: {e}", exc_info=True)
         return jsonify({"error": "An unexpected error occurred while saving settings."}), 500
 
-@app.route("/get_workout_history", methods=["GET"])
+@bp.route("/get_workout_history", methods=["GET"])
 def get_workout_history():
     # For now, we'll use a hardcoded user_id.
     user_id = 1
     try:
         days = int(request.args.get('days', 14))
-        history = db.get_workout_history(user_id, days)
-        return jsonify(history)
+        # The window moves with the date, so the ETag covers the day it was computed on
+        today = date.today()
+        return conditional_json(user_id, ("history",), f"{days}d@{today}", day_start(today),
+                                lambda: storage.get_workout_history(user_id, days))
     except Exception as e:
-        app.logger.error(f"Error getting workout history: {e}", exc_info=True)
+        logger.error(f"Error getting workout history: {e}", exc_info=True)
         return jsonify({"error": "Could not retrieve workout history."}), 500
 
-@app.route("/get_current_weekly_plan", methods=["GET"])
+@bp.route("/get_current_weekly_plan", methods=["GET"])
 def get_current_weekly_plan_route():
     user_id = 1 # Hardcoded for now
     try:
+        # Generates a fresh plan horizon from the saved settings if this week has none yet.
+        # That write bumps the plan version, so the ETag sent with it is already stale and
+        # the next request gets the plan once more before 304s start.
         week_start_date = get_current_week_start_date()
-        plan = db.get_weekly_plan(user_id, week_start_date)
-        if plan is None: # get_weekly_plan might return None or raise an exception
-            plan = []
-        return jsonify(plan)
+        return conditional_json(user_id, ("plan",), week_start_date, day_start(week_start_date),
+                                lambda: get_or_create_current_plan(user_id, storage) or [])
     except Exception as e:
-        app.logger.error(f"Error getting current weekly plan: {e}", exc_info=True)
+        logger.error(f"Error getting current weekly plan: {e}", exc_info=True)
         return jsonify({"error": "Could not retrieve weekly plan."}), 500
 
-@app.route("/generate_workout", methods=["POST"])
+@bp.route("/get_weekly_plan", methods=["GET"])
+def get_weekly_plan_route():
+    """Returns the plan for the week `week_offset` weeks from the current one (0 = this week)."""
+    user_id = 1 # Hardcoded for now
+    try:
+        week_offset = int(request.args.get('week_offset', 0))
+        current_week_start = get_current_week_start_date()
+        week_start_date = current_week_start + timedelta(weeks=week_offset)
+        if week_offset == 0:
+            load = lambda: get_or_create_current_plan(user_id, storage) or []
+        else:
+            load = lambda: storage.get_weekly_plan(user_id, week_start_date) or []
+        return conditional_json(user_id, ("plan",), f"{week_start_date}@{current_week_start}", day_start(current_week_start), load)
+    except Exception as e:
+        logger.error(f"Error getting weekly plan: {e}", exc_info=True)
+        return jsonify({"error": "Could not retrieve weekly plan."}), 500
+
+@bp.route("/get_weekly_summary", methods=["GET"])
+def get_weekly_summary_route():
+    """Returns per-week pillar and muscle rollups for the last `weeks` weeks (including this one)."""
+    user_id = 1 # Hardcoded for now
+    try:
+        weeks = max(1, min(int(request.args.get('weeks', 8)), 104))
+        end_week = get_current_week_start_date()
+        start_week = end_week - timedelta(weeks=weeks - 1)
+        return jsonify(storage.get_weekly_summaries(user_id, start_week, end_week))
+    except Exception as e:
+        logger.error(f"Error getting weekly summary: {e}", exc_info=True)
+        return jsonify({"error": "Could not retrieve weekly summary."}), 500
+
+@bp.route("/generate_workout", methods=["POST"])
 def generate_workout():
     try:
         data = request.get_json(silent=True)
@@ -148,39 +563,18 @@ def generate_workout():
             return jsonify({"error": "Invalid request: No data provided or data is not valid JSON."}), 400
 
         user_id = 1  # Hardcoded for now
-        settings = db.get_user_settings(user_id)
-        api_key = load_gemini_api_key()
+        api_key = load_gemini_api_key(user_id)
 
         if not api_key:
             return jsonify({"error": "AI service is not configured. Please save your Gemini API key in User Settings."}), 500
 
         try:
-            # Prepare user_data for the generator, mapping from request data
-
-            # Fetch recent workout history and today's planned pillar
-            recent_history_list = db.get_workout_history(user_id, days=4) # Fetch last 4 days to likely get 2-3 workouts
-
-            today_date_obj = date.today()
-            week_start_obj = get_current_week_start_date()
-            current_weekly_plan = db.get_weekly_plan(user_id, week_start_obj)
-
-            todays_plan_entry_dict = None
-            if current_weekly_plan:
-                for day_plan in current_weekly_plan:
-                    if day_plan['day_of_week'] == today_date_obj.weekday():
-                        todays_plan_entry_dict = day_plan
-                        break
-
-            todays_planned_pillar_str = f"Today's Planned Pillar: {todays_plan_entry_dict['pillar_focus']}" if todays_plan_entry_dict else "Today's Planned Pillar: Not specifically planned (User selected)."
-
-            history_summary_parts = []
-            if recent_history_list:
-                for entry in recent_history_list[:3]: # Max 3 entries
-                    muscles = ', '.join(entry['muscles_worked']) if isinstance(entry['muscles_worked'], list) else entry['muscles_worked']
-                    history_summary_parts.append(f"- {entry['workout_date'][:10]}: {entry['pillar']}, Focus: {entry['focus']}, Muscles: {muscles}")
-
-            recent_history_str = "Recent Training History (last few sessions):\n" + "\n".join(history_summary_parts) if history_summary_parts else "Recent Training History: No recent workouts logged."
+            # Settings, today's planned pillar and recent history (last 4 days, max 3 sessions)
+            # are read together in a single read transaction.
+            with metrics.time_stage("context"):
+                context = storage.get_generation_context(user_id)
 
+            # Prepare user_data for the generator, mapping from request data
             user_data_for_generator = {
                 "workout_pillar": data.get("workout_pillar"),
                 "strength_style": data.get("strength_style"),
@@ -188,39 +582,58 @@ def generate_workout():
                 "equipment": data.get("equipment"),
                 "focus": data.get("focus"),
                 "userNotes": data.get("userNotes"),
-                "todays_planned_pillar": todays_planned_pillar_str, # Added
-                "recent_history": recent_history_str # Added
+                "todays_planned_pillar": context.todays_planned_pillar,
+                "recent_history": context.recent_history
             }
-            app.logger.info(f"Data passed to workout generator: {user_data_for_generator}")
-
-            workout_data = generate_workout_plan(user_data_for_generator, settings, api_key)
+            log_payload(logger, logging.INFO, "Data passed to workout generator", user_data_for_generator, user_id=user_id)
+
+            # Counted so a shutting-down worker finishes this call before it exits. Within that,
+            # the rate limiter may hold the request for its turn (or reject it with 429).
+            model_id = context.settings.get('ai_model_id', DEFAULT_MODEL_ID)
+            with current_app.extensions["generations"].track():
+                with tracing.span("rate_limit", model=model_id), metrics.time_stage("rate_limit"):
+                    release = current_app.extensions["rate_limiter"].acquire(user_id, model_id)
+                try:
+                    workout_data = current_app.config["GENERATE_WORKOUT"](user_data_for_generator, context.settings, api_key)
+                finally:
+                    release()
             
             # Save the generated workout to history
             # workout_data["pillar"] from the generator now correctly reflects the actual pillar
             # (e.g., "Strength", "Zone2 Cardio")
-            db.save_workout_to_history(
-                user_id,
-                workout_data["pillar"], # This should be the actual pillar like "Strength", "Zone2 Cardio"
-                workout_data["focus"],
-                workout_data["muscles_worked"],
-                workout_data["workout_text"]
-            )
-            app.logger.info(f"Workout saved to history for user {user_id}. Pillar: {workout_data['pillar']}, Focus: {workout_data['focus']}")
+            with metrics.time_stage("save"):
+                storage.save_workout_to_history(
+                    user_id,
+                    workout_data["pillar"], # This should be the actual pillar like "Strength", "Zone2 Cardio"
+                    workout_data["focus"],
+                    workout_data["muscles_worked"],
+                    workout_data["workout_text"]
+                )
+            logger.info(f"Workout saved to history for user {user_id}. Pillar: {workout_data['pillar']}, Focus: {workout_data['focus']}")
             
             return jsonify(workout_data)
 
+        except rate_limit.RateLimited as e:
+            logger.warning(f"Workout generation for user {user_id} rate limited: {e}")
+            response = jsonify({"error": "Too many workout requests. Please try again shortly.", "retry_after": int(e.retry_after_header)})
+            response.headers["Retry-After"] = e.retry_after_header
+            return response, 429
+        except DrainingError:
+            response = jsonify({"error": "The server is restarting. Please try again in a few seconds."})
+            response.headers["Retry-After"] = str(DRAIN_RETRY_AFTER)
+            return response, 503
         except ValueError as e:
-            app.logger.error(f"Workout generation failed: {e}")
+            logger.error(f"Workout generation failed: {e}")
             return jsonify({"error": str(e)}), 500
         except Exception as e:
-            app.logger.error(f"An unexpected error occurred in generate_workout: {e}", exc_info=True)
+            logger.error(f"An unexpected error occurred in generate_workout: {e}", exc_info=True)
             return jsonify({"error": "An unexpected error occurred. Please try again."}), 500
 
     except Exception as e:
-        app.logger.error(f"An unexpected error occurred in generate_workout: {e}", exc_info=True)
+        logger.error(f"An unexpected error occurred in generate_workout: {e}", exc_info=True)
         return jsonify({"error": "An unexpected error occurred. Please try again."}), 500
 
-@app.route("/save_workout", methods=["POST"])
+@bp.route("/save_workout", methods=["POST"])
 def save_workout():
     user_id = 1 # Hardcoded for now
     try:
@@ -233,22 +646,22 @@ def save_workout():
         if not all([pillar, focus, muscles_worked, full_workout_text]):
             return jsonify({"error": "Missing required workout data."}), 400
 
-        db.save_workout_to_history(user_id, pillar, focus, muscles_worked, full_workout_text)
+        storage.save_workout_to_history(user_id, pillar, focus, muscles_worked, full_workout_text)
         return jsonify({"message": "Workout saved successfully!"}), 200
     except Exception as e:
-        app.logger.error(f"Error saving workout: {e}", exc_info=True)
+        logger.error(f"Error saving workout: {e}", exc_info=True)
         return jsonify({"error": "Could not save workout."}), 500
 
-@app.route("/delete_workout/<int:workout_id>", methods=["DELETE"])
+@bp.route("/delete_workout/<int:workout_id>", methods=["DELETE"])
 def delete_workout(workout_id):
     user_id = 1 # Hardcoded for now, in a real app, you'd verify ownership
     try:
-        db.delete_workout_from_history(workout_id)
-        app.logger.info(f"Workout with ID {workout_id} deleted for user {user_id}.")
+        storage.delete_workout_from_history(workout_id, user_id)
+        logger.info(f"Workout with ID {workout_id} deleted for user {user_id}.")
         return jsonify({"message": "Workout deleted successfully!"}), 200
     except Exception as e:
-        app.logger.error(f"Error deleting workout {workout_id}: {e}", exc_info=True)
+        logger.error(f"Error deleting workout {workout_id}: {e}", exc_info=True)
         return jsonify({"error": "Could not delete workout."}), 500
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,219 @@
+"""
+Tiered retention for workout_history.
+
+Entries older than the retention age are moved from the main database into an
+attached archive database (optionally with zlib-compressed workout texts), so the
+hot table only holds recent sessions. Reads that need the full history go through
+the workout_history_all view, which unions both tiers and decompresses on the fly.
+
+Each user-data database has its own archive file, by default ARCHIVE_DB_FILE in the same
+directory as that database (see archive_path_for), so moving the database (DB_FILE,
+manage.py --db) moves its archive along.
+"""
+import os
+import json
+import zlib
+import logging
+import sqlite3
+from datetime import datetime, timedelta
+import database
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DB_FILE = "training_archive.db" # File name, in the directory of the database it archives
+ARCHIVE_SCHEMA = "archive" # Name the archive database is attached under
+DEFAULT_RETENTION_DAYS = int(os.getenv("WORKOUT_HISTORY_RETENTION_DAYS", 180))
+
+def _compress_text(text):
+    return zlib.compress(text.encode("utf-8")) if text is not None else None
+
+def _decompress_text(blob):
+    if blob is None or isinstance(blob, str):
+        return blob
+    return zlib.decompress(blob).decode("utf-8")
+
+def attach_archive(conn, archive_path=None):
+    """
+    Attaches the archive database to an open connection, creating its table on first use,
+    and defines the temporary workout_history_all view spanning both tiers. archive_path
+    defaults to the archive of DB_FILE.
+    """
+    archive_path = archive_path or archive_path_for(database.DB_FILE)
+    attached = [row[1] for row in conn.execute("PRAGMA database_list").fetchall()]
+    if ARCHIVE_SCHEMA not in attached:
+        conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (archive_path,))
+
+    conn.create_function("compress_text", 1, _compress_text, deterministic=True)
+    conn.create_function("decompress_text", 1, _decompress_text, deterministic=True)
+
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.workout_history_archive (
+        id INTEGER PRIMARY KEY,      -- Same id the entry had in workout_history
+        user_id INTEGER NOT NULL,
+        workout_date TIMESTAMP,
+        pillar TEXT NOT NULL,
+        focus TEXT NOT NULL,
+        muscles_worked TEXT,
+        full_workout_text,           -- TEXT, or a zlib BLOB when compressed = 1
+        compressed INTEGER NOT NULL DEFAULT 0,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_user_date ON workout_history_archive (user_id, workout_date)")
+
+    # Views in the main schema cannot reference attached databases, so the union view is TEMP
+    conn.execute(f'''
+    CREATE TEMP VIEW IF NOT EXISTS workout_history_all AS
+        SELECT id, user_id, workout_date, pillar, focus, muscles_worked, full_workout_text, 0 AS archived
+        FROM main.workout_history
+        UNION ALL
+        SELECT id, user_id, workout_date, pillar, focus, muscles_worked,
+               CASE WHEN compressed THEN decompress_text(full_workout_text) ELSE full_workout_text END,
+               1 AS archived
+        FROM {ARCHIVE_SCHEMA}.workout_history_archive
+    ''')
+    return conn
+
+def archive_path_for(db_path, archive_path=None):
+    """
+    Archive file for the user-data database at db_path. By default that is ARCHIVE_DB_FILE
+    next to it, so with shards each shard's archive sits in the shard directory, e.g.
+    shards/training_archive_shard_003.db. An explicit archive_path is used as it is when
+    unsharded; with shards it is the base name the shard's name is added to.
+    """
+    if archive_path is None:
+        archive_path = os.path.join(os.path.dirname(db_path), ARCHIVE_DB_FILE)
+    if not database.SHARD_COUNT:
+        return archive_path
+    base, ext = os.path.splitext(archive_path)
+    shard_name = os.path.splitext(os.path.basename(db_path))[0]
+    return f"{base}_{shard_name}{ext or '.db'}"
+
+def _cutoff_for(older_than_days, now=None):
+    return (now or datetime.now()) - timedelta(days=older_than_days)
+
+def _merge_reports(reports):
+    """Combines per-shard reports; counters add up, date bounds widen."""
+    merged = dict(reports[0])
+    for report in reports[1:]:
+        for key in ('entries', 'users', 'text_bytes', 'total_entries', 'archived', 'reclaimed_pages'):
+            if key in merged:
+                merged[key] += report[key]
+        if report['oldest'] is not None:
+            merged['oldest'] = min(filter(None, [merged['oldest'], report['oldest']]))
+        if report['newest'] is not None:
+            merged['newest'] = max(filter(None, [merged['newest'], report['newest']]))
+    merged['shards'] = len(reports)
+    return merged
+
+def archival_report(older_than_days=DEFAULT_RETENTION_DAYS, conn=None, now=None):
+    """
+    Describes what an archival run would move, without changing anything.
+    Without a connection the report covers every shard.
+    """
+    if conn is None:
+        return _merge_reports(database.for_each_shard(
+            lambda shard_conn, path: archival_report(older_than_days, conn=shard_conn, now=now)))
+
+    cutoff = _cutoff_for(older_than_days, now)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COUNT(*) AS entries,
+               COUNT(DISTINCT user_id) AS users,
+               COALESCE(SUM(LENGTH(full_workout_text)), 0) AS text_bytes,
+               MIN(workout_date) AS oldest,
+               MAX(workout_date) AS newest
+        FROM workout_history
+        WHERE workout_date < ?
+    ''', (cutoff,))
+    report = dict(cursor.fetchone())
+    cursor.execute("SELECT COUNT(*) FROM workout_history")
+    report['total_entries'] = cursor.fetchone()[0]
+    report['cutoff'] = cutoff.isoformat(sep=' ')
+    report['older_than_days'] = older_than_days
+    return report
+
+def archive_workout_history(older_than_days=DEFAULT_RETENTION_DAYS, compress=False, dry_run=False,
+                            archive_path=None, vacuum_pages=None, now=None):
+    """
+    Moves workout_history entries older than older_than_days into the archive database in
+    one transaction, then reclaims the freed pages with an incremental vacuum.
+    vacuum_pages limits how many pages are released in this run (None releases all).
+    When sharded, each shard is archived into its own archive file (see archive_path_for).
+    Returns the archival report, with 'archived' and 'reclaimed_pages' filled in.
+    """
+    def archive_shard(conn, db_path):
+        return _archive_database(conn, archive_path_for(db_path, archive_path), older_than_days,
+                                 compress, dry_run, vacuum_pages, now)
+    return _merge_reports(database.for_each_shard(archive_shard))
+
+def _archive_database(conn, archive_path, older_than_days, compress, dry_run, vacuum_pages, now):
+    report = archival_report(older_than_days, conn=conn, now=now)
+    report['dry_run'] = dry_run
+    report['compressed'] = compress
+    report['archived'] = 0
+    report['reclaimed_pages'] = 0
+    if dry_run or report['entries'] == 0:
+        return report
+
+    attach_archive(conn, archive_path)
+    cutoff = _cutoff_for(older_than_days, now)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f'''
+            INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.workout_history_archive
+                (id, user_id, workout_date, pillar, focus, muscles_worked, full_workout_text, compressed)
+            SELECT id, user_id, workout_date, pillar, focus, muscles_worked,
+                   CASE WHEN :compress THEN compress_text(full_workout_text) ELSE full_workout_text END,
+                   :compress
+            FROM main.workout_history
+            WHERE workout_date < :cutoff
+        ''', {"compress": 1 if compress else 0, "cutoff": cutoff})
+        # The flag keeps the weekly_summary delete trigger from un-counting archived sessions
+        conn.execute("INSERT OR IGNORE INTO main.maintenance_flags (name) VALUES ('archiving')")
+        cursor = conn.execute("DELETE FROM main.workout_history WHERE workout_date < ?", (cutoff,))
+        report['archived'] = cursor.rowcount
+        conn.execute("DELETE FROM main.maintenance_flags WHERE name = 'archiving'")
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error during archival: {e}")
+        conn.rollback()
+        raise
+
+    freelist_before = conn.execute("PRAGMA main.freelist_count").fetchone()[0]
+    if vacuum_pages:
+        conn.execute(f"PRAGMA main.incremental_vacuum({int(vacuum_pages)})").fetchall()
+    else:
+        conn.execute("PRAGMA main.incremental_vacuum").fetchall() # Each result row frees a page
+    freelist_after = conn.execute("PRAGMA main.freelist_count").fetchone()[0]
+    report['reclaimed_pages'] = freelist_before - freelist_after
+    return report
+
+def get_full_workout_history(user_id, start_date=None, end_date=None, archive_path=None):
+    """Returns history entries from both tiers, newest first, optionally bounded by date."""
+    conn = database.get_db_connection(user_id)
+    try:
+        attach_archive(conn, archive_path_for(database.get_db_path(user_id), archive_path))
+        conditions = ["user_id = ?"]
+        params = [user_id]
+        if start_date is not None:
+            conditions.append("workout_date >= ?")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("workout_date < ?")
+            params.append(end_date)
+        cursor = conn.execute(f'''
+            SELECT id, pillar, focus, muscles_worked, workout_date, full_workout_text, archived
+            FROM workout_history_all
+            WHERE {" AND ".join(conditions)}
+            ORDER BY workout_date DESC
+        ''', params)
+        history = []
+        for row in cursor.fetchall():
+            entry = dict(row)
+            entry['muscles_worked'] = json.loads(entry['muscles_worked']) if entry['muscles_worked'] else []
+            entry['archived'] = bool(entry['archived'])
+            history.append(entry)
+        return history
+    finally:
+        conn.close()
@@ -0,0 +1,267 @@
+"""
+Async (ASGI) variant of the MVP Workout Generator, built on Quart.
+
+Serves the same routes as app.py, but database access goes through aiosqlite
+(async_database.py) and the Gemini call is awaited, so one process can hold many
+in-flight generations instead of one per thread. The Flask app in app.py remains
+the default entry point; run this one with an ASGI server, e.g.:
+
+    hypercorn asgi_app:app --bind 127.0.0.1:5000
+"""
+import asyncio
+from datetime import date
+from quart import Quart, request, jsonify, render_template, g, after_this_request
+import async_database as adb
+from app import (load_gemini_api_key, get_current_week_start_date, store_gemini_api_key,
+                 data_validators, is_not_modified, set_validators, day_start,
+                 load_bootstrap_state, INLINE_BOOTSTRAP_STATE)
+from weekly_planner import get_or_create_current_plan, changed_plan_settings, replan_scheduler
+from storage import get_storage
+from credentials import get_credential_store
+from workout_generator import generate_workout_plan_async
+from ai_provider import DEFAULT_MODEL_ID
+from rate_limit import RateLimiter, RateLimited
+import database as db
+import metrics
+import tracing
+import logging_config
+
+app = Quart(__name__)
+rate_limiter = RateLimiter() # Limits from GEMINI_MODELS and the RATE_LIMIT_* environment
+
+@app.before_serving
+async def setup():
+    logging_config.configure_logging()
+    await asyncio.to_thread(db.setup_database)
+
+@app.before_request
+async def start_trace():
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    g.trace = tracing.begin_trace(f"{request.method} {route}", request.headers.get("traceparent"),
+                                  **{"http.method": request.method, "http.route": route})
+
+@app.after_request
+async def add_trace_header(response):
+    root, _ = g.get("trace", (None, None))
+    if root is not None:
+        response.headers[tracing.TRACE_ID_HEADER] = root.trace_id
+        root.set_attribute("http.status_code", response.status_code)
+    return response
+
+@app.teardown_request
+async def end_trace(exc):
+    root, token = g.pop("trace", (None, None))
+    tracing.end_trace(root, token, exc)
+
+async def conditional_json(user_id, kinds, scope, scope_start, load):
+    """Async twin of app.conditional_json: 304 when the client is current, else jsonify(await load())."""
+    etag, last_modified = data_validators(await adb.get_data_versions(user_id), kinds, scope, scope_start)
+    if is_not_modified(request, etag, last_modified):
+        return set_validators(app.response_class("", status=304), etag, last_modified)
+    return set_validators(jsonify(await load()), etag, last_modified)
+
+@app.route("/")
+async def index():
+    """Renders the main workout configuration page."""
+    bootstrap_state = None
+    if INLINE_BOOTSTRAP_STATE:
+        try:
+            bootstrap_state = await asyncio.to_thread(load_bootstrap_state, 1) # Hardcoded user for now
+        except Exception as e:
+            app.logger.error(f"Error loading bootstrap state for index page: {e}", exc_info=True)
+    return await render_template("index.html", bootstrap_state=bootstrap_state)
+
+@app.route("/bootstrap", methods=["GET"])
+async def bootstrap():
+    user_id = 1 # Hardcoded for now
+    try:
+        today = date.today()
+        return await conditional_json(user_id, ("settings", "history", "plan"), f"bootstrap@{today}", day_start(today),
+                                      lambda: asyncio.to_thread(load_bootstrap_state, user_id))
+    except Exception as e:
+        app.logger.error(f"Error loading bootstrap state: {e}", exc_info=True)
+        return jsonify({"error": "Could not load the initial page state."}), 500
+
+@app.route("/save_settings", methods=["POST"])
+async def save_settings():
+    try:
+        data = await request.get_json(silent=True) or {}
+        gemini_key = data.get("geminiApiKey")
+        if not gemini_key:
+            return jsonify({"error": "API key is required."}), 400
+        user_id = 1 if data.get("scope") == "user" else None # Hardcoded user for now
+
+        try:
+            # Writing the key and validating the provider are short blocking calls
+            await asyncio.to_thread(store_gemini_api_key, gemini_key, user_id)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        return jsonify({"message": "API Key saved successfully!"}), 200
+    except Exception as e:
+        app.logger.error(f"Error saving settings: {e}", exc_info=True)
+        return jsonify({"error": "An unexpected error occurred while saving settings."}), 500
+
+@app.route("/get_user_settings", methods=["GET"])
+async def get_user_settings():
+    user_id = 1 # Hardcoded for now
+    try:
+        return await conditional_json(user_id, ("settings",), "", None, lambda: adb.get_user_settings(user_id))
+    except Exception as e:
+        app.logger.error(f"Error getting user settings: {e}", exc_info=True)
+        return jsonify({"error": "Could not retrieve user settings."}), 500
+
+@app.route("/get_cache_stats", methods=["GET"])
+async def get_cache_stats():
+    return jsonify({"user_settings": db.get_settings_cache_stats(), "credentials": get_credential_store().get_cache_stats()})
+
+@app.route("/metrics", methods=["GET"])
+async def get_metrics():
+    # AI call and generation stage metrics; request latency is only recorded by app.py's hooks
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+@app.route("/save_user_settings", methods=["POST"])
+async def save_user_settings():
+    user_id = 1 # Hardcoded for now
+    try:
+        data = await request.get_json(silent=True)
+        if not data:
+            return jsonify({"error": "Invalid request: No data provided or data is not valid JSON."}), 400
+
+        previous_settings = await adb.get_user_settings(user_id)
+        await adb.save_user_settings(user_id, data)
+        app.logger.info(f"User settings saved for user_id {user_id}.")
+
+        settings = await adb.get_user_settings(user_id)
+        changed = changed_plan_settings(previous_settings, settings)
+        if not changed:
+            return jsonify({"message": "Settings saved successfully!", "replan_scheduled": False}), 200
+
+        # Runs on the replan thread once the response is ready, as in app.py. Bound now, so the
+        # replan's spans join this request's trace.
+        app.logger.info(f"Plan settings changed for user_id {user_id} ({', '.join(changed)}); scheduling a replan.")
+        schedule_replan = tracing.bind(lambda: replan_scheduler.schedule(user_id, settings, get_storage()))
+
+        @after_this_request
+        async def replan_after_response(response):
+            schedule_replan()
+            return response
+
+        return jsonify({"message": "Settings saved successfully! Weekly plan is being updated.", "replan_scheduled": True}), 200
+    except Exception as e:
+        app.logger.error(f"Error saving user settings: {e}", exc_info=True)
+        return jsonify({"error": "An unexpected error occurred while saving settings."}), 500
+
+@app.route("/get_workout_history", methods=["GET"])
+async def get_workout_history():
+    user_id = 1 # Hardcoded for now
+    try:
+        days = int(request.args.get('days', 14))
+        today = date.today()
+        return await conditional_json(user_id, ("history",), f"{days}d@{today}", day_start(today),
+                                      lambda: adb.get_workout_history(user_id, days))
+    except Exception as e:
+        app.logger.error(f"Error getting workout history: {e}", exc_info=True)
+        return jsonify({"error": "Could not retrieve workout history."}), 500
+
+@app.route("/get_current_weekly_plan", methods=["GET"])
+async def get_current_weekly_plan_route():
+    user_id = 1 # Hardcoded for now
+    try:
+        week_start_date = get_current_week_start_date()
+
+        async def load():
+            plan = await adb.get_weekly_plan(user_id, week_start_date)
+            if not plan:
+                # The plan horizon ran out; generate a new one from the saved settings
+                plan = await asyncio.to_thread(get_or_create_current_plan, user_id, get_storage())
+            return plan or []
+        return await conditional_json(user_id, ("plan",), week_start_date, day_start(week_start_date), load)
+    except Exception as e:
+        app.logger.error(f"Error getting current weekly plan: {e}", exc_info=True)
+        return jsonify({"error": "Could not retrieve weekly plan."}), 500
+
+@app.route("/generate_workout", methods=["POST"])
+async def generate_workout():
+    data = await request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Invalid request: No data provided or data is not valid JSON."}), 400
+
+    user_id = 1 # Hardcoded for now
+    api_key = await asyncio.to_thread(load_gemini_api_key, user_id) # Usually cached; a miss reads the database
+    if not api_key:
+        return jsonify({"error": "AI service is not configured. Please save your Gemini API key in User Settings."}), 500
+
+    try:
+        context = await adb.get_generation_context(user_id)
+        user_data_for_generator = {
+            "workout_pillar": data.get("workout_pillar"),
+            "strength_style": data.get("strength_style"),
+            "experience": data.get("experience"),
+            "equipment": data.get("equipment"),
+            "focus": data.get("focus"),
+            "userNotes": data.get("userNotes"),
+            "todays_planned_pillar": context.todays_planned_pillar,
+            "recent_history": context.recent_history
+        }
+        model_id = context.settings.get('ai_model_id', DEFAULT_MODEL_ID)
+        with tracing.span("rate_limit", model=model_id):
+            release = await rate_limiter.acquire_async(user_id, model_id)
+        try:
+            workout_data = await generate_workout_plan_async(user_data_for_generator, context.settings, api_key)
+        finally:
+            release()
+
+        await adb.save_workout_to_history(
+            user_id,
+            workout_data["pillar"],
+            workout_data["focus"],
+            workout_data["muscles_worked"],
+            workout_data["workout_text"]
+        )
+        app.logger.info(f"Workout saved to history for user {user_id}. Pillar: {workout_data['pillar']}, Focus: {workout_data['focus']}")
+        return jsonify(workout_data)
+    except RateLimited as e:
+        app.logger.warning(f"Workout generation for user {user_id} rate limited: {e}")
+        response = jsonify({"error": "Too many workout requests. Please try again shortly.", "retry_after": int(e.retry_after_header)})
+        response.headers["Retry-After"] = e.retry_after_header
+        return response, 429
+    except ValueError as e:
+        app.logger.error(f"Workout generation failed: {e}")
+        return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        app.logger.error(f"An unexpected error occurred in generate_workout: {e}", exc_info=True)
+        return jsonify({"error": "An unexpected error occurred. Please try again."}), 500
+
+@app.route("/save_workout", methods=["POST"])
+async def save_workout():
+    user_id = 1 # Hardcoded for now
+    try:
+        data = await request.get_json(silent=True) or {}
+        pillar = data.get("pillar")
+        focus = data.get("focus")
+        muscles_worked = data.get("muscles_worked")
+        full_workout_text = data.get("full_workout_text")
+
+        if not all([pillar, focus, muscles_worked, full_workout_text]):
+            return jsonify({"error": "Missing required workout data."}), 400
+
+        await adb.save_workout_to_history(user_id, pillar, focus, muscles_worked, full_workout_text)
+        return jsonify({"message": "Workout saved successfully!"}), 200
+    except Exception as e:
+        app.logger.error(f"Error saving workout: {e}", exc_info=True)
+        return jsonify({"error": "Could not save workout."}), 500
+
+@app.route("/delete_workout/<int:workout_id>", methods=["DELETE"])
+async def delete_workout(workout_id):
+    user_id = 1 # Hardcoded for now, in a real app, you'd verify ownership
+    try:
+        await adb.delete_workout_from_history(workout_id, user_id)
+        app.logger.info(f"Workout with ID {workout_id} deleted for user {user_id}.")
+        return jsonify({"message": "Workout deleted successfully!"}), 200
+    except Exception as e:
+        app.logger.error(f"Error deleting workout {workout_id}: {e}", exc_info=True)
+        return jsonify({"error": "Could not delete workout."}), 500
+
+if __name__ == "__main__":
+    app.run(debug=True)
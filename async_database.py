@@ -0,0 +1,139 @@
+"""
+Async counterparts of the database.py functions used by the ASGI app (asgi_app.py).
+
+Queries, row parsing and the settings cache are shared with database.py; only the
+connection handling differs, using aiosqlite so the event loop is never blocked on SQLite.
+"""
+import json
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime, timedelta, date
+import aiosqlite
+import database
+
+logger = logging.getLogger(__name__)
+
+async def get_db_connection(user_id=None):
+    """Connection to the database holding user_id's data (see database.get_db_path)."""
+    if database.SHARD_COUNT and user_id is not None and user_id not in database._shard_placement_cache:
+        # A user's first shard lookup queries (and may write) the catalog: keep it off the event loop.
+        # After that the placement is cached and get_db_path does no I/O.
+        db_path = await asyncio.to_thread(database.get_db_path, user_id)
+    else:
+        db_path = database.get_db_path(user_id)
+    conn = await aiosqlite.connect(db_path)
+    conn.row_factory = sqlite3.Row # Allows accessing columns by name
+    return conn
+
+async def _get_user_settings_cached(conn, user_id):
+    async with conn.execute(database.SETTINGS_VERSION_QUERY, (user_id,)) as cursor:
+        version_row = await cursor.fetchone()
+    cached_settings = database._settings_cache_lookup(user_id, version_row)
+    if cached_settings is not None:
+        return cached_settings
+
+    async with conn.execute(database.USER_SETTINGS_QUERY, (user_id,)) as cursor:
+        settings_row = await cursor.fetchone()
+    settings_version, settings = database._parse_settings_row(settings_row)
+    return database._settings_cache_store(user_id, settings_version, settings)
+
+async def get_user_settings(user_id):
+    conn = await get_db_connection(user_id)
+    try:
+        return await _get_user_settings_cached(conn, user_id)
+    finally:
+        await conn.close()
+
+async def save_user_settings(user_id, settings_dict):
+    conn = await get_db_connection(user_id)
+    try:
+        async with conn.execute("SELECT id FROM user_settings WHERE user_id = ?", (user_id,)) as cursor:
+            existing_setting = await cursor.fetchone()
+        sql, params = database._settings_write_statement(user_id, settings_dict, existing_setting is not None)
+        await conn.execute(sql, params)
+        await conn.commit()
+        database.invalidate_settings_cache(user_id)
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {e}")
+        await conn.rollback()
+        raise
+    finally:
+        await conn.close()
+
+async def get_data_versions(user_id):
+    conn = await get_db_connection(user_id)
+    try:
+        async with conn.execute(database.DATA_VERSIONS_QUERY, (user_id,)) as cursor:
+            rows = await cursor.fetchall()
+        return database._data_versions_from_rows(rows)
+    finally:
+        await conn.close()
+
+async def save_workout_to_history(user_id, pillar, focus, muscles_worked, full_workout_text):
+    if database.WRITE_BATCHING:
+        # The group-commit writer is thread based; await its future without blocking the loop
+        future = database.submit_workout_to_history(user_id, pillar, focus, muscles_worked, full_workout_text)
+        return await asyncio.wrap_future(future)
+
+    conn = await get_db_connection(user_id)
+    try:
+        cursor = await conn.execute(database.INSERT_WORKOUT_SQL, (user_id, datetime.now(), pillar, focus, json.dumps(muscles_worked), full_workout_text))
+        await conn.commit()
+        return cursor.lastrowid
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {e}")
+        await conn.rollback()
+        raise
+    finally:
+        await conn.close()
+
+async def get_workout_history(user_id, days=14):
+    conn = await get_db_connection(user_id)
+    try:
+        start_date = datetime.now() - timedelta(days=days)
+        async with conn.execute(database.WORKOUT_HISTORY_QUERY, (user_id, start_date)) as cursor:
+            rows = await cursor.fetchall()
+        return [database._history_row_to_entry(row) for row in rows]
+    finally:
+        await conn.close()
+
+async def delete_workout_from_history(workout_id, user_id=None):
+    conn = await get_db_connection(user_id)
+    try:
+        if user_id is not None:
+            await conn.execute("DELETE FROM workout_history WHERE id = ? AND user_id = ?", (workout_id, user_id))
+        else:
+            await conn.execute("DELETE FROM workout_history WHERE id = ?", (workout_id,))
+        await conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {e}")
+        await conn.rollback()
+        raise
+    finally:
+        await conn.close()
+
+async def get_weekly_plan(user_id, week_start_date):
+    iso_week_start_date = week_start_date.isoformat() if isinstance(week_start_date, date) else week_start_date
+    conn = await get_db_connection(user_id)
+    try:
+        async with conn.execute(database.WEEKLY_PLAN_QUERY, (user_id, iso_week_start_date)) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+    finally:
+        await conn.close()
+
+async def get_generation_context(user_id, today=None, history_days=4, history_limit=3):
+    """Async version of database.get_generation_context (one connection, one read transaction)."""
+    plan_params, sessions_params = database._generation_context_params(user_id, today, history_days, history_limit)
+    conn = await get_db_connection(user_id)
+    try:
+        await conn.execute("BEGIN")
+        settings = await _get_user_settings_cached(conn, user_id)
+        async with conn.execute(database.TODAYS_PLAN_QUERY, plan_params) as cursor:
+            plan_row = await cursor.fetchone()
+        async with conn.execute(database.RECENT_SESSIONS_QUERY, sessions_params) as cursor:
+            session_rows = await cursor.fetchall()
+        await conn.rollback()
+    finally:
+        await conn.close()
+    return database._build_generation_context(user_id, settings, plan_row, session_rows)
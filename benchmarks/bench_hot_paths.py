@@ -0,0 +1,202 @@
+"""
+Microbenchmarks for the generator, planner and database hot paths.
+
+Cases:
+* generate_workout_plan[pillar/style/experience]: every combination the form offers (strength
+  style only applies to Strength), with the AI provider stubbed. This covers prompt building and
+  parsing the reply.
+* generate_and_save_weekly_plan: a week's plan built and saved.
+* get_workout_history[N]: the app's 14-day history read. The user has N rows of history spread
+  over the past year, so the table size is what varies.
+* save_workout_to_history: one insert and commit.
+* settings_round_trip: save_user_settings followed by get_user_settings.
+
+The database cases run on SQLite in a temporary directory, with this process's configuration
+(DB_WRITE_BATCHING, DB_SETTINGS_CACHE etc., see database.py). Logging below WARNING and
+print() output from the code under test are suppressed. Each case is calibrated to run
+for at least --min-time seconds per round. The best (minimum) time per call over --repeat rounds
+is reported with the median. Noise from other processes, frequency scaling etc. only ever adds
+time, so the minimum is the stable figure to compare.
+
+Regression check, for CI or before a release: with --baseline, a case more than --tolerance
+slower than its saved best time fails the run (exit status 1). Cases found slower are measured
+again after all the others, up to --retries times, and only fail if they stay slower in every
+measurement.
+--save-baseline writes the current best times. Timings only compare on one machine, so record
+the baseline in the same job that checks against it, from the commit being compared with:
+
+    git checkout <base> && python benchmarks/bench_hot_paths.py --save-baseline /tmp/hot_paths.json
+    git checkout <head> && python benchmarks/bench_hot_paths.py --baseline /tmp/hot_paths.json
+
+Usage:
+    python benchmarks/bench_hot_paths.py [--filter history] [--history-rows 10 1000 100000]
+        [--repeat 7] [--min-time 0.2] [--baseline FILE] [--tolerance 0.25] [--retries 2]
+        [--save-baseline FILE]
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import database
+import workout_generator
+from storage import SQLiteStorage
+from weekly_planner import generate_and_save_weekly_plan
+
+PILLARS = ["Strength", "Zone2 Cardio", "HIIT", "Stability/Mobility"]
+STRENGTH_STYLES = ["Build Muscle", "Get Stronger", "General Fitness"]
+EXPERIENCE_LEVELS = ["Beginner", "Intermediate", "Advanced"]
+SETTINGS = {"strength_freq": 3, "zone2_freq": 2, "hiit_freq": 1, "stability_freq": 1,
+            "primary_goal": "Balanced Fitness", "workout_duration_preference": "45-60 minutes"}
+WORKOUT_TEXT = "## Warm-up\n- 5 min easy cardio\n\n## Main Workout\n" + "\n".join(
+    f"- **Exercise {i}**: 4 sets x 8 reps @ RPE 8, rest 120s" for i in range(6)) + "\n\n## Cool-down\n- 5 min walk"
+REPLY = SimpleNamespace(text=json.dumps({"workout_text": WORKOUT_TEXT, "muscles_worked": ["Quads", "Glutes"]}),
+                        usage_metadata=None)
+STUB_PROVIDER = SimpleNamespace(model=SimpleNamespace(generate_content=lambda prompt: REPLY))
+
+def generation_cases():
+    """(name, callable) for every pillar/style/experience combination."""
+    recent_history = "\n".join(f"- {day} days ago: Strength (Lower Body)" for day in (1, 2, 4))
+    for pillar in PILLARS:
+        for style in STRENGTH_STYLES if pillar == "Strength" else [None]:
+            for experience in EXPERIENCE_LEVELS:
+                user_data = {"workout_pillar": pillar, "strength_style": style, "experience": experience,
+                             "equipment": ["Dumbbells", "Barbell"], "focus": "Full Body", "userNotes": "Short on time.",
+                             "todays_planned_pillar": pillar, "recent_history": recent_history}
+                label = "/".join(part for part in (pillar, style, experience) if part)
+                yield (f"generate_workout_plan[{label}]",
+                       lambda user_data=user_data: workout_generator.generate_workout_plan(user_data, SETTINGS, "stub-key"))
+
+def seed_history(user_id, rows):
+    """rows history entries for user_id, evenly spread over the past year, in one transaction."""
+    now = datetime.now()
+    step = timedelta(days=365) / max(rows, 1)
+    params = [(user_id, now - step * i, PILLARS[i % 4], "Full Body", '["Quads", "Glutes"]', WORKOUT_TEXT)
+              for i in range(rows)]
+    conn = database.get_db_connection(user_id)
+    with conn:
+        conn.executemany(database.INSERT_WORKOUT_SQL, params)
+    conn.close()
+
+def database_cases(history_rows):
+    """(name, callable) for the database and planner cases; expects a set-up database."""
+    storage = SQLiteStorage()
+    user_id = database.create_user("bench_planner")
+    yield "generate_and_save_weekly_plan", lambda: generate_and_save_weekly_plan(user_id, SETTINGS, storage)
+
+    for rows in history_rows:
+        history_user = database.create_user(f"bench_history_{rows}")
+        seed_history(history_user, rows)
+        yield f"get_workout_history[{rows}]", lambda history_user=history_user: database.get_workout_history(history_user, 14)
+
+    writer = database.create_user("bench_writer")
+    yield "save_workout_to_history", lambda: database.save_workout_to_history(
+        writer, "Strength", "Full Body", ["Quads", "Glutes"], WORKOUT_TEXT)
+
+    settings_user = database.create_user("bench_settings")
+    frequencies = iter(range(10**9))
+    def settings_round_trip():
+        database.save_user_settings(settings_user, {**SETTINGS, "strength_freq": 2 + next(frequencies) % 3})
+        return database.get_user_settings(settings_user)
+    yield "settings_round_trip", settings_round_trip
+
+def measure(func, repeat, min_time):
+    """Seconds per call: (median, min) over repeat rounds, each calibrated to last at least min_time."""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - started) / number)
+    return statistics.median(rounds), min(rounds)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", help="Only run cases whose name contains this text.")
+    parser.add_argument("--history-rows", type=int, nargs="+", default=[10, 1000, 100000],
+                        help="History sizes for get_workout_history.")
+    parser.add_argument("--repeat", type=int, default=7, help="Timed rounds per case (the best one is compared).")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per round.")
+    parser.add_argument("--baseline", help="JSON file of {case: best microseconds} to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown over the baseline (0.25 = 25%%).")
+    parser.add_argument("--retries", type=int, default=2, help="Measurements that must confirm a slowdown before it fails.")
+    parser.add_argument("--save-baseline", help="Write the measured best times to this JSON file.")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    best_times = {}
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            mock.patch.object(workout_generator, "_create_provider", return_value=STUB_PROVIDER), \
+            contextlib.redirect_stdout(io.StringIO()) as quiet:
+        database.configure(db_file=os.path.join(tmp_dir, "bench_training_app.db"))
+        database.setup_database()
+        cases = [case for case in list(generation_cases()) + list(database_cases(args.history_rows))
+                 if not args.filter or args.filter in case[0]]
+        def slower(name):
+            return name in baseline and best_times[name] / baseline[name] - 1 > args.tolerance
+
+        for name, func in cases:
+            median_s, min_s = measure(func, args.repeat, args.min_time)
+            best_times[name] = round(min_s * 1e6, 2)
+            line = f"{name:<62}{min_s * 1e6:>12.1f} us (median {median_s * 1e6:.1f})"
+            if name in baseline:
+                line += f"  baseline {baseline[name]:.1f} us ({best_times[name] / baseline[name] - 1:+.0%})"
+            print(line, file=sys.__stdout__) # Printing from the code under test is suppressed
+            quiet.seek(0)
+            quiet.truncate()
+
+        # Noise comes in bursts, so suspects are measured again after the other cases, not right away
+        funcs = dict(cases)
+        for retry in range(args.retries):
+            suspects = [name for name in best_times if slower(name)]
+            if not suspects:
+                break
+            print(f"\nMeasuring {len(suspects)} slower case(s) again ({retry + 1}/{args.retries}):", file=sys.__stdout__)
+            for name in suspects:
+                best_times[name] = min(best_times[name], round(measure(funcs[name], args.repeat, args.min_time)[1] * 1e6, 2))
+                print(f"{name:<62}{best_times[name]:>12.1f} us  baseline {baseline[name]:.1f} us "
+                      f"({best_times[name] / baseline[name] - 1:+.0%})", file=sys.__stdout__)
+                quiet.seek(0)
+                quiet.truncate()
+        failures = [f"{name}: {best_times[name]:.1f} us, baseline {baseline[name]:.1f} us ({best_times[name] / baseline[name] - 1:+.0%})"
+                    for name in best_times if slower(name)]
+        database.close_history_writer()
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(best_times, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.save_baseline}.")
+
+    if failures:
+        print(f"\nRegressions beyond {args.tolerance:.0%}:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Serialization time and bytes on the wire for workout history responses.
+
+Builds history payloads shaped like /get_workout_history output (full markdown workout
+texts included) for a few history sizes, then reports:
+
+* encode time per JSON encoder (stdlib as Flask uses it, orjson/msgspec when installed),
+* response size uncompressed, gzip (levels 1/6/9) and brotli (when installed), with the
+  time each compression takes.
+
+Usage:
+    python benchmarks/bench_responses.py [--entries 10 60 250] [--repeat 50]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import response_encoding
+
+EXERCISES = ["Back Squat", "Romanian Deadlift", "Bench Press", "Pull-Up", "Overhead Press", "Walking Lunge",
+             "Barbell Row", "Hip Thrust", "Plank", "Farmer's Carry", "Kettlebell Swing", "Box Jump"]
+MUSCLES = ["Quads", "Hamstrings", "Glutes", "Chest", "Lats", "Shoulders", "Core", "Triceps", "Biceps"]
+PILLARS = ["Strength", "Zone2 Cardio", "HIIT", "Stability/Mobility"]
+
+def workout_text(rng):
+    """Markdown in the shape the generator produces: warm-up, main block, cool-down, notes."""
+    lines = ["## Warm-up", "- 5 min easy cardio", "- Dynamic mobility: leg swings, arm circles", "", "## Main Workout"]
+    for _ in range(rng.randint(4, 7)):
+        lines.append(f"- **{rng.choice(EXERCISES)}**: {rng.randint(3, 5)} sets x {rng.randint(5, 12)} reps "
+                     f"@ RPE {rng.randint(6, 9)}, rest {rng.choice([60, 90, 120, 180])}s")
+        lines.append(f"  - Cue: {rng.choice(['brace before each rep', 'control the eccentric', 'drive through the heels', 'keep ribs down'])}")
+    lines += ["", "## Cool-down", "- 5 min walk", "- Stretch: hips, hamstrings, thoracic spine", "",
+              "## Coach Notes", f"Week context: {rng.choice(['build week', 'deload week'])}. " * rng.randint(3, 6)]
+    return "\n".join(lines)
+
+def history_payload(entries, seed=1):
+    rng = random.Random(seed)
+    now = datetime.now()
+    return [{
+        "id": 1000 + i,
+        "pillar": rng.choice(PILLARS),
+        "focus": rng.choice(["Upper Body", "Lower Body", "Push", "Pull", "Full Body"]),
+        "muscles_worked": rng.sample(MUSCLES, rng.randint(2, 5)),
+        "workout_date": str(now - timedelta(days=i, hours=rng.randint(0, 12))),
+        "full_workout_text": workout_text(rng),
+    } for i in range(entries)]
+
+def timed(func, repeat):
+    """Median milliseconds per call, and the last result."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, nargs="+", default=[10, 60, 250], help="History sizes (entries) to try.")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed runs per measurement (median reported).")
+    args = parser.parse_args(argv)
+
+    encoders = [name for name in ("stdlib", "orjson", "msgspec") if response_encoding.ENCODERS[name][0] is not None]
+    codings = [("gzip-1", "gzip", 1), ("gzip-6", "gzip", 6), ("gzip-9", "gzip", 9)]
+    if response_encoding.brotli is not None:
+        codings += [("br-4", "br", 4), ("br-11", "br", 11)]
+
+    for entries in args.entries:
+        payload = history_payload(entries)
+        print(f"\n{entries} history entries")
+        print(f"  {'encoder':<10} {'encode ms':>10} {'speedup':>8}")
+        baseline_ms, body = None, None
+        for name in encoders:
+            _, encode = response_encoding.make_encoder(name)
+            encode_ms, encoded = timed(lambda: encode(payload), args.repeat)
+            baseline_ms = baseline_ms or encode_ms
+            body = body or encoded
+            print(f"  {name:<10} {encode_ms:>10.3f} {baseline_ms / encode_ms:>7.1f}x")
+
+        print(f"  {'coding':<10} {'bytes':>10} {'ratio':>8} {'compress ms':>12}")
+        print(f"  {'identity':<10} {len(body):>10} {1:>8.2f} {0:>12.3f}")
+        for label, coding, level in codings:
+            if coding == "gzip":
+                response_encoding.COMPRESS_GZIP_LEVEL = level
+            else:
+                response_encoding.COMPRESS_BROTLI_QUALITY = level
+            compress_ms, compressed = timed(lambda: response_encoding.compress_body(body, coding), args.repeat)
+            print(f"  {label:<10} {len(compressed):>10} {len(body) / len(compressed):>8.2f} {compress_ms:>12.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Write-throughput benchmark for per-user database sharding.
+
+Simulates many users saving workouts at once (one thread per user, each committing its
+own inserts) and reports committed writes per second for each shard count. With a single
+database every commit queues behind the one SQLite write lock; with shards, users on
+different files commit in parallel.
+
+Usage:
+    python benchmarks/bench_sharding.py [--users 32] [--writes 50] [--shards 0 2 4 8]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import database
+
+def run(shard_count, users, writes_per_user):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_FILE = os.path.join(tmp_dir, "bench_training_app.db")
+        database.SHARD_COUNT = shard_count
+        database._shard_placement_cache.clear()
+        database.setup_database()
+        user_ids = [database.create_user(f"bench_user_{i}") for i in range(users)]
+        for user_id in user_ids:
+            database.get_db_path(user_id) # Resolve placement before timing
+
+        errors = []
+        def save_workouts(user_id):
+            try:
+                for i in range(writes_per_user):
+                    database.save_workout_to_history(user_id, "Strength", "Full Body", ["Quads", "Chest"], f"Workout {i} " * 40)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=save_workouts, args=(user_id,)) for user_id in user_ids]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        database._shard_placement_cache.clear()
+    total_writes = users * writes_per_user - len(errors) * writes_per_user
+    return total_writes / elapsed, elapsed, len(errors)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--writes", type=int, default=50, help="Workouts saved per user.")
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 2, 4, 8], help="Shard counts to compare (0 = unsharded).")
+    args = parser.parse_args(argv)
+
+    original_db_file, original_shard_count = database.DB_FILE, database.SHARD_COUNT
+    try:
+        baseline = None
+        print(f"{'shards':>6}  {'writes/s':>10}  {'seconds':>8}  {'speedup':>7}  failed users")
+        for shard_count in args.shards:
+            throughput, elapsed, failed = run(shard_count, args.users, args.writes)
+            baseline = baseline or throughput
+            print(f"{shard_count or 1:>6}  {throughput:>10.1f}  {elapsed:>8.2f}  {throughput / baseline:>6.2f}x  {failed}")
+    finally:
+        database.DB_FILE, database.SHARD_COUNT = original_db_file, original_shard_count
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Cold-start import time of the app's entry modules.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, and the
+timings Python prints to stderr are parsed. Reported per module:
+
+* the median cumulative import time over --repeat runs,
+* its heaviest imports (cumulative time, from the median run), so a slow new import is easy
+  to attribute.
+
+Regression checks, for CI or before a release:
+
+* modules listed in --forbid must not be imported at startup at all (by default the Gemini
+  SDK, which is loaded when the first provider is created),
+* with --baseline, a module more than --tolerance slower than its saved time fails the run.
+  --save-baseline writes the current medians.
+
+The exit status is 1 when a check fails.
+
+Usage:
+    python benchmarks/bench_startup.py [--modules app asgi_app ...] [--repeat 5] [--top 8]
+        [--baseline startup_baseline.json] [--tolerance 0.25] [--save-baseline startup_baseline.json]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Not wsgi: importing it creates the app, which sets up the database
+DEFAULT_MODULES = ["app", "asgi_app", "database", "storage", "workout_generator"]
+DEFAULT_FORBIDDEN = ["google.generativeai"]
+
+# "import time:       226 |      81434 |           werkzeug"; the indent after "|" is the nesting depth
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S.*)$")
+
+def parse_importtime(stderr):
+    """[(name, depth, self_us, cumulative_us)] in the order Python printed them (children first)."""
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name.strip(), (len(indent) - 1) // 2, int(self_us), int(cumulative_us)))
+    return entries
+
+def import_once(module):
+    """Imports module in a fresh interpreter. Returns the parsed -X importtime entries."""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+def module_total_us(entries, module):
+    return next(cumulative for name, depth, _, cumulative in entries if name == module and depth == 0)
+
+def heaviest_imports(entries, module, top):
+    """The top imports by cumulative time among those the module pulled in."""
+    # Children print before their parent; earlier top-level lines are interpreter startup (site etc.)
+    end = next(index for index, (name, depth, _, _) in enumerate(entries) if name == module and depth == 0)
+    start = max([index + 1 for index, (_, depth, _, _) in enumerate(entries[:end]) if depth == 0], default=0)
+    return sorted(((cumulative, name) for name, _, _, cumulative in entries[start:end]), reverse=True)[:top]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES, help="Modules to import.")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per module (median reported).")
+    parser.add_argument("--top", type=int, default=8, help="Heaviest imports listed per module.")
+    parser.add_argument("--forbid", nargs="*", default=DEFAULT_FORBIDDEN, help="Modules that must not load at startup.")
+    parser.add_argument("--baseline", help="JSON file of {module: ms} to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown over the baseline (0.25 = 25%%).")
+    parser.add_argument("--save-baseline", help="Write the measured medians to this JSON file.")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    failures, medians = [], {}
+    for module in args.modules:
+        runs = [import_once(module) for _ in range(args.repeat)]
+        totals = [module_total_us(entries, module) for entries in runs]
+        median_us = statistics.median(totals)
+        medians[module] = round(median_us / 1000, 1)
+        median_run = runs[min(range(len(runs)), key=lambda index: abs(totals[index] - median_us))]
+
+        line = f"\n{module}: {median_us / 1000:.1f} ms (min {min(totals) / 1000:.1f}, max {max(totals) / 1000:.1f})"
+        if module in baseline:
+            line += f", baseline {baseline[module]:.1f} ms"
+            if medians[module] > baseline[module] * (1 + args.tolerance):
+                failures.append(f"{module} takes {medians[module]:.1f} ms to import, baseline {baseline[module]:.1f} ms")
+        print(line)
+        for cumulative_us, name in heaviest_imports(median_run, module, args.top):
+            print(f"  {cumulative_us / 1000:>8.1f} ms  {name}")
+
+        loaded = {name for name, _, _, _ in median_run}
+        for forbidden in args.forbid:
+            if forbidden in loaded:
+                failures.append(f"importing {module} loads {forbidden}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(medians, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.save_baseline}.")
+
+    if failures:
+        print("\nStartup regressions:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Throughput/latency benchmark for group-commit history saves.
+
+Runs the same burst of concurrent save_workout_to_history calls with direct commits and
+with the group-commit writer at several batch windows, and reports writes per second
+alongside per-save latency (the time until the save is acknowledged as committed).
+
+Usage:
+    python benchmarks/bench_write_batching.py [--threads 16] [--writes 100] [--delays-ms 1 5 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import database
+
+def run(threads, writes_per_thread, batching, max_delay_ms=5, max_batch_size=64):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_FILE = os.path.join(tmp_dir, "bench_training_app.db")
+        database.setup_database()
+        database.WRITE_BATCHING = batching
+        database.BATCH_MAX_DELAY_MS = max_delay_ms
+        database.BATCH_MAX_SIZE = max_batch_size
+
+        latencies = []
+        latencies_lock = threading.Lock()
+        def save_workouts():
+            own = []
+            for i in range(writes_per_thread):
+                started = time.perf_counter()
+                database.save_workout_to_history(1, "Strength", "Full Body", ["Quads", "Chest"], f"Workout {i} " * 40)
+                own.append(time.perf_counter() - started)
+            with latencies_lock:
+                latencies.extend(own)
+
+        workers = [threading.Thread(target=save_workouts) for _ in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        batches = database.get_history_writer().stats["batches"] if batching else len(latencies)
+        database.close_history_writer()
+        database.WRITE_BATCHING = False
+
+    latencies.sort()
+    return {
+        "writes_per_s": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "commits": batches,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=100, help="Saves per thread.")
+    parser.add_argument("--delays-ms", type=float, nargs="+", default=[1, 5, 20], help="Batch windows to try.")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    original = (database.DB_FILE, database.WRITE_BATCHING, database.BATCH_MAX_DELAY_MS, database.BATCH_MAX_SIZE)
+    try:
+        rows = [("direct", run(args.threads, args.writes, batching=False))]
+        for delay_ms in args.delays_ms:
+            result = run(args.threads, args.writes, batching=True, max_delay_ms=delay_ms, max_batch_size=args.batch_size)
+            rows.append((f"batched {delay_ms:g}ms", result))
+    finally:
+        database.DB_FILE, database.WRITE_BATCHING, database.BATCH_MAX_DELAY_MS, database.BATCH_MAX_SIZE = original
+
+    print(f"{'mode':<14} {'writes/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'commits':>8}")
+    for mode, result in rows:
+        print(f"{mode:<14} {result['writes_per_s']:>10.1f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['commits']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Load test: how much traffic one server sustains, with the AI provider simulated.
+
+By default the app is created in this process (create_simulated_app: a fresh database in a
+temporary directory) and served by werkzeug's threaded server on a free local port. The Gemini
+call is replaced by SimulatedProvider, which builds the real prompt, sleeps for a lognormal
+latency around --ai-latency-ms, fails --ai-error-rate of the calls and parses a canned reply.
+--url targets a server started separately instead, e.g. gunicorn serving the same simulated app:
+
+    gunicorn -c gunicorn.conf.py --chdir benchmarks "load_test:create_simulated_app(ai_latency_ms=800)"
+
+--users virtual users each run for --duration seconds, picking actions from TRAFFIC_MIX with an
+exponentially distributed think time (mean --think-ms) between them. The app has one hard-coded
+user, so the virtual users are concurrent sessions of that user. The per-user rate limit would
+throttle all of them together, so the in-process app runs with rate limiting off unless
+--rate-limiting is given.
+
+Reported per action and overall:
+* requests and throughput,
+* p50/p95/p99/max latency,
+* errors (5xx responses and failed connections) and 429s,
+* SQLite "database is locked" errors, from /get_query_stats before and after the run. With
+  several worker processes, that is only the worker that answered.
+
+--output writes the results as JSON, with the git commit, for comparison across commits;
+--compare prints the change from such a file.
+
+Usage:
+    python benchmarks/load_test.py [--users 50] [--duration 30] [--think-ms 500]
+        [--ai-latency-ms 800] [--ai-error-rate 0.01] [--output results.json] [--compare old.json]
+"""
+import argparse
+import gzip
+import http.client
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Action -> weight: mostly reads (the page and what it fetches), a generation every few actions
+TRAFFIC_MIX = {
+    "page_load": 25,
+    "get_workout_history": 20,
+    "get_current_weekly_plan": 10,
+    "get_user_settings": 10,
+    "generate_workout": 15,
+    "save_workout": 10,
+    "delete_workout": 5,
+    "save_user_settings": 5,
+}
+PILLARS = ["Strength", "Zone2 Cardio", "HIIT", "Stability/Mobility"]
+CANNED_WORKOUT = json.dumps({
+    "muscles_worked": ["Quads", "Glutes", "Hamstrings"],
+    "workout_text": "## Warm-up\n- 5 min easy cardio\n\n## Main Workout\n"
+                    + "\n".join(f"- **Exercise {i}**: 4 sets x 8 reps @ RPE 8, rest 120s" for i in range(6))
+                    + "\n\n## Cool-down\n- 5 min walk",
+})
+
+class SimulatedProvider:
+    """A GENERATE_WORKOUT stand-in: real prompt building and parsing around a simulated model call."""
+
+    def __init__(self, latency_ms=800, sigma=0.5, error_rate=0.01):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+
+    def __call__(self, user_data, settings, api_key):
+        from workout_generator import build_workout_prompt, parse_workout_response
+        build_workout_prompt(user_data, settings)
+        time.sleep(random.lognormvariate(math.log(self.latency_ms / 1000), self.sigma))
+        if random.random() < self.error_rate:
+            raise ValueError("Simulated AI provider error.")
+        return parse_workout_response(CANNED_WORKOUT, user_data)
+
+def create_simulated_app(data_dir=None, ai_latency_ms=800, ai_error_rate=0.01, rate_limiting=False):
+    """create_app() on a fresh database in data_dir (a new temporary directory by default), with SimulatedProvider."""
+    from app import create_app
+    data_dir = data_dir or tempfile.mkdtemp(prefix="load_test_")
+    config_file = os.path.join(data_dir, "user_config.json")
+    with open(config_file, "w", encoding="utf-8") as f:
+        json.dump({"GEMINI_API_KEY": "simulated"}, f)
+    return create_app({
+        "DB_FILE": os.path.join(data_dir, "load_test.db"),
+        "STORAGE_BACKEND": "sqlite",
+        "USER_CONFIG_FILE": config_file,
+        "GENERATE_WORKOUT": SimulatedProvider(ai_latency_ms, error_rate=ai_error_rate),
+        "RATE_LIMITING": rate_limiting,
+    })
+
+class VirtualUser:
+    """One session: a keep-alive connection, the workout ids it has seen, its own random stream."""
+
+    def __init__(self, base_url, seed, timeout):
+        parts = urlsplit(base_url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+        self.rng = random.Random(seed)
+        self.workout_ids = []
+
+    def request(self, method, path, body=None):
+        """(status, parsed JSON body or None); status 0 when the connection failed."""
+        headers = {"Accept-Encoding": "gzip"}
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close() # Reconnects on the next request
+            return 0, None
+        if not response.getheader("Content-Type", "").startswith("application/json"):
+            return response.status, None
+        try:
+            if response.getheader("Content-Encoding") == "gzip":
+                data = gzip.decompress(data)
+            return response.status, json.loads(data)
+        except (ValueError, OSError):
+            return response.status, None
+
+    def run_action(self, action):
+        rng = self.rng
+        if action == "page_load":
+            return self.request("GET", "/")[0]
+        if action == "get_workout_history":
+            status, history = self.request("GET", "/get_workout_history?days=14")
+            if isinstance(history, list):
+                self.workout_ids = [entry["id"] for entry in history if "id" in entry]
+            return status
+        if action == "get_current_weekly_plan":
+            return self.request("GET", "/get_current_weekly_plan")[0]
+        if action == "get_user_settings":
+            return self.request("GET", "/get_user_settings")[0]
+        if action == "generate_workout":
+            return self.request("POST", "/generate_workout", {
+                "workout_pillar": rng.choice(PILLARS), "experience": "Intermediate",
+                "equipment": ["Dumbbells", "Barbell"], "focus": rng.choice(["Upper Body", "Lower Body", "Full Body"]),
+            })[0]
+        if action == "save_workout":
+            return self.request("POST", "/save_workout", {
+                "pillar": rng.choice(PILLARS), "focus": "Full Body", "muscles_worked": ["Quads", "Core"],
+                "full_workout_text": json.loads(CANNED_WORKOUT)["workout_text"],
+            })[0]
+        if action == "delete_workout":
+            # An id from this session's last history view; another session may have deleted it already
+            workout_id = self.workout_ids.pop(rng.randrange(len(self.workout_ids))) if self.workout_ids else 0
+            return self.request("DELETE", f"/delete_workout/{workout_id}")[0]
+        if action == "save_user_settings":
+            return self.request("POST", "/save_user_settings", {
+                "strength_freq": rng.randint(2, 4), "zone2_freq": rng.randint(1, 3),
+                "hiit_freq": rng.randint(0, 2), "stability_freq": rng.randint(0, 2),
+            })[0]
+        raise ValueError(f"Unknown action {action}")
+
+def run_users(base_url, users, duration, think_ms, timeout, seed):
+    """Runs the virtual users. Returns ({action: [(status, seconds)]}, wall-clock seconds)."""
+    actions, weights = list(TRAFFIC_MIX), list(TRAFFIC_MIX.values())
+    results = {action: [] for action in actions}
+    results_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def user_loop(index):
+        user = VirtualUser(base_url, seed + index, timeout)
+        # Staggered starts, so the first requests do not all arrive at once
+        time.sleep(user.rng.uniform(0, think_ms / 1000))
+        while time.monotonic() < deadline:
+            action = user.rng.choices(actions, weights)[0]
+            started = time.perf_counter()
+            status = user.run_action(action)
+            elapsed = time.perf_counter() - started
+            with results_lock:
+                results[action].append((status, elapsed))
+            time.sleep(user.rng.expovariate(1000 / think_ms) if think_ms > 0 else 0)
+        user.connection.close()
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=user_loop, args=(index,), daemon=True) for index in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - started
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+def summarize(samples, elapsed):
+    latencies = sorted(seconds * 1000 for _, seconds in samples)
+    errors = sum(1 for status, _ in samples if status == 0 or status >= 500)
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "rate_limited": sum(1 for status, _ in samples if status == 429),
+        "latency_ms": {name: round(value, 2) if value is not None else None for name, value in (
+            ("p50", percentile(latencies, 0.50)), ("p95", percentile(latencies, 0.95)),
+            ("p99", percentile(latencies, 0.99)), ("max", latencies[-1] if latencies else None))},
+    }
+
+def lock_errors(base_url):
+    """Total "database is locked" errors the answering worker has seen, or None if unavailable."""
+    status, stats = VirtualUser(base_url, 0, 10).request("GET", "/get_query_stats")
+    if status != 200 or not isinstance(stats, dict):
+        return None
+    return sum(stats.get("lock_errors", {}).values())
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results):
+    print(f"\n{'action':<26}{'requests':>9}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}{'429':>6}")
+    rows = list(results["actions"].items()) + [("overall", results["overall"])]
+    for action, summary in rows:
+        latency = {name: "-" if value is None else f"{value:.1f}" for name, value in summary["latency_ms"].items()}
+        print(f"{action:<26}{summary['requests']:>9}{summary['throughput_rps']:>9.1f}{latency['p50']:>9}{latency['p95']:>9}"
+              f"{latency['p99']:>9}{latency['max']:>9}{summary['errors']:>8}{summary['rate_limited']:>6}")
+    print(f"\nSQLite lock errors: {results['sqlite_lock_errors'] if results['sqlite_lock_errors'] is not None else 'unavailable'}")
+
+def print_comparison(old, new):
+    print(f"\nCompared with {old.get('commit') or 'previous run'} ({old.get('timestamp', '?')}):")
+    def change(before, after):
+        if not before or after is None:
+            return "n/a"
+        return f"{before:.1f} -> {after:.1f} ({(after - before) / before:+.1%})"
+    print(f"  throughput rps: {change(old['overall']['throughput_rps'], new['overall']['throughput_rps'])}")
+    for name in ("p50", "p95", "p99"):
+        print(f"  {name} ms:         {change(old['overall']['latency_ms'][name], new['overall']['latency_ms'][name])}")
+    print(f"  error rate:     {old['overall']['error_rate']:.2%} -> {new['overall']['error_rate']:.2%}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="Server to test (default: the app in this process on a free port).")
+    parser.add_argument("--users", type=int, default=50, help="Concurrent virtual users.")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run.")
+    parser.add_argument("--think-ms", type=float, default=500, help="Mean pause between a user's actions.")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the users' action choices.")
+    parser.add_argument("--ai-latency-ms", type=float, default=800, help="Median simulated AI call latency (in-process app).")
+    parser.add_argument("--ai-error-rate", type=float, default=0.01, help="Fraction of simulated AI calls that fail.")
+    parser.add_argument("--rate-limiting", action="store_true", help="Keep the app's rate limits on (in-process app).")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", help="A previous --output file to compare against.")
+    args = parser.parse_args(argv)
+
+    server, app, data_dir = None, None, None
+    base_url = args.url
+    if base_url is None:
+        from werkzeug.serving import make_server
+        import app as app_module
+        logging.getLogger("werkzeug").setLevel(logging.ERROR) # One line per request otherwise
+        for name in (app_module.__name__, "workout_generator"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+        data_dir = tempfile.mkdtemp(prefix="load_test_")
+        app = create_simulated_app(data_dir, args.ai_latency_ms, args.ai_error_rate, args.rate_limiting)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+    print(f"Load test: {args.users} users for {args.duration:.0f}s against {base_url}"
+          + (f" (simulated AI: {args.ai_latency_ms:.0f} ms median, {args.ai_error_rate:.1%} errors)" if server else ""))
+    try:
+        locks_before = lock_errors(base_url)
+        samples, elapsed = run_users(base_url, args.users, args.duration, args.think_ms, args.timeout, args.seed)
+        locks_after = lock_errors(base_url)
+    finally:
+        if server is not None:
+            server.shutdown()
+            app_module.shutdown(app)
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        "elapsed_s": round(elapsed, 2),
+        "overall": summarize([sample for action_samples in samples.values() for sample in action_samples], elapsed),
+        "actions": {action: summarize(action_samples, elapsed) for action, action_samples in samples.items()},
+        "sqlite_lock_errors": None if None in (locks_before, locks_after) else locks_after - locks_before,
+    }
+    print_results(results)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(json.load(f), results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
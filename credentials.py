@@ -0,0 +1,171 @@
+"""
+AI provider credentials, cached in memory.
+
+* The deployment-wide Gemini key lives in USER_CONFIG_FILE (written by /save_settings), or
+  else in the GEMINI_API_KEY environment variable. The parsed file is cached and only read
+  again when its mtime, size or inode change, so a lookup costs one stat() instead of an open
+  and a JSON parse. Writes go to a temporary file in the same directory, which is fsync'd and
+  then renamed over the old one: readers in any worker see either the old or the new file,
+  never a half-written one.
+* Per-user keys live in the user_credentials table (through Storage), whose version column
+  changes on every save and delete. A key, or the fact that a user has none, is cached with
+  that version and served while the stored version still matches, the way database.py's
+  settings cache checks settings_version: a key saved or deleted by another worker process is
+  seen on the next lookup.
+
+api_key_for(user_id) returns the user's own key when they have one, else the global key, so
+callers that pool providers or rate-limit per tenant can key on the user.
+
+Environment:
+    GEMINI_API_KEY              used when the config file has no key
+"""
+import os
+import json
+import logging
+import tempfile
+import threading
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+USER_CONFIG_FILE = "user_config.json"
+DEFAULT_PROVIDER = "gemini"
+
+def write_json_atomically(path, data):
+    """Replaces path with data as JSON in one rename. The file is only readable by its owner."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp") # Mode 0600
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+class CredentialStore:
+    """Global and per-user API keys with the caching described in the module docstring."""
+
+    def __init__(self, config_file=USER_CONFIG_FILE, storage=None):
+        self.config_file = config_file
+        self._storage = storage # None: the process-wide storage at call time
+        self._lock = threading.Lock()
+        self._file_cache = None # ((st_mtime_ns, st_size, st_ino), parsed config dict)
+        self._user_keys = {}    # (user_id, provider) -> (stored version, api_key or None)
+        self._stats = {"hits": 0, "misses": 0, "file_reads": 0}
+
+    @property
+    def storage(self):
+        return self._storage or get_storage()
+
+    def _read_config(self):
+        try:
+            stat = os.stat(self.config_file)
+        except FileNotFoundError:
+            return {}
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if self._file_cache and self._file_cache[0] == signature:
+                return self._file_cache[1]
+        try:
+            with open(self.config_file, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        except FileNotFoundError: # Replaced between stat() and open(); the next call sees the new file
+            return {}
+        except json.JSONDecodeError:
+            logger.error(f"Error decoding {self.config_file}. Using environment variable for API key.")
+            config = {}
+        with self._lock:
+            self._file_cache = (signature, config)
+            self._stats["file_reads"] += 1
+        return config
+
+    def global_api_key(self):
+        """The deployment-wide key: from the config file, else GEMINI_API_KEY."""
+        return self._read_config().get("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY")
+
+    def save_global_api_key(self, api_key):
+        """Writes the key to the config file atomically, keeping any other settings in it."""
+        config = dict(self._read_config())
+        config["GEMINI_API_KEY"] = api_key
+        write_json_atomically(self.config_file, config) # New inode, so the cached copy no longer matches
+        logger.info(f"Gemini API Key saved to {self.config_file}.")
+
+    def user_api_key(self, user_id, provider=DEFAULT_PROVIDER):
+        """The user's own key, or None; cached while the stored key's version is unchanged."""
+        version = self.storage.get_user_api_key_version(user_id, provider)
+        with self._lock:
+            cached = self._user_keys.get((user_id, provider))
+            if cached and cached[0] == version:
+                self._stats["hits"] += 1
+                return cached[1]
+            self._stats["misses"] += 1
+        # Read after the version: a key saved in between is cached under the older version and
+        # read again on the next lookup, never the other way round
+        api_key = self.storage.get_user_api_key(user_id, provider) if version is not None else None
+        with self._lock:
+            self._user_keys[(user_id, provider)] = (version, api_key)
+        return api_key
+
+    def save_user_api_key(self, user_id, api_key, provider=DEFAULT_PROVIDER):
+        self.storage.save_user_api_key(user_id, api_key, provider)
+        with self._lock:
+            self._user_keys.pop((user_id, provider), None)
+
+    def delete_user_api_key(self, user_id, provider=DEFAULT_PROVIDER):
+        self.storage.delete_user_api_key(user_id, provider)
+        with self._lock:
+            self._user_keys.pop((user_id, provider), None)
+
+    def api_key_for(self, user_id=None, provider=DEFAULT_PROVIDER):
+        """The key to call the provider with for this user: their own, else the global one."""
+        if user_id is not None:
+            api_key = self.user_api_key(user_id, provider)
+            if api_key:
+                return api_key
+        return self.global_api_key()
+
+    def invalidate(self):
+        """Drops every cached key; the next lookups read the file and the database again."""
+        with self._lock:
+            self._file_cache = None
+            self._user_keys.clear()
+
+    def get_cache_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._user_keys)
+        return stats
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+
+_credential_store = None
+_credential_store_lock = threading.Lock()
+
+def get_credential_store():
+    """Returns the process-wide CredentialStore, creating it with the defaults on first use."""
+    global _credential_store
+    with _credential_store_lock:
+        if _credential_store is None:
+            _credential_store = CredentialStore()
+        return _credential_store
+
+def set_credential_store(store):
+    """Replaces the process-wide CredentialStore (create_app does, with its configuration)."""
+    global _credential_store
+    with _credential_store_lock:
+        _credential_store = store
+
+def _reset_after_fork():
+    global _credential_store_lock
+    _credential_store_lock = threading.Lock()
+    if _credential_store is not None:
+        _credential_store._reset_after_fork()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,16 +1,179 @@
+import os
+import atexit
 import sqlite3
 import json
-from datetime import datetime, timedelta, date # Added date
+import zlib
+import logging
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from datetime import datetime, timedelta, date, timezone # Added date
+import query_stats
+
+logger = logging.getLogger(__name__)
 
 DB_FILE = "training_app.db"
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
+# --- Sharding ---
+# With DB_SHARD_COUNT unset (0), everything lives in DB_FILE. With N > 0, DB_FILE becomes a
+# small catalog (users and their shard placement) and each user's settings, plans and history
+# live in one of N shard files under SHARD_DIR, chosen by hash. SQLite allows one writer per
+# file, so spreading users over shards lets saves from different users commit in parallel.
+SHARD_COUNT = int(os.getenv("DB_SHARD_COUNT", 0))
+SHARD_DIR = "shards" # Relative to the directory of DB_FILE
+_shard_placement_cache = {} # user_id -> shard_id; placements never change once assigned
+_shard_placement_lock = threading.Lock()
+
+# --- Write Batching ---
+# With DB_WRITE_BATCHING=1, history saves go through a GroupCommitWriter (write_batcher.py):
+# one background thread commits the saves collected within a short window together, instead
+# of one fsync'd commit per save. DB_BATCH_MAX_SIZE and DB_BATCH_MAX_DELAY_MS set the window.
+WRITE_BATCHING = os.getenv("DB_WRITE_BATCHING", "0") == "1"
+BATCH_MAX_SIZE = int(os.getenv("DB_BATCH_MAX_SIZE", 64))
+BATCH_MAX_DELAY_MS = float(os.getenv("DB_BATCH_MAX_DELAY_MS", 5))
+_history_writer = None
+_history_writer_lock = threading.Lock()
+
+# --- User Settings Cache ---
+# Settings are read on every /generate_workout and /get_user_settings call but only
+# change through save_user_settings. Every user_settings row carries a settings_version
+# that is bumped on each write, so a cached entry is served only while its version still
+# matches the row. Checking the version is a single indexed lookup, which keeps the cache
+# correct across worker processes without any cross-process messaging.
+# DB_SETTINGS_CACHE=0 turns it off (every read goes to the database).
+SETTINGS_CACHE = os.getenv("DB_SETTINGS_CACHE", "1") == "1"
+_settings_cache = {} # user_id -> (settings_version, settings dict)
+_settings_cache_lock = threading.Lock()
+_settings_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def configure(db_file=None, shard_count=None, write_batching=None, batch_max_size=None,
+              batch_max_delay_ms=None, settings_cache=None):
+    """
+    Sets the module configuration (arguments left as None keep their current value). Caches
+    tied to the previous database are dropped and the history writer is restarted, so this can
+    be called again, e.g. by tests, after the process has already used another database.
+    """
+    global DB_FILE, SHARD_COUNT, WRITE_BATCHING, BATCH_MAX_SIZE, BATCH_MAX_DELAY_MS, SETTINGS_CACHE
+    close_history_writer() # Flushes saves queued for the old configuration
+    if (db_file is not None and db_file != DB_FILE) or (shard_count is not None and shard_count != SHARD_COUNT):
+        with _shard_placement_lock:
+            _shard_placement_cache.clear()
+        invalidate_settings_cache()
+    DB_FILE = DB_FILE if db_file is None else db_file
+    SHARD_COUNT = SHARD_COUNT if shard_count is None else shard_count
+    WRITE_BATCHING = WRITE_BATCHING if write_batching is None else write_batching
+    BATCH_MAX_SIZE = BATCH_MAX_SIZE if batch_max_size is None else batch_max_size
+    BATCH_MAX_DELAY_MS = BATCH_MAX_DELAY_MS if batch_max_delay_ms is None else batch_max_delay_ms
+    if settings_cache is not None and not settings_cache:
+        invalidate_settings_cache()
+    SETTINGS_CACHE = SETTINGS_CACHE if settings_cache is None else settings_cache
+
+def _reset_after_fork():
+    """
+    Runs in a forked child (e.g. a server worker). Only the forking thread survives a fork, so
+    the parent's history writer thread is gone and its locks may have been held by threads that
+    no longer exist: start from fresh ones. Cached settings and placements stay valid (settings
+    are checked against their version on every read).
+    """
+    global _history_writer, _history_writer_lock, _shard_placement_lock, _settings_cache_lock
+    if _history_writer is not None:
+        # Anything it still held is the parent's to commit
+        atexit.unregister(_history_writer.close)
+        _history_writer = None
+    _history_writer_lock = threading.Lock()
+    _shard_placement_lock = threading.Lock()
+    _settings_cache_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _connect(path):
+    conn = sqlite3.connect(path, factory=query_stats.connection_factory())
     conn.row_factory = sqlite3.Row # Allows accessing columns by name
     return conn
 
+def get_catalog_connection():
+    """Connection to DB_FILE, which always holds the users table (and shard placement)."""
+    return _connect(DB_FILE)
+
+def get_shard_path(shard_id):
+    return os.path.join(os.path.dirname(DB_FILE), SHARD_DIR, f"shard_{shard_id:03d}.db")
+
+def get_user_data_paths():
+    """Every database file holding user data: the shard files, or just DB_FILE when unsharded."""
+    if not SHARD_COUNT:
+        return [DB_FILE]
+    return [get_shard_path(shard_id) for shard_id in range(SHARD_COUNT)]
+
+@query_stats.operation("shard_for_user")
+def shard_for_user(user_id):
+    """
+    Returns the shard holding a user's data. New users are placed by hash and the placement is
+    recorded in the catalog, so changing SHARD_COUNT later never moves existing users silently.
+    """
+    with _shard_placement_lock:
+        if user_id in _shard_placement_cache:
+            return _shard_placement_cache[user_id]
+
+    conn = get_catalog_connection()
+    try:
+        row = conn.execute("SELECT shard_id FROM user_shards WHERE user_id = ?", (user_id,)).fetchone()
+        if row:
+            shard_id = row['shard_id']
+        else:
+            shard_id = zlib.crc32(str(user_id).encode("utf-8")) % SHARD_COUNT
+            conn.execute("INSERT OR IGNORE INTO user_shards (user_id, shard_id) VALUES (?, ?)", (user_id, shard_id))
+            conn.commit()
+            # Another process may have won the race; its placement is the one that counts
+            shard_id = conn.execute("SELECT shard_id FROM user_shards WHERE user_id = ?", (user_id,)).fetchone()['shard_id']
+    finally:
+        conn.close()
+
+    with _shard_placement_lock:
+        _shard_placement_cache[user_id] = shard_id
+    return shard_id
+
+def get_db_path(user_id=None):
+    if SHARD_COUNT and user_id is not None:
+        return get_shard_path(shard_for_user(user_id))
+    return DB_FILE
+
+def get_db_connection(user_id=None):
+    """Connection to the database holding user_id's data (DB_FILE when unsharded)."""
+    if SHARD_COUNT and user_id is None:
+        raise ValueError("A user_id is required to pick a shard when DB_SHARD_COUNT is set.")
+    return _connect(get_db_path(user_id))
+
+def for_each_shard(func):
+    """Runs func(conn, path) on every user-data database and returns the results in shard order."""
+    results = []
+    for path in get_user_data_paths():
+        conn = _connect(path)
+        try:
+            results.append(func(conn, path))
+        finally:
+            conn.close()
+    return results
+
+def _ensure_incremental_auto_vacuum(conn):
+    """
+    Switches the database to incremental auto-vacuum so space freed by archival can be
+    reclaimed with PRAGMA incremental_vacuum instead of a blocking full VACUUM.
+    Existing files need one VACUUM to apply the mode; this happens only once.
+    """
+    auto_vacuum_mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if auto_vacuum_mode != 2: # 0=NONE, 1=FULL, 2=INCREMENTAL
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        logger.info("Database switched to incremental auto-vacuum mode.")
+
+@query_stats.operation("setup_database")
 def setup_database():
-    conn = get_db_connection()
+    """
+    Creates or migrates the catalog and every user-data database (all shards when sharded),
+    then ensures the default user and their settings exist.
+    """
+    conn = get_catalog_connection()
+    _ensure_incremental_auto_vacuum(conn)
     cursor = conn.cursor()
 
     # Create users table
@@ -22,6 +185,42 @@ def setup_database():
     )
     ''')
 
+    # Shard placement (only consulted when SHARD_COUNT > 0)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_shards (
+        user_id INTEGER PRIMARY KEY,
+        shard_id INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''')
+    conn.commit()
+
+    if not SHARD_COUNT:
+        _create_user_data_schema(conn)
+    conn.close()
+
+    if SHARD_COUNT:
+        os.makedirs(os.path.join(os.path.dirname(DB_FILE), SHARD_DIR), exist_ok=True)
+        for shard_path in get_user_data_paths():
+            shard_conn = _connect(shard_path)
+            try:
+                _ensure_incremental_auto_vacuum(shard_conn)
+                _create_user_data_schema(shard_conn)
+            finally:
+                shard_conn.close()
+        logger.info(f"Schema ensured on {SHARD_COUNT} shard(s) in {os.path.join(os.path.dirname(DB_FILE), SHARD_DIR)}.")
+
+    # Create a default user and their settings if they don't exist
+    user_id = create_user('default_user')
+    if _ensure_default_settings(user_id):
+        logger.info(f"Default settings created for user 'default_user' with ID {user_id}.")
+
+    logger.info("Database setup complete. Tables created and default user/settings ensured.")
+
+def _create_user_data_schema(conn):
+    """Creates and migrates the per-user tables (settings, plans, history, summaries) on one database."""
+    cursor = conn.cursor()
+
     # Create user_settings table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS user_settings (
@@ -36,6 +235,7 @@ def setup_database():
         primary_goal TEXT DEFAULT 'Balanced Fitness',
         ai_model_id TEXT DEFAULT 'gemini-1.5-flash-latest',
         workout_duration_preference TEXT DEFAULT 'Any',
+        settings_version INTEGER NOT NULL DEFAULT 0,
         FOREIGN KEY (user_id) REFERENCES users (id)
     )
     ''')
@@ -44,29 +244,36 @@ def setup_database():
     try:
         cursor.execute("SELECT ai_model_id, workout_duration_preference, stability_freq FROM user_settings LIMIT 1")
     except sqlite3.OperationalError:
-        print("Attempting to add new columns to 'user_settings' table.")
+        logger.info("Attempting to add new columns to 'user_settings' table.")
         # Add columns one by one, committing after each, in case some already exist
         try:
             cursor.execute("ALTER TABLE user_settings ADD COLUMN ai_model_id TEXT DEFAULT 'gemini-1.5-flash-latest'")
             conn.commit()
-            print("Column 'ai_model_id' added or already exists.")
+            logger.info("Column 'ai_model_id' added or already exists.")
         except sqlite3.OperationalError:
             conn.rollback() # Rollback if this specific ALTER fails (e.g. column exists)
-            print("Column 'ai_model_id' likely already exists.")
+            logger.debug("Column 'ai_model_id' likely already exists.")
         try:
             cursor.execute("ALTER TABLE user_settings ADD COLUMN workout_duration_preference TEXT DEFAULT 'Any'")
             conn.commit()
-            print("Column 'workout_duration_preference' added or already exists.")
+            logger.info("Column 'workout_duration_preference' added or already exists.")
         except sqlite3.OperationalError:
             conn.rollback()
-            print("Column 'workout_duration_preference' likely already exists.")
+            logger.debug("Column 'workout_duration_preference' likely already exists.")
         try:
             cursor.execute("ALTER TABLE user_settings ADD COLUMN stability_freq INTEGER DEFAULT 1")
             conn.commit()
-            print("Column 'stability_freq' added or already exists.")
+            logger.info("Column 'stability_freq' added or already exists.")
         except sqlite3.OperationalError:
             conn.rollback()
-            print("Column 'stability_freq' likely already exists.")
+            logger.debug("Column 'stability_freq' likely already exists.")
+
+    try:
+        cursor.execute("SELECT settings_version FROM user_settings LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE user_settings ADD COLUMN settings_version INTEGER NOT NULL DEFAULT 0")
+        conn.commit()
+        logger.info("Column 'settings_version' added to 'user_settings' table.")
 
     # Create weekly_plan table
     cursor.execute('''
@@ -78,10 +285,23 @@ def setup_database():
         pillar_focus TEXT NOT NULL, -- e.g., 'Strength', 'Zone2', 'HIIT', 'Stability', 'Rest'
         workout_id INTEGER,          -- NULLABLE, FK to workout_history.id
         status TEXT NOT NULL,        -- e.g., 'Planned', 'Completed', 'Skipped'
+        session_focus TEXT,          -- Strength split for the day, taken from focus_rotation
+        phase TEXT,                  -- Periodization phase, e.g. 'Build' or 'Deload'
+        load_factor REAL NOT NULL DEFAULT 1.0, -- Relative training load for the week
         FOREIGN KEY (user_id) REFERENCES users (id),
         FOREIGN KEY (workout_id) REFERENCES workout_history (id)
     )
     ''')
+    try:
+        cursor.execute("SELECT session_focus, phase, load_factor FROM weekly_plan LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE weekly_plan ADD COLUMN session_focus TEXT")
+        cursor.execute("ALTER TABLE weekly_plan ADD COLUMN phase TEXT")
+        cursor.execute("ALTER TABLE weekly_plan ADD COLUMN load_factor REAL NOT NULL DEFAULT 1.0")
+        conn.commit()
+        logger.info("Periodization columns added to 'weekly_plan' table.")
+    # Plans are always read a week (or a range of weeks) at a time
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_weekly_plan_user_week ON weekly_plan (user_id, week_start_date, day_of_week)")
 
     # Create workout_history table
     cursor.execute('''
@@ -96,14 +316,53 @@ def setup_database():
         FOREIGN KEY (user_id) REFERENCES users (id)
     )
     ''')
+    # History reads and archival always filter by user and date range
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_workout_history_user_date ON workout_history (user_id, workout_date)")
 
-    # Create a default user and their settings if they don't exist
-    cursor.execute("SELECT id FROM users WHERE username = 'default_user'")
-    user = cursor.fetchone()
-    if not user:
-        cursor.execute("INSERT INTO users (username) VALUES (?)", ('default_user',))
-        user_id = cursor.lastrowid
-        
+    # Rows here pause trigger bookkeeping during bulk maintenance (e.g. 'archiving')
+    cursor.execute("CREATE TABLE IF NOT EXISTS maintenance_flags (name TEXT PRIMARY KEY)")
+
+    # A user's own AI provider keys (see credentials.py); without one the deployment-wide key is used
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_credentials (
+        user_id INTEGER NOT NULL,
+        provider TEXT NOT NULL,
+        api_key TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 1,   -- Bumped on every change of the key
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, provider)
+    ) WITHOUT ROWID
+    ''')
+
+    _create_weekly_summary_schema(conn)
+    _create_data_versions_schema(conn)
+    conn.commit()
+
+@query_stats.operation("create_user")
+def create_user(username):
+    """Returns the id of the user with this username, creating the user (and placing it on a shard) if needed."""
+    conn = get_catalog_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO users (username) VALUES (?)", (username,))
+        conn.commit()
+        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
+        user_id = cursor.fetchone()['id']
+    finally:
+        conn.close()
+    if SHARD_COUNT:
+        shard_for_user(user_id)
+    return user_id
+
+@query_stats.operation("ensure_default_settings")
+def _ensure_default_settings(user_id):
+    """Inserts default settings for a user without any. Returns True if a row was created."""
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id FROM user_settings WHERE user_id = ?", (user_id,))
+        if cursor.fetchone():
+            return False
         default_settings = {
             "user_id": user_id,
             "strength_freq": 2,
@@ -121,104 +380,340 @@ def setup_database():
         VALUES (:user_id, :strength_freq, :hiit_freq, :zone2_freq, :recovery_freq, :stability_freq, :focus_rotation, :primary_goal, :ai_model_id, :workout_duration_preference)
         ''', default_settings)
         conn.commit()
-        print(f"Default user 'default_user' with ID {user_id} and settings created with new fields including stability_freq.")
-    else:
-        user_id = user['id']
-        # Check if settings exist for default user, if not, create them
-        cursor.execute("SELECT id FROM user_settings WHERE user_id = ?", (user_id,))
-        settings = cursor.fetchone()
-        if not settings:
-            default_settings_values = {
-                "user_id": user_id,
-                "strength_freq": 2,
-                "hiit_freq": 1,
-                "zone2_freq": 2,
-                "recovery_freq": 1,
-                "stability_freq": 1,
-                "focus_rotation": json.dumps(["Upper Body", "Lower Body", "Push", "Pull"]),
-                "primary_goal": "Balanced Fitness",
-                "ai_model_id": "gemini-1.5-flash-latest",
-                "workout_duration_preference": "Any"
-            }
-            cursor.execute('''
-        INSERT INTO user_settings (user_id, strength_freq, hiit_freq, zone2_freq, recovery_freq, stability_freq, focus_rotation, primary_goal, ai_model_id, workout_duration_preference)
-        VALUES (:user_id, :strength_freq, :hiit_freq, :zone2_freq, :recovery_freq, :stability_freq, :focus_rotation, :primary_goal, :ai_model_id, :workout_duration_preference)
-            ''', default_settings_values)
-            conn.commit()
-        print(f"Default settings created for existing user 'default_user' with ID {user_id} with new fields including stability_freq.")
+        return True
+    finally:
+        conn.close()
 
+@query_stats.operation("list_users")
+def list_users():
+    """Returns [{'id', 'username'}] for every user in the catalog."""
+    conn = get_catalog_connection()
+    try:
+        return [dict(row) for row in conn.execute("SELECT id, username FROM users ORDER BY id").fetchall()]
+    finally:
+        conn.close()
 
-    conn.close()
-    print("Database setup complete. Tables created and default user/settings ensured.")
+INSERT_WORKOUT_SQL = '''
+    INSERT INTO workout_history (user_id, workout_date, pillar, focus, muscles_worked, full_workout_text)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+WORKOUT_HISTORY_QUERY = '''
+    SELECT id, pillar, focus, muscles_worked, workout_date, full_workout_text
+    FROM workout_history
+    WHERE user_id = ? AND workout_date >= ?
+    ORDER BY workout_date DESC
+'''
+
+# --- Weekly Summary Schema ---
+# weekly_summary is a materialized per-week, per-pillar rollup of workout_history and
+# weekly_plan, kept current by the triggers below so dashboards never aggregate raw rows.
+# History pillars ('Zone2 Cardio', 'Stability/Mobility') are mapped to plan pillar names.
+
+def _pillar_key_sql(column):
+    return f"CASE {column} WHEN 'Zone2 Cardio' THEN 'Zone2' WHEN 'Stability/Mobility' THEN 'Stability' ELSE {column} END"
+
+def _week_start_sql(column):
+    # 'weekday 0' moves forward to Sunday (or stays on it), so -6 days is that week's Monday
+    return f"date({column}, 'weekday 0', '-6 days')"
+
+def _history_summary_trigger_sql(row, delta):
+    """Statements that add delta sessions for one workout_history row (NEW or OLD)."""
+    week = _week_start_sql(f"{row}.workout_date")
+    pillar = _pillar_key_sql(f"{row}.pillar")
+    return f'''
+        INSERT OR IGNORE INTO weekly_summary (user_id, week_start_date, pillar) VALUES ({row}.user_id, {week}, {pillar});
+        UPDATE weekly_summary SET sessions = sessions + ({delta})
+        WHERE user_id = {row}.user_id AND week_start_date = {week} AND pillar = {pillar};
+        INSERT OR IGNORE INTO weekly_muscle_summary (user_id, week_start_date, muscle)
+            SELECT {row}.user_id, {week}, value FROM json_each({row}.muscles_worked) WHERE json_valid({row}.muscles_worked);
+        UPDATE weekly_muscle_summary SET sessions = sessions + ({delta})
+        WHERE user_id = {row}.user_id AND week_start_date = {week}
+          AND muscle IN (SELECT value FROM json_each({row}.muscles_worked) WHERE json_valid({row}.muscles_worked));
+    '''
+
+def _plan_summary_trigger_sql(row, delta):
+    """Statements that add delta planned/completed/skipped days for one weekly_plan row."""
+    return f'''
+        INSERT OR IGNORE INTO weekly_summary (user_id, week_start_date, pillar) VALUES ({row}.user_id, {row}.week_start_date, {row}.pillar_focus);
+        UPDATE weekly_summary
+        SET planned = planned + ({delta}),
+            completed = completed + ({delta}) * ({row}.status = 'Completed'),
+            skipped = skipped + ({delta}) * ({row}.status = 'Skipped')
+        WHERE user_id = {row}.user_id AND week_start_date = {row}.week_start_date AND pillar = {row}.pillar_focus;
+    '''
+
+def _create_weekly_summary_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'weekly_summary'")
+    summary_existed = cursor.fetchone() is not None
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS weekly_summary (
+        user_id INTEGER NOT NULL,
+        week_start_date DATE NOT NULL,     -- Monday, ISO format
+        pillar TEXT NOT NULL,              -- 'Strength', 'Zone2', 'HIIT', 'Stability', 'Rest', ...
+        sessions INTEGER NOT NULL DEFAULT 0,  -- Workouts logged in workout_history
+        planned INTEGER NOT NULL DEFAULT 0,   -- Days planned in weekly_plan
+        completed INTEGER NOT NULL DEFAULT 0, -- Planned days with status 'Completed'
+        skipped INTEGER NOT NULL DEFAULT 0,   -- Planned days with status 'Skipped'
+        PRIMARY KEY (user_id, week_start_date, pillar)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS weekly_muscle_summary (
+        user_id INTEGER NOT NULL,
+        week_start_date DATE NOT NULL,
+        muscle TEXT NOT NULL,
+        sessions INTEGER NOT NULL DEFAULT 0,  -- Logged workouts that listed this muscle
+        PRIMARY KEY (user_id, week_start_date, muscle)
+    ) WITHOUT ROWID
+    ''')
+
+    not_archiving = "NOT EXISTS (SELECT 1 FROM maintenance_flags WHERE name = 'archiving')"
+    cursor.executescript(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_history_summary_insert AFTER INSERT ON workout_history
+    BEGIN {_history_summary_trigger_sql("NEW", 1)} END;
+
+    -- Archival moves rows to the archive tier; the sessions still happened, so keep the counts
+    CREATE TRIGGER IF NOT EXISTS trg_history_summary_delete AFTER DELETE ON workout_history
+    WHEN {not_archiving}
+    BEGIN {_history_summary_trigger_sql("OLD", -1)} END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_history_summary_update
+    AFTER UPDATE OF user_id, workout_date, pillar, muscles_worked ON workout_history
+    BEGIN {_history_summary_trigger_sql("OLD", -1)} {_history_summary_trigger_sql("NEW", 1)} END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_plan_summary_insert AFTER INSERT ON weekly_plan
+    BEGIN {_plan_summary_trigger_sql("NEW", 1)} END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_plan_summary_delete AFTER DELETE ON weekly_plan
+    BEGIN {_plan_summary_trigger_sql("OLD", -1)} END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_plan_summary_update
+    AFTER UPDATE OF user_id, week_start_date, pillar_focus, status ON weekly_plan
+    BEGIN {_plan_summary_trigger_sql("OLD", -1)} {_plan_summary_trigger_sql("NEW", 1)} END;
+    ''')
+
+    if not summary_existed:
+        # First run on an existing database: backfill from the rows already stored
+        rebuild_weekly_summaries(conn=conn)
+
+# --- Data Versions ---
+# data_versions counts writes per user and kind of data, bumped by triggers so every write
+# path (app, batch writer, maintenance commands) is covered. Readers use it as a cheap
+# validator (ETag / Last-Modified) without loading the data itself.
+DATA_VERSION_TABLES = {"settings": "user_settings", "history": "workout_history", "plan": "weekly_plan"}
+DATA_VERSIONS_QUERY = "SELECT kind, version, updated_at FROM data_versions WHERE user_id = ?"
+
+def _data_version_trigger_sql(row, kind):
+    return f'''
+        INSERT INTO data_versions (user_id, kind) VALUES ({row}.user_id, '{kind}')
+        ON CONFLICT (user_id, kind) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+    '''
 
+def _create_data_versions_schema(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS data_versions (
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,                   -- 'settings', 'history' or 'plan'
+        version INTEGER NOT NULL DEFAULT 1,   -- Bumped on every insert, update or delete
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- UTC, second resolution
+        PRIMARY KEY (user_id, kind)
+    ) WITHOUT ROWID
+    ''')
+    triggers = []
+    for kind, table in DATA_VERSION_TABLES.items():
+        for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            triggers.append(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()} AFTER {event} ON {table}
+            BEGIN {_data_version_trigger_sql(row, kind)} END;
+            ''')
+    conn.executescript("".join(triggers))
+
+def _data_versions_from_rows(rows):
+    """{kind: (version, updated_at as an aware UTC datetime)}; kinds never written are (0, None)."""
+    versions = {kind: (0, None) for kind in DATA_VERSION_TABLES}
+    for kind, version, updated_at in rows:
+        versions[kind] = (version, datetime.fromisoformat(str(updated_at)).replace(tzinfo=timezone.utc))
+    return versions
+
+@query_stats.operation("get_data_versions")
+def get_data_versions(user_id, conn=None):
+    """Current data version and last change time of each kind of a user's data (see data_versions)."""
+    db_conn = conn or get_db_connection(user_id)
+    try:
+        return _data_versions_from_rows(db_conn.execute(DATA_VERSIONS_QUERY, (user_id,)).fetchall())
+    finally:
+        if not conn:
+            db_conn.close()
+
+@query_stats.operation("rebuild_weekly_summaries")
+def rebuild_weekly_summaries(user_id=None, conn=None, history_source="workout_history"):
+    """
+    Recomputes weekly_summary and weekly_muscle_summary from scratch, for one user or all.
+    history_source can be 'workout_history_all' (see archive.attach_archive) to include archived sessions.
+    Without conn, all users are rebuilt shard by shard.
+    """
+    if conn is None and user_id is None and SHARD_COUNT:
+        def rebuild_shard(shard_conn, path):
+            rebuild_weekly_summaries(conn=shard_conn, history_source=history_source)
+            shard_conn.commit()
+        for_each_shard(rebuild_shard)
+        return
+    db_conn = conn or get_db_connection(user_id)
+    cursor = db_conn.cursor()
+    user_filter = "WHERE user_id = :user_id" if user_id is not None else ""
+    history_filter = "AND h.user_id = :user_id" if user_id is not None else ""
+    params = {"user_id": user_id}
+    week = _week_start_sql("workout_date")
+    try:
+        cursor.execute(f"DELETE FROM weekly_summary {user_filter}", params)
+        cursor.execute(f"DELETE FROM weekly_muscle_summary {user_filter}", params)
+        cursor.execute(f'''
+            INSERT INTO weekly_summary (user_id, week_start_date, pillar, sessions)
+            SELECT user_id, {week}, {_pillar_key_sql("pillar")}, COUNT(*)
+            FROM {history_source} {user_filter}
+            GROUP BY 1, 2, 3
+        ''', params)
+        cursor.execute(f'''
+            INSERT INTO weekly_summary (user_id, week_start_date, pillar, planned, completed, skipped)
+            SELECT user_id, week_start_date, pillar_focus, COUNT(*),
+                   SUM(status = 'Completed'), SUM(status = 'Skipped')
+            FROM weekly_plan {user_filter}
+            GROUP BY 1, 2, 3
+            ON CONFLICT (user_id, week_start_date, pillar) DO UPDATE SET
+                planned = excluded.planned, completed = excluded.completed, skipped = excluded.skipped
+        ''', params)
+        cursor.execute(f'''
+            INSERT INTO weekly_muscle_summary (user_id, week_start_date, muscle, sessions)
+            SELECT h.user_id, {_week_start_sql("h.workout_date")}, j.value, COUNT(DISTINCT h.id)
+            FROM {history_source} AS h, json_each(h.muscles_worked) AS j
+            WHERE json_valid(h.muscles_worked) {history_filter}
+            GROUP BY 1, 2, 3
+        ''', params)
+        if not conn:
+            db_conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error rebuilding weekly summaries: {e}")
+        if not conn:
+            db_conn.rollback()
+        raise
+    finally:
+        if not conn:
+            db_conn.close()
+
+def get_history_writer():
+    """Returns the shared GroupCommitWriter, starting it on first use."""
+    global _history_writer
+    with _history_writer_lock:
+        if _history_writer is None:
+            from write_batcher import GroupCommitWriter
+            _history_writer = GroupCommitWriter(BATCH_MAX_SIZE, BATCH_MAX_DELAY_MS / 1000.0)
+            atexit.register(_history_writer.close)
+        return _history_writer
+
+def close_history_writer():
+    """Flushes and stops the shared writer (a later submit starts a new one)."""
+    global _history_writer
+    with _history_writer_lock:
+        writer, _history_writer = _history_writer, None
+    if writer is not None:
+        writer.close()
+        atexit.unregister(writer.close)
+
+def get_history_writer_stats():
+    """The running writer's counters plus its queue length, or None when no writer is running."""
+    writer = _history_writer
+    if writer is None:
+        return None
+    return {**writer.stats, "pending": writer.pending}
+
+def submit_workout_to_history(user_id, pillar, focus, muscles_worked, full_workout_text):
+    """
+    Queues a history save on the group-commit writer. Returns a Future that resolves to the
+    new workout id once the batch holding it has been committed.
+    """
+    params = (user_id, datetime.now(), pillar, focus, json.dumps(muscles_worked), full_workout_text)
+    return get_history_writer().submit(get_db_path(user_id), INSERT_WORKOUT_SQL, params)
+
+@query_stats.operation("save_workout_to_history")
 def save_workout_to_history(user_id, pillar, focus, muscles_worked, full_workout_text):
-    conn = get_db_connection()
+    """Saves a workout and returns its id. With WRITE_BATCHING, waits for the group commit."""
+    if WRITE_BATCHING:
+        return submit_workout_to_history(user_id, pillar, focus, muscles_worked, full_workout_text).result()
+
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
     muscles_worked_json = json.dumps(muscles_worked)
     try:
-        cursor.execute('''
-        INSERT INTO workout_history (user_id, workout_date, pillar, focus, muscles_worked, full_workout_text)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, datetime.now(), pillar, focus, muscles_worked_json, full_workout_text))
+        cursor.execute(INSERT_WORKOUT_SQL, (user_id, datetime.now(), pillar, focus, muscles_worked_json, full_workout_text))
         conn.commit()
+        return cursor.lastrowid
     except sqlite3.Error as e:
-        print(f"Database error: {e}")
+        logger.error(f"Database error: {e}")
         conn.rollback()
         raise
     finally:
         conn.close()
 
+@query_stats.operation("get_workout_history")
 def get_workout_history(user_id, days=14):
-    conn = get_db_connection()
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
     start_date = datetime.now() - timedelta(days=days)
     
-    cursor.execute('''
-    SELECT id, pillar, focus, muscles_worked, workout_date, full_workout_text
-    FROM workout_history
-    WHERE user_id = ? AND workout_date >= ?
-    ORDER BY workout_date DESC
-    ''', (user_id, start_date))
+    cursor.execute(WORKOUT_HISTORY_QUERY, (user_id, start_date))
     
-    history = []
-    for row in cursor.fetchall():
-        entry = dict(row)
-        if entry['muscles_worked']:
-            entry['muscles_worked'] = json.loads(entry['muscles_worked'])
-        else:
-            entry['muscles_worked'] = [] # Ensure it's always a list
-        history.append(entry)
+    history = [_history_row_to_entry(row) for row in cursor.fetchall()]
         
     conn.close()
     return history
 
-def delete_workout_from_history(workout_id):
-    conn = get_db_connection()
+def _history_row_to_entry(row):
+    entry = dict(row)
+    if entry['muscles_worked']:
+        entry['muscles_worked'] = json.loads(entry['muscles_worked'])
+    else:
+        entry['muscles_worked'] = [] # Ensure it's always a list
+    return entry
+
+@query_stats.operation("delete_workout_from_history")
+def delete_workout_from_history(workout_id, user_id=None):
+    """Deletes one history entry. user_id selects the shard and guards against deleting another user's entry."""
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM workout_history WHERE id = ?", (workout_id,))
+        if user_id is None:
+            cursor.execute("DELETE FROM workout_history WHERE id = ?", (workout_id,))
+        else:
+            cursor.execute("DELETE FROM workout_history WHERE id = ? AND user_id = ?", (workout_id, user_id))
         conn.commit()
     except sqlite3.Error as e:
-        print(f"Database error: {e}")
+        logger.error(f"Database error: {e}")
         conn.rollback()
         raise
     finally:
         conn.close()
 
-def get_user_settings(user_id):
-    conn = get_db_connection()
+# Fetch all relevant columns including the new ones
+USER_SETTINGS_QUERY = """
+    SELECT strength_freq, hiit_freq, zone2_freq, recovery_freq, stability_freq,
+           focus_rotation, primary_goal, ai_model_id, workout_duration_preference,
+           settings_version
+    FROM user_settings WHERE user_id = ?
+"""
+SETTINGS_VERSION_QUERY = "SELECT settings_version FROM user_settings WHERE user_id = ?"
+
+def _fetch_user_settings(conn, user_id):
+    """Reads and parses the settings row for a user. Returns (settings_version, settings)."""
     cursor = conn.cursor()
-    
-    # Fetch all relevant columns including the new ones
-    cursor.execute("""
-        SELECT strength_freq, hiit_freq, zone2_freq, recovery_freq, stability_freq,
-               focus_rotation, primary_goal, ai_model_id, workout_duration_preference
-        FROM user_settings WHERE user_id = ?
-    """, (user_id,))
-    settings_row = cursor.fetchone()
-    
+    cursor.execute(USER_SETTINGS_QUERY, (user_id,))
+    return _parse_settings_row(cursor.fetchone())
+
+def _parse_settings_row(settings_row):
     if settings_row:
         settings = dict(settings_row)
+        settings_version = settings.pop('settings_version')
         # Safely parse JSON for focus_rotation
         try:
             settings['focus_rotation'] = json.loads(settings['focus_rotation']) if settings['focus_rotation'] else []
@@ -234,6 +729,7 @@ def get_user_settings(user_id):
             settings['stability_freq'] = 1 # Default stability frequency
     else:
         # Return default settings if none found for the user
+        settings_version = None
         settings = {
             "strength_freq": 2,
             "hiit_freq": 1,
@@ -245,14 +741,79 @@ def get_user_settings(user_id):
             "ai_model_id": "gemini-1.5-flash-latest",
             "workout_duration_preference": "Any"
         }
-    conn.close()
-    return settings
+    return settings_version, settings
+
+def _copy_settings(settings):
+    # Callers may mutate the returned dict (and its focus_rotation list), never the cached one.
+    settings_copy = dict(settings)
+    settings_copy['focus_rotation'] = list(settings['focus_rotation'])
+    return settings_copy
+
+def _settings_cache_lookup(user_id, version_row):
+    """Returns a copy of the cached settings if their version matches version_row, else None."""
+    if not SETTINGS_CACHE:
+        return None
+    with _settings_cache_lock:
+        cached = _settings_cache.get(user_id)
+        if version_row and cached and cached[0] == version_row['settings_version']:
+            _settings_cache_stats['hits'] += 1
+            return _copy_settings(cached[1])
+        _settings_cache_stats['misses'] += 1
+        if cached:
+            # The row was rewritten by this or another process since it was cached.
+            _settings_cache.pop(user_id, None)
+            _settings_cache_stats['invalidations'] += 1
+    return None
+
+def _settings_cache_store(user_id, settings_version, settings):
+    if SETTINGS_CACHE and settings_version is not None: # Defaults for unknown users are not cached
+        with _settings_cache_lock:
+            _settings_cache[user_id] = (settings_version, settings)
+    return _copy_settings(settings)
+
+def _get_user_settings_cached(conn, user_id):
+    """Serves settings from the in-process cache when the stored settings_version still matches."""
+    cursor = conn.cursor()
+    cursor.execute(SETTINGS_VERSION_QUERY, (user_id,))
+    cached_settings = _settings_cache_lookup(user_id, cursor.fetchone())
+    if cached_settings is not None:
+        return cached_settings
+
+    settings_version, settings = _fetch_user_settings(conn, user_id)
+    return _settings_cache_store(user_id, settings_version, settings)
+
+@query_stats.operation("get_user_settings")
+def get_user_settings(user_id):
+    conn = get_db_connection(user_id)
+    try:
+        return _get_user_settings_cached(conn, user_id)
+    finally:
+        conn.close()
+
+def invalidate_settings_cache(user_id=None):
+    """Drops cached settings for one user, or for everyone when user_id is None."""
+    with _settings_cache_lock:
+        if user_id is None:
+            _settings_cache_stats['invalidations'] += len(_settings_cache)
+            _settings_cache.clear()
+        elif _settings_cache.pop(user_id, None) is not None:
+            _settings_cache_stats['invalidations'] += 1
+
+def get_settings_cache_stats():
+    """Returns hit/miss counters and the current size of the settings cache."""
+    with _settings_cache_lock:
+        stats = dict(_settings_cache_stats)
+        stats['size'] = len(_settings_cache)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = (stats['hits'] / lookups) if lookups else 0.0
+    return stats
 
 # --- Weekly Plan Functions ---
 
+@query_stats.operation("clear_weekly_plan")
 def clear_weekly_plan(user_id, week_start_date, conn=None):
     """Clears all weekly plan entries for a given user and week_start_date."""
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     cursor = db_conn.cursor()
     try:
         iso_week_start_date = week_start_date.isoformat() if isinstance(week_start_date, date) else week_start_date
@@ -262,9 +823,9 @@ def clear_weekly_plan(user_id, week_start_date, conn=None):
         )
         if not conn: # Only commit if this function owns the connection
             db_conn.commit()
-        print(f"Cleared weekly plan for user {user_id}, week starting {iso_week_start_date}")
+        logger.debug(f"Cleared weekly plan for user {user_id}, week starting {iso_week_start_date}")
     except sqlite3.Error as e:
-        print(f"Database error clearing weekly plan: {e}")
+        logger.error(f"Database error clearing weekly plan: {e}")
         if not conn:
             db_conn.rollback()
         raise # Re-raise the exception to be handled by the caller
@@ -272,24 +833,40 @@ def clear_weekly_plan(user_id, week_start_date, conn=None):
         if not conn: # Only close if this function owns the connection
             db_conn.close()
 
+INSERT_PLAN_ENTRY_SQL = '''
+    INSERT INTO weekly_plan (user_id, week_start_date, day_of_week, pillar_focus, status, workout_id,
+                             session_focus, phase, load_factor)
+    VALUES (:user_id, :week_start_date, :day_of_week, :pillar_focus, :status, :workout_id,
+            :session_focus, :phase, :load_factor)
+'''
+
+def _plan_entry_params(plan_entry_data):
+    """Named parameters for INSERT_PLAN_ENTRY_SQL; periodization fields are optional."""
+    params = {
+        "status": "Planned", "workout_id": None,
+        "session_focus": None, "phase": None, "load_factor": 1.0,
+    }
+    params.update(plan_entry_data)
+    if isinstance(params['week_start_date'], date):
+        params['week_start_date'] = params['week_start_date'].isoformat()
+    return params
+
+@query_stats.operation("save_daily_plan_entry")
 def save_daily_plan_entry(plan_entry_data, conn=None):
     """Saves a single day's plan entry into the weekly_plan table."""
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(plan_entry_data['user_id'])
     cursor = db_conn.cursor()
     try:
         # Ensure week_start_date is in ISO format if it's a date object
         if 'week_start_date' in plan_entry_data and isinstance(plan_entry_data['week_start_date'], date):
             plan_entry_data['week_start_date'] = plan_entry_data['week_start_date'].isoformat()
 
-        cursor.execute('''
-            INSERT INTO weekly_plan (user_id, week_start_date, day_of_week, pillar_focus, status, workout_id)
-            VALUES (:user_id, :week_start_date, :day_of_week, :pillar_focus, :status, :workout_id)
-        ''', plan_entry_data)
+        cursor.execute(INSERT_PLAN_ENTRY_SQL, _plan_entry_params(plan_entry_data))
         if not conn: # Only commit if this function owns the connection
             db_conn.commit()
         # print(f"Saved daily plan entry: {plan_entry_data}") # Can be verbose
     except sqlite3.Error as e:
-        print(f"Database error saving daily plan entry: {e}")
+        logger.error(f"Database error saving daily plan entry: {e}")
         if not conn:
             db_conn.rollback()
         raise
@@ -297,75 +874,439 @@ def save_daily_plan_entry(plan_entry_data, conn=None):
         if not conn:
             db_conn.close()
 
+@query_stats.operation("replace_weekly_plan")
+def replace_weekly_plan(user_id, week_start_date, plan_entries):
+    """
+    Replaces a user's plan for one week in a single transaction. plan_entries are dicts with
+    day_of_week and pillar_focus (status defaults to 'Planned', workout_id to None).
+    """
+    replace_weekly_plans(user_id, {week_start_date: plan_entries})
+
+@query_stats.operation("replace_weekly_plans")
+def replace_weekly_plans(user_id, plans_by_week):
+    """
+    Replaces several weeks of a user's plan ({week_start_date: plan_entries}) in one
+    transaction: one batched DELETE and one batched INSERT, so a multi-week plan costs a
+    single commit and readers never see a half-written horizon.
+    """
+    week_keys = [week.isoformat() if isinstance(week, date) else week for week in plans_by_week]
+    rows = [
+        _plan_entry_params(dict(plan_entry, user_id=user_id, week_start_date=week_key))
+        for week_key, plan_entries in zip(week_keys, plans_by_week.values())
+        for plan_entry in plan_entries
+    ]
+    conn = get_db_connection(user_id)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("DELETE FROM weekly_plan WHERE user_id = ? AND week_start_date = ?",
+                         [(user_id, week_key) for week_key in week_keys])
+        conn.executemany(INSERT_PLAN_ENTRY_SQL, rows)
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error replacing weekly plans: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+UPDATE_PLANNED_ENTRY_SQL = '''
+    UPDATE weekly_plan SET pillar_focus = :pillar_focus, session_focus = :session_focus,
+                           phase = :phase, load_factor = :load_factor
+    WHERE id = :id AND user_id = :user_id AND status = 'Planned'
+'''
+
+@query_stats.operation("apply_weekly_plan_changes")
+def apply_weekly_plan_changes(user_id, changes_by_week):
+    """
+    Applies a plan diff ({week_start_date: (updates, inserts)}) in one transaction. updates are
+    entries with the id of the row to change; only rows still 'Planned' are touched, so a day
+    completed or skipped since the diff was computed keeps its entry. inserts are new days.
+    Returns the number of rows changed.
+    """
+    update_rows, insert_rows = [], []
+    for week_start_date, (updates, inserts) in changes_by_week.items():
+        week_key = week_start_date.isoformat() if isinstance(week_start_date, date) else week_start_date
+        update_rows.extend(_plan_entry_params(dict(entry, user_id=user_id, week_start_date=week_key)) for entry in updates)
+        insert_rows.extend(_plan_entry_params(dict(entry, user_id=user_id, week_start_date=week_key)) for entry in inserts)
+    conn = get_db_connection(user_id)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        changed = conn.executemany(UPDATE_PLANNED_ENTRY_SQL, update_rows).rowcount if update_rows else 0
+        if insert_rows:
+            conn.executemany(INSERT_PLAN_ENTRY_SQL, insert_rows)
+        conn.commit()
+        return changed + len(insert_rows)
+    except sqlite3.Error as e:
+        logger.error(f"Database error applying weekly plan changes: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def get_replan_inputs(conn, previous_week, target_week):
+    """
+    Bulk read for re-planning every user on one database (shard): returns
+    (settings by user_id, previous_week plan entries by user_id, target_week plan entries by user_id).
+    Users without a plan for target_week have no entry in the last dict.
+    """
+    previous_week, target_week = (week.isoformat() if isinstance(week, date) else week for week in (previous_week, target_week))
+    settings_by_user = {}
+    for row in conn.execute('''
+        SELECT user_id, strength_freq, hiit_freq, zone2_freq, recovery_freq, stability_freq,
+               focus_rotation, primary_goal, ai_model_id, workout_duration_preference, settings_version
+        FROM user_settings ORDER BY user_id
+    '''):
+        row = dict(row)
+        user_id = row.pop('user_id')
+        settings_by_user[user_id] = _parse_settings_row(row)[1]
+    previous_by_user = {}
+    for row in conn.execute('''
+        SELECT user_id, day_of_week, pillar_focus, session_focus, phase, load_factor
+        FROM weekly_plan WHERE week_start_date = ? ORDER BY user_id, day_of_week
+    ''', (previous_week,)):
+        previous_by_user.setdefault(row['user_id'], []).append(dict(row))
+    target_by_user = {}
+    for row in conn.execute('''
+        SELECT id, user_id, day_of_week, pillar_focus, session_focus, phase, load_factor, status
+        FROM weekly_plan WHERE week_start_date = ? ORDER BY user_id, day_of_week
+    ''', (target_week,)):
+        target_by_user.setdefault(row['user_id'], []).append(dict(row))
+    return settings_by_user, previous_by_user, target_by_user
+
+def write_weekly_plan_changes_for_users(conn, week_start_date, changes_by_user):
+    """
+    Applies week_start_date's plan diff for many users ({user_id: (updates, inserts)}, as in
+    apply_weekly_plan_changes) in one transaction on conn. Only entries still 'Planned' are updated.
+    """
+    week_key = week_start_date.isoformat() if isinstance(week_start_date, date) else week_start_date
+    update_rows, insert_rows = [], []
+    for user_id, (updates, inserts) in changes_by_user.items():
+        update_rows.extend(_plan_entry_params(dict(entry, user_id=user_id, week_start_date=week_key)) for entry in updates)
+        insert_rows.extend(_plan_entry_params(dict(entry, user_id=user_id, week_start_date=week_key)) for entry in inserts)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if update_rows:
+            conn.executemany(UPDATE_PLANNED_ENTRY_SQL, update_rows)
+        if insert_rows:
+            conn.executemany(INSERT_PLAN_ENTRY_SQL, insert_rows)
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error writing weekly plans: {e}")
+        conn.rollback()
+        raise
+
+WEEKLY_PLAN_QUERY = '''
+    SELECT id, user_id, week_start_date, day_of_week, pillar_focus, workout_id, status,
+           session_focus, phase, load_factor
+    FROM weekly_plan
+    WHERE user_id = ? AND week_start_date = ?
+    ORDER BY day_of_week ASC
+'''
+
+@query_stats.operation("get_weekly_plan")
 def get_weekly_plan(user_id, week_start_date, conn=None):
     """Retrieves the weekly plan for a given user and week_start_date."""
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     cursor = db_conn.cursor()
     try:
         iso_week_start_date = week_start_date.isoformat() if isinstance(week_start_date, date) else week_start_date
-        cursor.execute('''
-            SELECT id, user_id, week_start_date, day_of_week, pillar_focus, workout_id, status
-            FROM weekly_plan
-            WHERE user_id = ? AND week_start_date = ?
-            ORDER BY day_of_week ASC
-        ''', (user_id, iso_week_start_date))
+        cursor.execute(WEEKLY_PLAN_QUERY, (user_id, iso_week_start_date))
 
         plan_entries = [dict(row) for row in cursor.fetchall()]
         return plan_entries
     except sqlite3.Error as e:
-        print(f"Database error retrieving weekly plan: {e}")
+        logger.error(f"Database error retrieving weekly plan: {e}")
         raise
     finally:
         if not conn:
             db_conn.close()
 
-# --- User Settings Functions ---
+@query_stats.operation("update_plan_entry_status")
+def update_plan_entry_status(user_id, plan_entry_id, status, workout_id=None, conn=None):
+    """
+    Sets the status ('Planned', 'Completed', 'Skipped') and linked workout of one of the user's
+    plan entries. Returns False when the entry does not exist or belongs to another user.
+    """
+    db_conn = conn or get_db_connection(user_id)
+    cursor = db_conn.cursor()
+    try:
+        cursor.execute(
+            "UPDATE weekly_plan SET status = ?, workout_id = COALESCE(?, workout_id) WHERE id = ? AND user_id = ?",
+            (status, workout_id, plan_entry_id, user_id)
+        )
+        if not conn:
+            db_conn.commit()
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Database error updating plan entry status: {e}")
+        if not conn:
+            db_conn.rollback()
+        raise
+    finally:
+        if not conn:
+            db_conn.close()
 
-def save_user_settings(user_id, settings_dict):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+# --- Weekly Summary Functions ---
 
+@query_stats.operation("get_weekly_summaries")
+def get_weekly_summaries(user_id, start_week, end_week, conn=None):
+    """
+    Returns per-week rollups between two Mondays (inclusive), oldest first:
+    [{"week_start_date", "pillars": {pillar: {sessions, planned, completed, skipped}}, "muscles": {muscle: sessions}}]
+    Each table is read with one range scan over its (user_id, week_start_date, ...) primary key.
+    """
+    db_conn = conn or get_db_connection(user_id)
+    cursor = db_conn.cursor()
+    params = (user_id,
+              start_week.isoformat() if isinstance(start_week, date) else start_week,
+              end_week.isoformat() if isinstance(end_week, date) else end_week)
+    try:
+        weeks = {}
+        cursor.execute('''
+            SELECT week_start_date, pillar, sessions, planned, completed, skipped
+            FROM weekly_summary
+            WHERE user_id = ? AND week_start_date BETWEEN ? AND ?
+            ORDER BY week_start_date, pillar
+        ''', params)
+        for row in cursor.fetchall():
+            if not (row['sessions'] or row['planned']):
+                continue # Rows drained to zero by deletes
+            week = weeks.setdefault(row['week_start_date'], {"week_start_date": row['week_start_date'], "pillars": {}, "muscles": {}})
+            week['pillars'][row['pillar']] = {
+                "sessions": row['sessions'], "planned": row['planned'],
+                "completed": row['completed'], "skipped": row['skipped'],
+            }
+        cursor.execute('''
+            SELECT week_start_date, muscle, sessions
+            FROM weekly_muscle_summary
+            WHERE user_id = ? AND week_start_date BETWEEN ? AND ? AND sessions > 0
+            ORDER BY week_start_date, muscle
+        ''', params)
+        for row in cursor.fetchall():
+            week = weeks.setdefault(row['week_start_date'], {"week_start_date": row['week_start_date'], "pillars": {}, "muscles": {}})
+            week['muscles'][row['muscle']] = row['sessions']
+        return [weeks[week_start] for week_start in sorted(weeks)]
+    except sqlite3.Error as e:
+        logger.error(f"Database error retrieving weekly summaries: {e}")
+        raise
+    finally:
+        if not conn:
+            db_conn.close()
+
+# --- User Settings Functions ---
+
+def _settings_write_statement(user_id, settings_dict, exists):
+    """Builds the UPDATE (or INSERT for new users) statement and params for save_user_settings."""
     # Ensure focus_rotation is a JSON string
     if 'focus_rotation' in settings_dict and isinstance(settings_dict['focus_rotation'], list):
         settings_dict['focus_rotation'] = json.dumps(settings_dict['focus_rotation'])
 
+    if exists:
+        # Update existing settings
+        # Construct the SET part of the SQL query dynamically
+        set_clause = ", ".join([f"{key} = :{key}" for key in settings_dict.keys()])
+        # Bumping the version invalidates cached copies in every worker process
+        sql = f"UPDATE user_settings SET {set_clause}, settings_version = settings_version + 1 WHERE user_id = :user_id"
+        
+        params_to_update = settings_dict.copy()
+        params_to_update['user_id'] = user_id 
+        return sql, params_to_update
+
+    # Insert new settings
+    # Ensure all required fields for insertion are present, using defaults if necessary
+    # This is important if settings_dict doesn't contain all fields
+    # Or, we retrieve current, update, then save. For simplicity, assume settings_dict is complete for insert.
+    # A more robust way would be to merge with default values first.
+    
+    # Add user_id to the dictionary for insertion
+    settings_dict['user_id'] = user_id
+    columns = ', '.join(settings_dict.keys())
+    placeholders = ', '.join([f":{key}" for key in settings_dict.keys()])
+    sql = f"INSERT INTO user_settings ({columns}) VALUES ({placeholders})"
+    return sql, settings_dict
+
+@query_stats.operation("save_user_settings")
+def save_user_settings(user_id, settings_dict):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+
     # Check if settings for this user_id already exist
     cursor.execute("SELECT id FROM user_settings WHERE user_id = ?", (user_id,))
     existing_setting = cursor.fetchone()
 
     try:
-        if existing_setting:
-            # Update existing settings
-            # Construct the SET part of the SQL query dynamically
-            set_clause = ", ".join([f"{key} = :{key}" for key in settings_dict.keys()])
-            sql = f"UPDATE user_settings SET {set_clause} WHERE user_id = :user_id"
-            
-            params_to_update = settings_dict.copy()
-            params_to_update['user_id'] = user_id 
-            
-            cursor.execute(sql, params_to_update)
-        else:
-            # Insert new settings
-            # Ensure all required fields for insertion are present, using defaults if necessary
-            # This is important if settings_dict doesn't contain all fields
-            # Or, we retrieve current, update, then save. For simplicity, assume settings_dict is complete for insert.
-            # A more robust way would be to merge with default values first.
-            
-            # Add user_id to the dictionary for insertion
-            settings_dict['user_id'] = user_id
-            columns = ', '.join(settings_dict.keys())
-            placeholders = ', '.join([f":{key}" for key in settings_dict.keys()])
-            sql = f"INSERT INTO user_settings ({columns}) VALUES ({placeholders})"
-            cursor.execute(sql, settings_dict)
-        
+        sql, params = _settings_write_statement(user_id, settings_dict, existing_setting is not None)
+        cursor.execute(sql, params)
+        conn.commit()
+        invalidate_settings_cache(user_id)
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# --- User Credentials ---
+
+@query_stats.operation("get_user_api_key")
+def get_user_api_key(user_id, provider="gemini"):
+    """The user's own key for provider, or None."""
+    conn = get_db_connection(user_id)
+    try:
+        row = conn.execute("SELECT api_key FROM user_credentials WHERE user_id = ? AND provider = ?",
+                           (user_id, provider)).fetchone()
+        return (row['api_key'] or None) if row else None # '' once deleted
+    finally:
+        conn.close()
+
+@query_stats.operation("get_user_api_key_version")
+def get_user_api_key_version(user_id, provider="gemini"):
+    """The version of the user's key for provider, bumped by every save and delete; None if never saved."""
+    conn = get_db_connection(user_id)
+    try:
+        row = conn.execute("SELECT version FROM user_credentials WHERE user_id = ? AND provider = ?",
+                           (user_id, provider)).fetchone()
+        return row['version'] if row else None
+    finally:
+        conn.close()
+
+@query_stats.operation("save_user_api_key")
+def save_user_api_key(user_id, api_key, provider="gemini"):
+    conn = get_db_connection(user_id)
+    try:
+        conn.execute('''
+            INSERT INTO user_credentials (user_id, provider, api_key) VALUES (?, ?, ?)
+            ON CONFLICT (user_id, provider) DO UPDATE
+            SET api_key = excluded.api_key, version = version + 1, updated_at = CURRENT_TIMESTAMP
+        ''', (user_id, provider, api_key))
         conn.commit()
     except sqlite3.Error as e:
-        print(f"Database error: {e}")
+        logger.error(f"Database error saving API key for user_id {user_id}: {e}")
         conn.rollback()
         raise
     finally:
         conn.close()
 
+@query_stats.operation("delete_user_api_key")
+def delete_user_api_key(user_id, provider="gemini"):
+    conn = get_db_connection(user_id)
+    try:
+        # The row stays with an empty key, so its version keeps counting: a key saved again later
+        # can never match a version another process cached before the delete
+        conn.execute('''
+            UPDATE user_credentials SET api_key = '', version = version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ? AND provider = ?
+        ''', (user_id, provider))
+        conn.commit()
+    finally:
+        conn.close()
+
+# --- Generation Context ---
+
+@dataclass(frozen=True)
+class GenerationContext:
+    """Read-only snapshot of everything /generate_workout needs from the database."""
+    user_id: int
+    settings: MappingProxyType
+    todays_plan_entry: MappingProxyType # None when today has no plan row
+    recent_sessions: tuple # Newest first, each a MappingProxyType without full_workout_text
+
+    @property
+    def todays_planned_pillar(self):
+        if self.todays_plan_entry:
+            entry = self.todays_plan_entry
+            details = []
+            if entry.get('session_focus'):
+                details.append(entry['session_focus'])
+            if entry.get('phase'):
+                details.append(f"{entry['phase']} week, load x{entry['load_factor']:g}")
+            suffix = f" ({', '.join(details)})" if details else ""
+            return f"Today's Planned Pillar: {entry['pillar_focus']}{suffix}"
+        return "Today's Planned Pillar: Not specifically planned (User selected)."
+
+    @property
+    def recent_history(self):
+        if not self.recent_sessions:
+            return "Recent Training History: No recent workouts logged."
+        history_summary_parts = []
+        for entry in self.recent_sessions:
+            muscles = ', '.join(entry['muscles_worked'])
+            history_summary_parts.append(f"- {entry['workout_date'][:10]}: {entry['pillar']}, Focus: {entry['focus']}, Muscles: {muscles}")
+        return "Recent Training History (last few sessions):\n" + "\n".join(history_summary_parts)
+
+TODAYS_PLAN_QUERY = '''
+    SELECT id, user_id, week_start_date, day_of_week, pillar_focus, workout_id, status,
+           session_focus, phase, load_factor
+    FROM weekly_plan
+    WHERE user_id = ? AND week_start_date = ? AND day_of_week = ?
+    ORDER BY id ASC LIMIT 1
+'''
+# Only the summary columns are needed; full_workout_text is never read here
+RECENT_SESSIONS_QUERY = '''
+    SELECT pillar, focus, muscles_worked, workout_date
+    FROM workout_history
+    WHERE user_id = ? AND workout_date >= ?
+    ORDER BY workout_date DESC
+    LIMIT ?
+'''
+
+def _generation_context_params(user_id, today, history_days, history_limit):
+    """Returns the parameters for TODAYS_PLAN_QUERY and RECENT_SESSIONS_QUERY."""
+    today = today or date.today()
+    week_start_date = today - timedelta(days=today.weekday())
+    start_date = datetime.now() - timedelta(days=history_days)
+    return (user_id, week_start_date.isoformat(), today.weekday()), (user_id, start_date, history_limit)
+
+def _build_generation_context(user_id, settings, plan_row, session_rows):
+    return GenerationContext(
+        user_id=user_id,
+        settings=MappingProxyType(settings),
+        todays_plan_entry=MappingProxyType(dict(plan_row)) if plan_row else None,
+        recent_sessions=tuple(MappingProxyType(_history_row_to_entry(row)) for row in session_rows),
+    )
+
+@query_stats.operation("get_generation_context")
+def get_generation_context(user_id, today=None, history_days=4, history_limit=3):
+    """
+    Builds a GenerationContext using one connection and one read transaction, so settings,
+    today's plan entry and recent sessions are read from the same consistent database state.
+    """
+    plan_params, sessions_params = _generation_context_params(user_id, today, history_days, history_limit)
+    conn = get_db_connection(user_id)
+    try:
+        conn.execute("BEGIN") # Read transaction: all three reads see the same snapshot
+        settings = _get_user_settings_cached(conn, user_id)
+        cursor = conn.cursor()
+        cursor.execute(TODAYS_PLAN_QUERY, plan_params)
+        plan_row = cursor.fetchone()
+        cursor.execute(RECENT_SESSIONS_QUERY, sessions_params)
+        session_rows = cursor.fetchall()
+        conn.rollback() # Nothing was written; just end the read transaction
+    finally:
+        conn.close()
+    return _build_generation_context(user_id, settings, plan_row, session_rows)
+
+@query_stats.operation("get_bootstrap_state")
+def get_bootstrap_state(user_id, week_start_date, history_days=14):
+    """
+    Everything the page needs on first load, read with one connection in one read transaction:
+    {"settings", "weekly_plan" (week_start_date's entries), "workout_history" (last history_days
+    days, newest first), "versions" (see get_data_versions)}.
+    """
+    iso_week_start_date = week_start_date.isoformat() if isinstance(week_start_date, date) else week_start_date
+    start_date = datetime.now() - timedelta(days=history_days)
+    conn = get_db_connection(user_id)
+    try:
+        conn.execute("BEGIN") # Read transaction: every part comes from the same snapshot
+        versions = _data_versions_from_rows(conn.execute(DATA_VERSIONS_QUERY, (user_id,)).fetchall())
+        settings = _get_user_settings_cached(conn, user_id)
+        plan = [dict(row) for row in conn.execute(WEEKLY_PLAN_QUERY, (user_id, iso_week_start_date)).fetchall()]
+        history = [_history_row_to_entry(row) for row in conn.execute(WORKOUT_HISTORY_QUERY, (user_id, start_date)).fetchall()]
+        conn.rollback() # Nothing was written; just end the read transaction
+    finally:
+        conn.close()
+    return {"settings": settings, "weekly_plan": plan, "workout_history": history, "versions": versions}
+
 if __name__ == '__main__':
     # Example usage (for testing purposes)
     print("Setting up database...")
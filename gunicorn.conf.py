@@ -0,0 +1,52 @@
+"""
+Gunicorn settings for the production entry point (wsgi.py):
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Sizing: a /generate_workout request spends seconds waiting on Gemini while holding a thread,
+and everything else is a few milliseconds of SQLite work. So each worker process runs many
+threads (gthread), and the number of processes follows the CPU count, capped because SQLite
+takes one writer per database file at a time and more processes mostly add lock waits.
+
+The app is preloaded in the master: the schema is set up once, and each forked worker starts
+with fresh locks, writer and replan threads (os.register_at_fork hooks in database.py,
+query_stats.py and weekly_planner.py). On SIGTERM a worker stops taking connections, finishes
+its requests within graceful_timeout, then worker_exit drains anything still generating and
+flushes batched writes and hands its counters to the metrics directory.
+
+/metrics reports every worker: each one writes snapshots to METRICS_MULTIPROC_DIR (a fresh
+temporary directory per start unless set), and a scrape of any worker adds them up (see
+metrics.py).
+
+Environment: BIND, WEB_CONCURRENCY (processes), GUNICORN_THREADS, GUNICORN_TIMEOUT,
+GRACEFUL_TIMEOUT, plus everything create_app reads (see app.default_config).
+"""
+import os
+import tempfile
+import multiprocessing
+
+bind = os.getenv("BIND", "127.0.0.1:8000")
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count(), 4)))
+# The workers split the global AI provider limits between them (see rate_limit.py); read when the app loads
+os.environ.setdefault("RATE_LIMIT_PROCESSES", str(workers))
+# Where the workers share their metrics (see metrics.py); a new one per start, so counters start at zero
+if not os.getenv("METRICS_MULTIPROC_DIR"):
+    os.environ["METRICS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="workout_metrics_")
+threads = int(os.getenv("GUNICORN_THREADS", 16)) # Mostly idle, waiting on the AI provider
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120)) # Above the slowest generation we expect
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 60))
+keepalive = 5
+preload_app = True
+# Recycle workers now and then; jitter keeps them from restarting at the same time
+max_requests = 5000
+max_requests_jitter = 500
+accesslog = "-"
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} started ({threads} threads).")
+
+def worker_exit(server, worker):
+    from wsgi import app
+    from app import shutdown
+    shutdown(app, timeout=graceful_timeout)
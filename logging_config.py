@@ -0,0 +1,173 @@
+"""
+Logging for the app: structured records written by a background thread.
+
+configure_logging() (create_app and the ASGI app call it) gives the root logger one QueueHandler.
+A log call only puts the record on an in-memory queue; a QueueListener thread formats it and
+writes it to stderr (or LOG_FILE), so a request never waits on that I/O. Each record is a JSON
+object:
+    {"time", "level", "logger", "message", "request_id", ...fields, "exception"}
+request_id is the request's trace id, the X-Trace-Id response header (see tracing.py), so a
+user's report, the log lines and the spans of a request can be matched up. Fields passed as
+extra={"fields": {...}} are added to the object.
+
+Large payloads (the inputs a workout is generated from, prompts, raw AI replies) are logged
+with log_payload(): string values are truncated to LOG_MAX_FIELD_CHARS, and below WARNING only
+LOG_PAYLOAD_SAMPLE_RATE of them are written. LOG_FULL_PROMPTS=1 writes every payload in full,
+the generator's prompts included, for debugging a generation.
+
+Environment:
+    LOG_LEVEL=INFO
+    LOG_FORMAT=json               or text, for reading in a terminal
+    LOG_FILE=path                 write here instead of stderr
+    LOG_MAX_FIELD_CHARS=500
+    LOG_PAYLOAD_SAMPLE_RATE=0.05
+    LOG_FULL_PROMPTS=0
+"""
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+import tracing
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_FILE = os.getenv("LOG_FILE") or None
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", 500))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.05))
+LOG_FULL_PROMPTS = os.getenv("LOG_FULL_PROMPTS", "0") == "1"
+
+_handler = None  # The root logger's QueueHandler, once configured
+_listener = None # Its QueueListener
+_configure_lock = threading.Lock()
+
+def truncate(value, limit=None):
+    """A copy of value with strings (also inside dicts and lists) cut to limit characters; 0 keeps them whole."""
+    limit = LOG_MAX_FIELD_CHARS if limit is None else limit
+    if isinstance(value, str):
+        return f"{value[:limit]}... [{len(value) - limit} more chars]" if limit and len(value) > limit else value
+    if isinstance(value, dict):
+        return {key: truncate(item, limit) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [truncate(item, limit) for item in value]
+    return value
+
+def log_payload(logger, level, message, payload, **fields):
+    """Logs message with payload as a field, sampled and truncated as the module docstring describes."""
+    if not logger.isEnabledFor(level):
+        return
+    if not LOG_FULL_PROMPTS and level < logging.WARNING and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    # Copied here: the listener formats the record later, after the caller may have changed payload
+    payload = truncate(payload, 0 if LOG_FULL_PROMPTS else None)
+    logger.log(level, message, extra={"fields": {**fields, "payload": payload}})
+
+class RequestIdFilter(logging.Filter):
+    """Sets record.request_id to the current trace id. Runs on the thread that logs, where the span is current."""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            span = tracing.current_span()
+            record.request_id = span.trace_id if span is not None else None
+        return True
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            entry.setdefault(key, value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record):
+        record.request_id = getattr(record, "request_id", None) or "-"
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        return f"{text} {json.dumps(fields, default=str)}" if fields else text
+
+class _QueueHandler(QueueHandler):
+
+    def prepare(self, record):
+        # The default merges the traceback into the message; keep them apart for the formatter
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def configure_logging(level=None, fmt=None, stream=None):
+    """
+    Routes the root logger through the queue to stderr, LOG_FILE or stream, replacing an earlier
+    configure_logging() setup (handlers others added are left alone). Returns the QueueHandler.
+    """
+    global _handler, _listener
+    with _configure_lock:
+        _stop()
+        if stream is not None:
+            target = logging.StreamHandler(stream)
+        elif LOG_FILE:
+            target = logging.FileHandler(LOG_FILE, encoding="utf-8")
+        else:
+            target = logging.StreamHandler(sys.stderr)
+        target.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+
+        log_queue = queue.SimpleQueue()
+        _handler = _QueueHandler(log_queue)
+        _handler.addFilter(RequestIdFilter())
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(level or LOG_LEVEL)
+        _listener = QueueListener(log_queue, target)
+        _listener.start()
+        return _handler
+
+def _stop():
+    global _handler, _listener
+    if _listener is not None:
+        _listener.stop() # Writes what is still queued
+        for target in _listener.handlers:
+            target.close()
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+    _handler = _listener = None
+
+def stop_logging():
+    """Writes every queued record, then removes the queue handler (at exit, or before reading a log)."""
+    with _configure_lock:
+        _stop()
+
+def _reset_after_fork():
+    # The listener thread is not copied into a forked child: give the child its own queue and thread
+    global _listener, _configure_lock
+    _configure_lock = threading.Lock()
+    if _listener is not None:
+        log_queue = queue.SimpleQueue()
+        _handler.queue = log_queue
+        _listener = QueueListener(log_queue, *_listener.handlers)
+        _listener.start()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(stop_logging)
@@ -0,0 +1,255 @@
+"""
+Maintenance commands for the workout generator database.
+
+Usage:
+    python manage.py archive --older-than-days 180 --dry-run
+    python manage.py archive --older-than-days 180 --compress
+    python manage.py rebuild-summaries [--user-id 1]
+    python manage.py export --output backup.jsonl
+    python manage.py replan [--week-start 2024-07-22] [--workers 4]
+
+With DB_SHARD_COUNT set, every command runs across all shards.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import database
+import archive
+import weekly_planner
+
+def cmd_archive(args):
+    report = archive.archive_workout_history(
+        older_than_days=args.older_than_days,
+        compress=args.compress,
+        dry_run=args.dry_run,
+        archive_path=args.archive_db,
+        vacuum_pages=args.vacuum_pages,
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    action = "Would archive" if args.dry_run else "Archived"
+    count = report['entries'] if args.dry_run else report['archived']
+    print(f"{action} {count} of {report['total_entries']} workout_history entries older than {report['cutoff']}")
+    print(f"  users affected: {report['users']}")
+    print(f"  workout text:   {report['text_bytes']} bytes{' (compressed in archive)' if args.compress else ''}")
+    print(f"  date range:     {report['oldest'] or '-'} .. {report['newest'] or '-'}")
+    if not args.dry_run:
+        print(f"  pages reclaimed by incremental vacuum: {report['reclaimed_pages']}")
+    return 0
+
+def cmd_rebuild_summaries(args):
+    def rebuild_shard(conn, db_path):
+        history_source = "workout_history"
+        if not args.skip_archive:
+            archive.attach_archive(conn, archive.archive_path_for(db_path, args.archive_db))
+            history_source = "workout_history_all" # Archived sessions still count
+        database.rebuild_weekly_summaries(user_id=args.user_id, conn=conn, history_source=history_source)
+        conn.commit()
+        return conn.execute("SELECT COUNT(*) FROM weekly_summary").fetchone()[0]
+
+    if args.user_id is not None:
+        conn = database.get_db_connection(args.user_id)
+        try:
+            rows = rebuild_shard(conn, database.get_db_path(args.user_id))
+        finally:
+            conn.close()
+    else:
+        rows = sum(database.for_each_shard(rebuild_shard))
+    scope = f"user {args.user_id}" if args.user_id is not None else "all users"
+    print(f"Rebuilt weekly summaries for {scope}; weekly_summary now holds {rows} rows.")
+    return 0
+
+EXPORT_TABLES = ["user_settings", "weekly_plan", "workout_history"]
+
+def cmd_export(args):
+    """Writes one JSON object per row ({"table": ..., "row": {...}}) for every user-data table on every shard."""
+    def export_shard(conn, db_path):
+        written = 0
+        for table in EXPORT_TABLES:
+            for row in conn.execute(f"SELECT * FROM {table} ORDER BY user_id, id"):
+                out.write(json.dumps({"table": table, "row": dict(row)}, default=str) + "\n")
+                written += 1
+        return written
+
+    out = open(args.output, "w", encoding="utf-8") if args.output != "-" else sys.stdout
+    try:
+        for user in database.list_users():
+            out.write(json.dumps({"table": "users", "row": user}) + "\n")
+        rows = sum(database.for_each_shard(export_shard))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Exported {rows} rows from {len(database.get_user_data_paths())} database(s) to {args.output}.", file=sys.stderr)
+    return 0
+
+def _plan_batch(batch, week_start_date):
+    """
+    Runs in a worker process: [(user_id, settings, previous_week, stored_week)] -> [(user_id, (updates, inserts))],
+    the changes that turn the stored week (empty unless re-planning with --force) into the planned one.
+    """
+    return [(user_id, weekly_planner.diff_week_plan(
+                stored_week, weekly_planner.plan_following_week(settings, previous_week, week_start_date)))
+            for user_id, settings, previous_week, stored_week in batch]
+
+def _load_checkpoint(path, week_key):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return set()
+    if checkpoint.get("week_start_date") != week_key:
+        return set() # Left over from another week's run
+    return set(checkpoint.get("done", []))
+
+def _save_checkpoint(path, week_key, done):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"week_start_date": week_key, "done": sorted(done)}, f)
+    os.replace(tmp_path, path) # Atomic, so an interrupted run never leaves a torn checkpoint
+
+def _next_monday(today=None):
+    today = today or datetime.date.today()
+    return today + datetime.timedelta(days=7 - today.weekday())
+
+def cmd_replan(args):
+    """
+    Plans one week (next Monday's by default) for every user with settings, continuing each
+    user's mesocycle and focus rotation from the week before. Plans are computed in a process
+    pool and written per shard, one transaction per batch. Committed users are recorded in a
+    checkpoint file, so an interrupted run picks up where it stopped. With --force, users who
+    already have the week are re-planned like a settings change: completed and skipped days stay.
+    """
+    week_start = datetime.date.fromisoformat(args.week_start) if args.week_start else _next_monday()
+    if week_start.weekday() != 0:
+        print(f"--week-start must be a Monday, got {week_start} ({week_start.strftime('%A')}).", file=sys.stderr)
+        return 2
+    week_key = week_start.isoformat()
+    checkpoint_path = args.checkpoint or f"replan_{week_key}.checkpoint.json"
+    done = _load_checkpoint(checkpoint_path, week_key)
+    stats = {"week_start_date": week_key, "planned": 0, "already_planned": 0, "resumed": len(done),
+             "failed": 0, "workers": args.workers, "shards": len(database.get_user_data_paths())}
+    if done:
+        print(f"Resuming from {checkpoint_path}: {len(done)} users already done.")
+
+    started = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+
+    def replan_shard(conn, db_path):
+        settings_by_user, previous_by_user, stored_by_user = database.get_replan_inputs(
+            conn, week_start - datetime.timedelta(weeks=1), week_start)
+        todo = []
+        for user_id, settings in settings_by_user.items():
+            if user_id in done:
+                continue
+            if user_id in stored_by_user and not args.force:
+                stats["already_planned"] += 1
+                continue
+            todo.append((user_id, settings, previous_by_user.get(user_id, []), stored_by_user.get(user_id, [])))
+        batches = [todo[i:i + args.batch_size] for i in range(0, len(todo), args.batch_size)]
+
+        if executor:
+            futures = {executor.submit(_plan_batch, batch, week_start): len(batch) for batch in batches}
+            results = ((future, futures[future]) for future in as_completed(futures))
+        else:
+            results = ((batch, len(batch)) for batch in batches)
+
+        processed = 0
+        for result, batch_size in results:
+            try:
+                planned = result.result() if executor else _plan_batch(result, week_start)
+                database.write_weekly_plan_changes_for_users(conn, week_start, dict(planned))
+            except Exception as e:
+                print(f"  batch of {batch_size} users failed: {e}", file=sys.stderr)
+                stats["failed"] += batch_size
+                processed += batch_size
+                continue
+            done.update(user_id for user_id, _ in planned)
+            _save_checkpoint(checkpoint_path, week_key, done)
+            stats["planned"] += len(planned)
+            processed += batch_size
+            elapsed = time.perf_counter() - started
+            print(f"  {os.path.basename(db_path)}: {processed}/{len(todo)} users "
+                  f"({processed * 100 // max(len(todo), 1)}%), {stats['planned'] / elapsed:.0f} users/s overall")
+
+    try:
+        database.for_each_shard(replan_shard)
+    except KeyboardInterrupt:
+        print(f"Interrupted; {len(done)} users are saved in {checkpoint_path}. Run the command again to resume.", file=sys.stderr)
+        return 130
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+    stats["elapsed_s"] = round(time.perf_counter() - started, 3)
+    stats["users_per_s"] = round(stats["planned"] / stats["elapsed_s"], 1) if stats["elapsed_s"] else 0.0
+    if not stats["failed"] and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path) # Finished; a failed run keeps it so the rerun only retries the rest
+
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print(f"Planned week of {week_key} for {stats['planned']} users in {stats['elapsed_s']}s "
+              f"({stats['users_per_s']} users/s, {args.workers} worker(s), {stats['shards']} database(s)).")
+        print(f"  skipped: {stats['already_planned']} already planned, {stats['resumed']} done by an earlier run; failed: {stats['failed']}")
+    return 1 if stats["failed"] else 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the workout generator database.")
+    parser.add_argument("--db", default=None, help=f"Path to the main database (default: {database.DB_FILE})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = subparsers.add_parser("archive", help="Move old workout history into the archive database.")
+    archive_parser.add_argument("--older-than-days", type=int, default=archive.DEFAULT_RETENTION_DAYS,
+                                help="Archive entries older than this many days (default: %(default)s).")
+    archive_parser.add_argument("--compress", action="store_true", help="Store archived workout texts zlib-compressed.")
+    archive_parser.add_argument("--dry-run", action="store_true", help="Only report what would be archived.")
+    archive_parser.add_argument("--archive-db", default=None,
+                                help=f"Path to the archive database (default: {archive.ARCHIVE_DB_FILE} next to each database).")
+    archive_parser.add_argument("--vacuum-pages", type=int, default=None, help="Reclaim at most this many pages (default: all free pages).")
+    archive_parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    archive_parser.set_defaults(func=cmd_archive)
+
+    rebuild_parser = subparsers.add_parser("rebuild-summaries", help="Recompute the materialized weekly summaries.")
+    rebuild_parser.add_argument("--user-id", type=int, default=None, help="Only rebuild this user's summaries.")
+    rebuild_parser.add_argument("--archive-db", default=None,
+                                help=f"Archive database to include (default: {archive.ARCHIVE_DB_FILE} next to each database).")
+    rebuild_parser.add_argument("--skip-archive", action="store_true", help="Only count sessions still in workout_history.")
+    rebuild_parser.set_defaults(func=cmd_rebuild_summaries)
+
+    export_parser = subparsers.add_parser("export", help="Export all users' settings, plans and history as JSON lines.")
+    export_parser.add_argument("--output", default="-", help="File to write, or - for stdout (default: %(default)s).")
+    export_parser.set_defaults(func=cmd_export)
+
+    replan_parser = subparsers.add_parser("replan", help="Plan the coming week for every user (e.g. as a Monday job).")
+    replan_parser.add_argument("--week-start", default=None, help="Monday to plan, YYYY-MM-DD (default: next Monday).")
+    replan_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Planner processes (default: %(default)s; 1 plans in-process).")
+    replan_parser.add_argument("--batch-size", type=int, default=200, help="Users per worker task and per write transaction (default: %(default)s).")
+    replan_parser.add_argument("--force", action="store_true", help="Re-plan users who already have a plan for that week (completed and skipped days are kept).")
+    replan_parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: replan_<week>.checkpoint.json).")
+    replan_parser.add_argument("--json", action="store_true", help="Print the final stats as JSON.")
+    replan_parser.set_defaults(func=cmd_replan)
+    return parser
+
+def _is_read_only(args):
+    return args.command == "export" or (args.command == "archive" and args.dry_run)
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.db:
+        database.configure(db_file=args.db)
+    if not _is_read_only(args):
+        database.setup_database()
+    elif not os.path.exists(database.DB_FILE):
+        # Connecting would create an empty file; a read-only run must not change anything
+        print(f"No database at {database.DB_FILE}.", file=sys.stderr)
+        return 2
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
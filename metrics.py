@@ -0,0 +1,382 @@
+"""
+In-process metrics, exposed by the app at /metrics in the Prometheus text format (0.0.4).
+
+Counters, gauges and histograms are defined at module level below and updated on the hot path
+(request latency per route, workout generation stages, AI calls per model). An update is a
+dict lookup plus a few additions under a per-metric lock. Numbers other modules already keep
+(query_stats' per-operation histograms, cache counters, queue lengths) are not duplicated:
+collectors registered with REGISTRY.register_collector() read them at scrape time.
+
+Every worker process has its own registry. With METRICS_MULTIPROC_DIR set (gunicorn.conf.py
+sets it), each process also writes a snapshot of its samples to that directory every
+METRICS_SNAPSHOT_INTERVAL seconds, and a scrape of any worker (render()) reports all of them:
+counters and histograms are summed, gauges get a "pid" label (snapshots older than three
+intervals, i.e. of processes that died, are left out). A worker that exits through
+retire_process() adds its counters and histograms to a retired-processes file first, so
+totals never drop when gunicorn recycles it. Other processes' numbers are up to one interval
+old. Without the directory, a scrape only sees the process that served it.
+"""
+import os
+import json
+import math
+import time
+import bisect
+import fcntl
+import logging
+import tempfile
+import threading
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR") or None
+SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", 5))
+_RETIRED_FILE = "retired.json"
+_LOCK_FILE = ".lock" # Shared while reading snapshots, exclusive while a process retires
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds; requests are milliseconds to seconds, AI calls seconds to a minute or two
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {} # label values tuple -> child
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values):
+        """The child for these label values (in labelnames order), created on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}.")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """[(sample name, labels dict, value)] for the exposition."""
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for values, child in children:
+            samples.extend(child.samples(self.name, dict(zip(self.labelnames, values))))
+        return samples
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._children = {}
+
+class _Value:
+    """A counter or gauge value; += on a float under the GIL is not atomic, hence the lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+class _HistogramValue:
+
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last one: above the largest bound
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        return histogram_samples(name, labels, self.buckets, counts, total)
+
+def histogram_samples(name, labels, bounds, counts, total):
+    """Exposition samples for a histogram given per-bucket (not cumulative) counts."""
+    samples, running = [], 0
+    for bound, count in zip(list(bounds) + [math.inf], counts):
+        running += count
+        samples.append((name + "_bucket", {**labels, "le": _format_value(float(bound))}, running))
+    samples.append((name + "_sum", labels, total))
+    samples.append((name + "_count", labels, running))
+    return samples
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def register_collector(self, collect):
+        """
+        collect() is called on every scrape and returns metric families for numbers kept
+        elsewhere: [(name, type, help, [(sample name, labels dict, value)])].
+        """
+        self._collectors.append(collect)
+
+    def unregister_collector(self, collect):
+        if collect in self._collectors:
+            self._collectors.remove(collect)
+
+    def families(self):
+        for metric in self._metrics:
+            yield metric.name, metric.type, metric.documentation, metric.samples()
+        for collect in list(self._collectors):
+            yield from collect()
+
+    def render(self):
+        """The whole registry in the Prometheus text format."""
+        lines = []
+        for name, metric_type, documentation, samples in self.families():
+            lines.append(f"# HELP {name} {_escape(documentation)}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        for metric in self._metrics:
+            metric.reset()
+
+REGISTRY = Registry()
+
+# --- Multi-process aggregation (see the module docstring) ---
+
+_snapshot_writer = None # (thread, stop event) of this process
+_retired = False
+
+def configure(multiproc_dir=None, snapshot_interval=None):
+    """Sets the snapshot directory ("" turns aggregation off) and interval; None keeps the current value."""
+    global MULTIPROC_DIR, SNAPSHOT_INTERVAL
+    _stop_snapshot_writer()
+    MULTIPROC_DIR = MULTIPROC_DIR if multiproc_dir is None else (multiproc_dir or None)
+    SNAPSHOT_INTERVAL = SNAPSHOT_INTERVAL if snapshot_interval is None else snapshot_interval
+    if MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        _start_snapshot_writer()
+
+def _snapshot_path(pid):
+    return os.path.join(MULTIPROC_DIR, f"metrics_{pid}.json")
+
+def _write_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=MULTIPROC_DIR, prefix=".tmp_")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path) # Readers see the old snapshot or the new one, never half of one
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+@contextlib.contextmanager
+def _directory_lock(exclusive):
+    with open(os.path.join(MULTIPROC_DIR, _LOCK_FILE), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def write_snapshot(registry=None):
+    """Writes this process's families to its snapshot file."""
+    families = [[name, metric_type, documentation, samples]
+                for name, metric_type, documentation, samples in (registry or REGISTRY).families()]
+    _write_json(_snapshot_path(os.getpid()), families)
+
+def _snapshot_loop(stop):
+    while not stop.wait(SNAPSHOT_INTERVAL):
+        try:
+            write_snapshot()
+        except Exception as e:
+            logger.warning(f"Writing the metrics snapshot failed: {e}")
+
+def _start_snapshot_writer():
+    global _snapshot_writer
+    stop = threading.Event()
+    thread = threading.Thread(target=_snapshot_loop, args=(stop,), name="metrics-snapshot", daemon=True)
+    thread.start()
+    _snapshot_writer = (thread, stop)
+
+def _stop_snapshot_writer():
+    global _snapshot_writer
+    if _snapshot_writer is not None:
+        thread, stop = _snapshot_writer
+        stop.set()
+        thread.join()
+        _snapshot_writer = None
+
+def _merge(merged, families, pid=None, include_gauges=True):
+    """Adds families into merged ({name: (type, help, {(sample name, labels): value})}); gauges are kept per pid."""
+    for name, metric_type, documentation, samples in families:
+        if metric_type == "gauge" and not include_gauges:
+            continue
+        values = merged.setdefault(name, (metric_type, documentation, {}))[2]
+        for sample_name, labels, value in samples:
+            if metric_type == "gauge":
+                labels = {**labels, "pid": str(pid)}
+            key = (sample_name, tuple(labels.items()))
+            values[key] = values.get(key, 0) + value
+
+def _merged_families(merged):
+    for name, (metric_type, documentation, values) in merged.items():
+        yield name, metric_type, documentation, [(sample_name, dict(labels), value) for (sample_name, labels), value in values.items()]
+
+def retire_process():
+    """
+    Called when a worker exits: stops its snapshots and moves its counters and histograms into
+    the retired-processes file, so the totals keep them. Safe to call more than once.
+    """
+    global _retired
+    if not MULTIPROC_DIR or _retired:
+        return
+    _stop_snapshot_writer()
+    retired_path = os.path.join(MULTIPROC_DIR, _RETIRED_FILE)
+    with _directory_lock(exclusive=True):
+        merged = {}
+        _merge(merged, _read_json(retired_path))
+        _merge(merged, REGISTRY.families(), include_gauges=False)
+        _write_json(retired_path, [list(family) for family in _merged_families(merged)])
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(_snapshot_path(os.getpid()))
+    _retired = True
+
+def render():
+    """The Prometheus text exposition: this process's registry, or every process's with MULTIPROC_DIR."""
+    if not MULTIPROC_DIR:
+        return REGISTRY.render()
+    own_pid = os.getpid()
+    merged = {}
+    _merge(merged, REGISTRY.families(), pid=own_pid) # Live numbers for this process
+    fresh_after = time.time() - 3 * SNAPSHOT_INTERVAL
+    with _directory_lock(exclusive=False):
+        _merge(merged, _read_json(os.path.join(MULTIPROC_DIR, _RETIRED_FILE)))
+        for entry in os.scandir(MULTIPROC_DIR):
+            if not (entry.name.startswith("metrics_") and entry.name.endswith(".json")):
+                continue
+            pid = entry.name[len("metrics_"):-len(".json")]
+            if pid == str(own_pid):
+                continue
+            _merge(merged, _read_json(entry.path), pid=pid, include_gauges=entry.stat().st_mtime >= fresh_after)
+    combined = Registry()
+    combined.register_collector(lambda: _merged_families(merged))
+    return combined.render()
+
+# --- Metrics updated on the hot path ---
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to handle a request, by route template, method and status.",
+    ("route", "method", "status"))
+GENERATION_STAGE_DURATION = Histogram(
+    "workout_generation_stage_seconds",
+    "Time spent in each stage of /generate_workout: context (database read), rate_limit (waiting "
+    "for a turn), prompt (building it), ai_call, parse and save.",
+    ("stage",))
+AI_REQUEST_DURATION = Histogram(
+    "ai_request_duration_seconds", "Latency of calls to the AI provider, by model and outcome (ok or error).",
+    ("model", "outcome"))
+AI_TOKENS = Counter("ai_tokens_total", "Tokens used by AI calls, by model and kind (input or output).", ("model", "kind"))
+AI_ERRORS = Counter("ai_errors_total", "Failed AI calls, by model and exception type.", ("model", "error"))
+
+def observe_stage(stage, seconds):
+    GENERATION_STAGE_DURATION.labels(stage).observe(seconds)
+
+@contextlib.contextmanager
+def time_stage(stage):
+    with GENERATION_STAGE_DURATION.labels(stage).time():
+        yield
+
+def record_ai_call(model, started, response=None, error=None):
+    """Records an AI call that began at perf_counter() time started, from its response or exception."""
+    elapsed = time.perf_counter() - started
+    AI_REQUEST_DURATION.labels(model, "error" if error is not None else "ok").observe(elapsed)
+    if error is not None:
+        AI_ERRORS.labels(model, type(error).__name__).inc()
+        return
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        AI_TOKENS.labels(model, "input").inc(getattr(usage, "prompt_token_count", 0) or 0)
+        AI_TOKENS.labels(model, "output").inc(getattr(usage, "candidates_token_count", 0) or 0)
+
+def _reset_after_fork():
+    # Per worker, see the module docstring: the child starts from zero with its own snapshot writer
+    global _snapshot_writer, _retired
+    REGISTRY.reset()
+    _snapshot_writer, _retired = None, False
+    if MULTIPROC_DIR:
+        _start_snapshot_writer()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,274 @@
+"""
+Query instrumentation for database.py.
+
+Each database.py operation (a function tagged with the @operation decorator) is timed as
+a whole: its statements, the rows fetched from them and the work in between. Connections
+opened by database.py use InstrumentedConnection, whose cursors record which statements
+each operation ran. Together these feed:
+
+* per-operation counters and latency histograms (get_query_stats), counting operations
+  that ran at least one statement,
+* a slow-query log: operations slower than SLOW_QUERY_MS are kept in memory with each
+  distinct statement they ran and its EXPLAIN QUERY PLAN output, and appended to
+  SLOW_QUERY_LOG as JSON lines when that is set,
+* a count of "database is locked" errors per operation, i.e. writers that gave up waiting
+  for the write lock (busy timeout) or found a table locked,
+* per-request capture: inside capture_queries(), every statement is also recorded in
+  a list the caller can inspect (the app turns this on per request).
+
+Statements run outside any operation count as the operation "untagged". Those, and the
+per-statement timings in capture_queries(), cover cursor.execute() only: preparing the
+statement and stepping to the first row.
+
+Environment:
+    DB_QUERY_STATS=0        disables instrumentation entirely
+    DB_SLOW_QUERY_MS=100    slow-query threshold in milliseconds
+    DB_SLOW_QUERY_LOG=path  also append slow queries to this file
+"""
+import os
+import json
+import time
+import logging
+import sqlite3
+import functools
+import itertools
+import threading
+import contextlib
+import contextvars
+import urllib.parse
+from collections import deque
+from datetime import datetime
+import tracing
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("DB_QUERY_STATS", "1") != "0"
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 100))
+SLOW_QUERY_LOG = os.getenv("DB_SLOW_QUERY_LOG") or None
+SLOW_QUERY_HISTORY = 100 # Slow queries kept in memory
+HISTOGRAM_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 1000) # Upper bounds; one more bucket for anything slower
+
+_operation = contextvars.ContextVar("db_operation", default=None)
+_statements = contextvars.ContextVar("db_operation_statements", default=None) # sql -> [conn, params, count, ms]
+_captured = contextvars.ContextVar("db_captured_queries", default=None)
+_stats = {} # operation -> {"count", "total_ms", "max_ms", "buckets"}
+_slow_queries = deque(maxlen=SLOW_QUERY_HISTORY)
+_lock_errors = {} # operation -> count
+_lock = threading.Lock()
+
+# Statements worth explaining; PRAGMA, BEGIN, DDL etc. have no useful plan
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+def operation(name):
+    """
+    Decorator timing the function as one operation and tagging every query run inside it
+    with the operation name. The outermost tagged function wins, so helpers called from a
+    public function count towards the caller. In a sampled trace the call is also a span,
+    "db.<name>".
+    """
+    span_name = f"db.{name}"
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _operation.get() is not None:
+                return func(*args, **kwargs)
+            token = _operation.set(name)
+            statements_token = _statements.set({})
+            started = time.perf_counter()
+            try:
+                with tracing.span(span_name):
+                    return func(*args, **kwargs)
+            finally:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                statements = _statements.get()
+                _statements.reset(statements_token)
+                _operation.reset(token)
+                if statements: # e.g. a settings cache hit ran no query
+                    _record_operation(name, elapsed_ms, statements)
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def capture_queries():
+    """Collects {"operation", "sql", "ms"} for every statement run in this context."""
+    queries = []
+    token = _captured.set(queries)
+    try:
+        yield queries
+    finally:
+        _captured.reset(token)
+
+def _bucket_index(elapsed_ms):
+    for index, upper_bound in enumerate(HISTOGRAM_BUCKETS_MS):
+        if elapsed_ms <= upper_bound:
+            return index
+    return len(HISTOGRAM_BUCKETS_MS)
+
+def _explain(conn, sql, params):
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    try:
+        try:
+            rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        except sqlite3.ProgrammingError:
+            # The operation closed its connection before it was found slow; the plan is the same on a
+            # new one (read-only, so a database deleted since is not created again)
+            uri = f"file:{urllib.parse.quote(conn.database_path)}?mode=ro"
+            with contextlib.closing(sqlite3.connect(uri, uri=True)) as fresh_conn:
+                rows = fresh_conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        return [row[3] for row in rows] # Plan detail text, e.g. "SEARCH workout_history USING INDEX ..."
+    except sqlite3.Error as e:
+        return [f"EXPLAIN failed: {e}"]
+
+def _record_statement(conn, sql, params, elapsed_ms):
+    op = _operation.get() or "untagged"
+    captured = _captured.get()
+    if captured is not None:
+        captured.append({"operation": op, "sql": " ".join(sql.split()), "ms": round(elapsed_ms, 3)})
+
+    statements = _statements.get()
+    if statements is None: # Outside any operation: the statement is timed on its own
+        _record_operation(op, elapsed_ms, {sql: [conn, params, 1, elapsed_ms]})
+        return
+    statement = statements.get(sql)
+    if statement is None:
+        statements[sql] = [conn, params, 1, elapsed_ms] # The first parameters are the ones explained
+    else:
+        statement[2] += 1
+        statement[3] += elapsed_ms
+
+def _record_operation(op, elapsed_ms, statements):
+    with _lock:
+        stats = _stats.get(op)
+        if stats is None:
+            stats = _stats[op] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)}
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        stats["buckets"][_bucket_index(elapsed_ms)] += 1
+
+    if elapsed_ms >= SLOW_QUERY_MS:
+        entry = {
+            "time": datetime.now().isoformat(sep=' '),
+            "operation": op,
+            "ms": round(elapsed_ms, 3),
+            # Slowest first; ms is each statement's execute() time, which excludes fetching its rows
+            "queries": [{"sql": " ".join(sql.split()), "count": count, "ms": round(statement_ms, 3),
+                         "plan": _explain(conn, sql, params)}
+                        for sql, (conn, params, count, statement_ms) in sorted(statements.items(), key=lambda item: -item[1][3])],
+        }
+        with _lock:
+            _slow_queries.append(entry)
+        if SLOW_QUERY_LOG:
+            try:
+                with open(SLOW_QUERY_LOG, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, default=str) + "\n")
+            except OSError as e:
+                logger.error(f"Could not write slow query log: {e}")
+
+def _record_error(error):
+    if isinstance(error, sqlite3.OperationalError) and "locked" in str(error):
+        op = _operation.get() or "untagged"
+        with _lock:
+            _lock_errors[op] = _lock_errors.get(op, 0) + 1
+
+class InstrumentedCursor(sqlite3.Cursor):
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        except sqlite3.Error as e:
+            _record_error(e)
+            raise
+        finally:
+            _record_statement(self.connection, sql, params, (time.perf_counter() - started) * 1000)
+
+    def executemany(self, sql, seq_of_params):
+        # The first parameter set is kept to explain the statement with; placeholders need values
+        remaining_params = iter(seq_of_params)
+        first_params = next(remaining_params, None)
+        if first_params is not None:
+            remaining_params = itertools.chain([first_params], remaining_params)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, remaining_params)
+        except sqlite3.Error as e:
+            _record_error(e)
+            raise
+        finally:
+            _record_statement(self.connection, sql, first_params or (), (time.perf_counter() - started) * 1000)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3.Connection whose execute() shortcuts and cursors are timed."""
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.database_path = os.fspath(database) # To explain a slow operation's statements after it closed us
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        try:
+            super().commit()
+        except sqlite3.Error as e:
+            _record_error(e)
+            raise
+
+def connection_factory():
+    """The sqlite3.connect factory to use: instrumented unless DB_QUERY_STATS=0."""
+    return InstrumentedConnection if ENABLED else sqlite3.Connection
+
+def get_query_stats():
+    """Per-operation counters and latency histograms, plus the recent slow queries."""
+    with _lock:
+        operations = {}
+        for op, stats in sorted(_stats.items()):
+            # Cumulative, like Prometheus buckets: le_10ms counts every query that took <= 10ms
+            histogram, running_total = {}, 0
+            for bound, count in zip(HISTOGRAM_BUCKETS_MS, stats["buckets"]):
+                running_total += count
+                histogram[f"le_{bound}ms"] = running_total
+            histogram["le_inf"] = stats["count"]
+            operations[op] = {
+                "count": stats["count"],
+                "total_ms": round(stats["total_ms"], 3),
+                "avg_ms": round(stats["total_ms"] / stats["count"], 3),
+                "max_ms": round(stats["max_ms"], 3),
+                "histogram": histogram,
+            }
+        return {"operations": operations, "slow_queries": list(_slow_queries), "slow_query_ms": SLOW_QUERY_MS,
+                "lock_errors": dict(_lock_errors)}
+
+def get_operation_histograms():
+    """{operation: (per-bucket counts, total_ms)} with buckets as in HISTOGRAM_BUCKETS_MS plus one above."""
+    with _lock:
+        return {op: (list(stats["buckets"]), stats["total_ms"]) for op, stats in _stats.items()}
+
+def get_lock_errors():
+    """{operation: count} of "database is locked" errors."""
+    with _lock:
+        return dict(_lock_errors)
+
+def reset_query_stats():
+    with _lock:
+        _stats.clear()
+        _slow_queries.clear()
+        _lock_errors.clear()
+
+def _reset_after_fork():
+    # Stats are per worker: a forked child starts from zero, with a lock no parent thread holds
+    global _lock
+    _lock = threading.Lock()
+    _stats.clear()
+    _slow_queries.clear()
+    _lock_errors.clear()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
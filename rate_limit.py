@@ -0,0 +1,217 @@
+"""
+Rate limiting for workout generation, i.e. for calls to the AI provider.
+
+Every generation passes three checks, all configured per model in ai_provider.GEMINI_MODELS:
+
+* a per-user token bucket (userRequestsPerMinute, refilling continuously, holding up to
+  userBurst tokens), so one user or script cannot run up the bill. Each user has one for
+  every model and one across all models, with the most generous of the models' user limits,
+  so switching models does not start the user on a fresh budget,
+* a global token bucket (requestsPerMinute), the provider quota this deployment may use,
+* a global concurrency limit (maxConcurrent) on calls in flight.
+
+A request that is over a limit waits when its turn comes within RATE_LIMIT_WAIT_SECONDS
+(tokens are reserved ahead, so waiting requests are served in order). Otherwise it is rejected
+with RateLimited, which carries how long to wait before retrying; the app turns it into
+429 + Retry-After.
+
+The limits are per process. With several worker processes the global requestsPerMinute and
+maxConcurrent are divided between them (RATE_LIMIT_PROCESSES, set by gunicorn.conf.py).
+Per-user buckets are not divided: a user's requests land on any worker, so per-user limits
+are approximate by up to that factor.
+
+Environment:
+    RATE_LIMITING=0              turns the limits off
+    RATE_LIMIT_WAIT_SECONDS=10   how long a request may queue before it is rejected
+    RATE_LIMIT_PROCESSES=1       worker processes sharing the global limits
+"""
+import os
+import math
+import asyncio
+import time
+import threading
+import contextlib
+from ai_provider import GEMINI_MODELS, DEFAULT_MODEL_ID
+
+RATE_LIMITING = os.getenv("RATE_LIMITING", "1") == "1"
+RATE_LIMIT_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_WAIT_SECONDS", 10))
+RATE_LIMIT_PROCESSES = max(1, int(os.getenv("RATE_LIMIT_PROCESSES", 1)))
+# Limits for models without their own entry (and fields missing from an entry)
+DEFAULT_LIMITS = {"requestsPerMinute": 60, "maxConcurrent": 8, "userRequestsPerMinute": 6, "userBurst": 3}
+MAX_TRACKED_USERS = 10000 # Idle (full) user buckets are dropped beyond this
+ASYNC_SLOT_POLL_SECONDS = 0.05 # acquire_async checks for a free concurrency slot this often
+
+class RateLimited(Exception):
+    """Raised when a request cannot be served within the wait budget."""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f"Rate limit exceeded ({scope}); retry in {retry_after:.1f}s.")
+        self.scope = scope # "user", "global" or "concurrency"
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        """Retry-After value: whole seconds, at least 1."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens, refilled at rate tokens per second. reserve() may take tokens
+    the bucket does not have yet (the balance goes negative), which is how waiting requests
+    queue: each one waits until the refill has covered it.
+    """
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        if now > self.updated: # Callers may pass a timestamp taken just before another caller's
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self, now, max_wait):
+        """
+        Takes one token. Returns (True, seconds until it may be used), or (False, seconds until
+        a retry could succeed) when that would be longer than max_wait; nothing is taken then.
+        """
+        self._refill(now)
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            return False, wait
+        self.tokens -= 1
+        return True, wait
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class RateLimiter:
+    """Applies the limits in the module docstring. One instance per process (and app)."""
+
+    def __init__(self, models=GEMINI_MODELS, wait_budget=RATE_LIMIT_WAIT_SECONDS, processes=RATE_LIMIT_PROCESSES,
+                 enabled=RATE_LIMITING, clock=time.monotonic, sleep=time.sleep):
+        self.models = models
+        self.wait_budget = wait_budget
+        self.processes = processes
+        self.enabled = enabled
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._user_buckets = {}   # (user_id, model_id) -> TokenBucket; (user_id, None) is across models
+        self._model_buckets = {}  # model_id -> TokenBucket
+        self._slots = {}          # model_id -> BoundedSemaphore
+        self._user_limits = self.user_limits()
+        self._stats = {"allowed": 0, "delayed": 0, "rejected": {"user": 0, "global": 0, "concurrency": 0}}
+        self._waiting = 0 # Requests between _reserve() and _finish(): waiting for their turn or a slot
+
+    def limits_for(self, model_id):
+        model = self.models.get(model_id) or self.models.get(DEFAULT_MODEL_ID) or {}
+        return {name: model.get(name, default) for name, default in DEFAULT_LIMITS.items()}
+
+    def user_limits(self):
+        """(requests per minute, burst) of a user's bucket across models: the most any one model allows."""
+        limits = [self.limits_for(model_id) for model_id in self.models] or [DEFAULT_LIMITS]
+        return (max(model["userRequestsPerMinute"] for model in limits),
+                max(model["userBurst"] for model in limits))
+
+    def _user_bucket(self, key, requests_per_minute, burst, now):
+        bucket = self._user_buckets.get(key)
+        if bucket is None:
+            if len(self._user_buckets) >= MAX_TRACKED_USERS:
+                for idle_key in [idle_key for idle_key, idle in self._user_buckets.items() if idle.is_idle(now)]:
+                    del self._user_buckets[idle_key]
+            bucket = self._user_buckets[key] = TokenBucket(requests_per_minute / 60, burst, now)
+        return bucket
+
+    def _buckets(self, user_id, model_id, now):
+        """The buckets a request takes a token from: the user's for the model, the user's across models, the model's."""
+        limits = self.limits_for(model_id)
+        model_bucket = self._model_buckets.get(model_id)
+        if model_bucket is None:
+            global_rpm = limits["requestsPerMinute"] / self.processes
+            # Bursts of up to ten seconds' worth of this process's share (at least one request)
+            model_bucket = self._model_buckets[model_id] = TokenBucket(global_rpm / 60, max(1.0, global_rpm / 6), now)
+            self._slots[model_id] = threading.BoundedSemaphore(max(1, limits["maxConcurrent"] // self.processes))
+        return (self._user_bucket((user_id, model_id), limits["userRequestsPerMinute"], limits["userBurst"], now),
+                self._user_bucket((user_id, None), *self._user_limits, now),
+                model_bucket)
+
+    def _reserve(self, user_id, model_id, started):
+        """Takes a token from every bucket. Returns (seconds to wait, the model's slots, buckets)."""
+        with self._lock:
+            buckets = self._buckets(user_id, model_id, started)
+            wait = 0.0
+            for taken, (bucket, scope) in enumerate(zip(buckets, ("user", "user", "global"))):
+                ok, bucket_wait = bucket.reserve(started, self.wait_budget)
+                if not ok:
+                    for earlier in buckets[:taken]:
+                        earlier.refund()
+                    self._stats["rejected"][scope] += 1
+                    raise RateLimited(scope, bucket_wait)
+                wait = max(wait, bucket_wait)
+            self._waiting += 1
+            return wait, self._slots[model_id], buckets
+
+    def _finish(self, got_slot, buckets, started):
+        with self._lock:
+            self._waiting -= 1
+            if not got_slot:
+                for bucket in buckets:
+                    bucket.refund()
+                self._stats["rejected"]["concurrency"] += 1
+                # No way to know when a slot frees up; a generation takes seconds
+                raise RateLimited("concurrency", self.wait_budget)
+            self._stats["allowed"] += 1
+            if self._clock() - started > 0.001:
+                self._stats["delayed"] += 1
+
+    def acquire(self, user_id, model_id):
+        """
+        Blocks until the request may call the provider (within the wait budget) and returns a
+        release function to call when the call is over. Raises RateLimited.
+        """
+        if not self.enabled:
+            return lambda: None
+        started = self._clock()
+        wait, slots, buckets = self._reserve(user_id, model_id, started)
+        if wait > 0:
+            self._sleep(wait)
+        got_slot = slots.acquire(timeout=max(0.0, self.wait_budget - (self._clock() - started)))
+        self._finish(got_slot, buckets, started)
+        return slots.release
+
+    async def acquire_async(self, user_id, model_id):
+        """acquire() for asyncio callers: waits without blocking the event loop."""
+        if not self.enabled:
+            return lambda: None
+        started = self._clock()
+        wait, slots, buckets = self._reserve(user_id, model_id, started)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        got_slot = slots.acquire(blocking=False)
+        while not got_slot and self._clock() - started < self.wait_budget:
+            await asyncio.sleep(ASYNC_SLOT_POLL_SECONDS)
+            got_slot = slots.acquire(blocking=False)
+        self._finish(got_slot, buckets, started)
+        return slots.release
+
+    @contextlib.contextmanager
+    def limit(self, user_id, model_id):
+        """acquire() as a context manager holding the concurrency slot for the block."""
+        release = self.acquire(user_id, model_id)
+        try:
+            yield
+        finally:
+            release()
+
+    def get_stats(self):
+        with self._lock:
+            return {"allowed": self._stats["allowed"], "delayed": self._stats["delayed"],
+                    "rejected": dict(self._stats["rejected"]), "waiting": self._waiting,
+                    "tracked_users": len(self._user_buckets)}
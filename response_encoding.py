@@ -0,0 +1,115 @@
+"""
+Faster JSON encoding and negotiated compression for the Flask app's responses.
+
+* FastJSONProvider replaces Flask's stdlib-based JSON provider with orjson or msgspec when
+  one is installed (JSON_ENCODER=auto picks orjson, then msgspec, then the stdlib). Output
+  matches the stdlib provider: compact, sorted keys, and dates/datetimes formatted by
+  Flask's default hook.
+* compress_response() is an after_request hook that gzip- or brotli-compresses responses
+  above COMPRESS_MIN_BYTES when the client accepts it. Brotli is only offered when the
+  brotli package is installed.
+
+Environment:
+    JSON_ENCODER=auto|orjson|msgspec|stdlib   serializer for jsonify (default auto)
+    COMPRESS_MIN_BYTES=1024                   smaller bodies are sent as is (0 disables compression)
+    COMPRESS_GZIP_LEVEL=6 / COMPRESS_BROTLI_QUALITY=4
+"""
+import os
+import json
+import gzip
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_ENCODER = os.getenv("JSON_ENCODER", "auto")
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", 6))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 4)) # Low qualities are fast enough per request
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain", "text/css", "text/javascript", "application/javascript"}
+
+def _stdlib_encoder(default):
+    def encode(obj):
+        return json.dumps(obj, default=default, sort_keys=True, separators=(",", ":")).encode()
+    return encode
+
+def _orjson_encoder(default):
+    # Dates go through Flask's hook (HTTP dates) so output does not change with the encoder
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    def encode(obj):
+        return orjson.dumps(obj, default=default, option=options)
+    return encode
+
+def _msgspec_encoder(default):
+    # msgspec encodes datetimes natively (ISO 8601), unlike the stdlib provider
+    encoder = msgspec.json.Encoder(enc_hook=default, order="sorted")
+    return encoder.encode
+
+ENCODERS = {"orjson": (orjson, _orjson_encoder), "msgspec": (msgspec, _msgspec_encoder), "stdlib": (json, _stdlib_encoder)}
+
+def make_encoder(name=None, default=DefaultJSONProvider.default):
+    """Returns (name, encode) where encode(obj) -> compact JSON bytes."""
+    name = name or JSON_ENCODER
+    if name == "auto":
+        name = next(candidate for candidate in ("orjson", "msgspec", "stdlib") if ENCODERS[candidate][0] is not None)
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown JSON_ENCODER '{name}'. Choose from: auto, {', '.join(ENCODERS)}.")
+    module, factory = ENCODERS[name]
+    if module is None:
+        raise ValueError(f"JSON_ENCODER={name} but the {name} package is not installed.")
+    return name, factory(default)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider whose jsonify() uses the encoder chosen by make_encoder()."""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.encoder_name, self._encode = make_encoder()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs: # Custom formatting (indent, separators...) is left to the stdlib
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(obj) # Pretty-printed for debugging
+        # Bytes straight into the response, skipping the str round trip
+        return self._app.response_class(self._encode(obj) + b"\n", mimetype=self.mimetype)
+
+def _negotiate_encoding(accept_encodings):
+    """Best supported content coding the client accepts: 'br', 'gzip' or None."""
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    quality, coding = max(((accept_encodings[coding], -index), coding) for index, coding in enumerate(candidates))
+    return coding if quality[0] > 0 else None
+
+def compress_body(body, coding):
+    if coding == "br":
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+def compress_response(response, request):
+    """Compresses a buffered response in place when worthwhile and accepted by the client."""
+    if (COMPRESS_MIN_BYTES <= 0 or response.direct_passthrough or response.is_streamed
+            or response.status_code != 200 or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add("Accept-Encoding") # Whether or not this one is compressed, it depends on the header
+    coding = _negotiate_encoding(request.accept_encodings)
+    body = response.get_data()
+    if coding is None or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(compress_body(body, coding))
+    response.headers["Content-Encoding"] = coding
+    return response
@@ -27,29 +27,41 @@ document.addEventListener('DOMContentLoaded', function () {
     // --- Global Variables / State ---
     let currentWorkoutData = null;
 
+    // Last response per URL for the read endpoints: { etag, data }
+    const conditionalCache = new Map();
+
     // --- API Functions ---
-    async function loadWorkoutHistoryRequest() {
-        const response = await fetch('/get_workout_history?days=14');
+    // GETs a JSON read endpoint, revalidating with If-None-Match. On 304 the server skipped
+    // the query entirely and the cached payload is reused.
+    async function fetchJsonConditional(url, errorMessage) {
+        const cached = conditionalCache.get(url);
+        const headers = cached ? { 'If-None-Match': cached.etag } : {};
+        // no-store: the validators are handled here, so keep the browser cache out of the way
+        const response = await fetch(url, { headers, cache: 'no-store' });
+        if (response.status === 304 && cached) {
+            return cached.data;
+        }
         if (!response.ok) {
-            throw new Error('Could not load workout history.');
+            throw new Error(errorMessage);
         }
-        return response.json();
+        const data = await response.json();
+        const etag = response.headers.get('ETag');
+        if (etag) {
+            conditionalCache.set(url, { etag, data });
+        }
+        return data;
+    }
+
+    async function loadWorkoutHistoryRequest() {
+        return fetchJsonConditional('/get_workout_history?days=14', 'Could not load workout history.');
     }
 
     async function loadWeeklyPlanRequest() {
-        const response = await fetch('/get_current_weekly_plan');
-        if (!response.ok) {
-            throw new Error('Could not load weekly plan.');
-        }
-        return response.json();
+        return fetchJsonConditional('/get_current_weekly_plan', 'Could not load weekly plan.');
     }
 
     async function loadUserSettingsRequest() {
-        const response = await fetch('/get_user_settings');
-        if (!response.ok) {
-            throw new Error('Could not load user settings.');
-        }
-        return response.json();
+        return fetchJsonConditional('/get_user_settings', 'Could not load user settings.');
     }
 
     async function generateWorkoutRequest(formData) {
@@ -201,9 +213,14 @@ document.addEventListener('DOMContentLoaded', function () {
         plan.sort((a, b) => a.day_of_week - b.day_of_week);
 
         const days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"];
-        let html = '<ul>';
+        let html = '';
+        if (plan[0].phase) {
+            html += `<p><em>${plan[0].phase} week (load x${plan[0].load_factor})</em></p>`;
+        }
+        html += '<ul>';
         plan.forEach(item => {
-            html += `<li><strong>${days[item.day_of_week] || 'Unknown Day'}:</strong> ${item.pillar_focus} (${item.status})</li>`;
+            const focus = item.session_focus ? ` - ${item.session_focus}` : '';
+            html += `<li><strong>${days[item.day_of_week] || 'Unknown Day'}:</strong> ${item.pillar_focus}${focus} (${item.status})</li>`;
         });
         html += '</ul>';
         weeklyPlanDisplay.innerHTML = html;
@@ -313,6 +330,10 @@ document.addEventListener('DOMContentLoaded', function () {
         try {
             const result = await saveUserSettingsRequest(settingsData);
             displaySettingsMessage(result.message || 'Settings saved successfully!');
+            if (result.replan_scheduled) {
+                // The plan is updated in the background after the response; refresh once it has had time to land
+                setTimeout(fetchAndDisplayWeeklyPlan, 1000);
+            }
         } catch (error) {
             console.error('Error saving settings:', error);
             displaySettingsMessage(error.message || 'A network error occurred while saving settings.');
@@ -402,9 +423,46 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     // --- Initial Data Load ---
-    fetchAndPopulateUserSettings();
-    fetchAndDisplayWorkoutHistory();
-    fetchAndDisplayWeeklyPlan(); // Added
+    // Initial state: inlined into the page by the server, else one /bootstrap request, else the
+    // three separate reads. Seeding the ETag cache lets later refreshes revalidate with 304s.
+    async function loadInitialState() {
+        let state = null;
+        const inlineState = document.getElementById('bootstrapState');
+        try {
+            if (inlineState) {
+                state = JSON.parse(inlineState.textContent);
+            } else {
+                const response = await fetch('/bootstrap', { cache: 'no-store' });
+                if (response.ok) {
+                    state = await response.json();
+                }
+            }
+        } catch (error) {
+            console.error('Error loading initial state:', error);
+        }
+        if (!state) {
+            fetchAndPopulateUserSettings();
+            fetchAndDisplayWorkoutHistory();
+            fetchAndDisplayWeeklyPlan();
+            return;
+        }
+
+        const payloads = {
+            '/get_user_settings': state.settings,
+            '/get_workout_history?days=14': state.workout_history,
+            '/get_current_weekly_plan': state.weekly_plan,
+        };
+        for (const [url, etag] of Object.entries(state.etags || {})) {
+            if (url in payloads) {
+                conditionalCache.set(url, { etag, data: payloads[url] });
+            }
+        }
+        populateUserSettingsForm(state.settings);
+        updateWorkoutHistoryDisplay(state.workout_history);
+        displayWeeklyPlan(state.weekly_plan);
+    }
+
+    loadInitialState();
 
     const savedTheme = localStorage.getItem('appTheme') || 'light'; // Default to light
     applyTheme(savedTheme);
@@ -0,0 +1,442 @@
+"""
+Storage interface for user settings, workout history and weekly plans.
+
+App and planner code talk to a Storage object instead of calling database.py directly,
+so the backend can be swapped:
+
+* SQLiteStorage - the normal backend, delegating to database.py (sharding, settings
+  cache, weekly summary triggers and write batching all still apply).
+* InMemoryStorage - plain dicts with per-user indexes kept sorted by date. Nothing is
+  persisted, which makes it a fit for tests, benchmarks and throwaway demo deployments.
+
+The backend is chosen with STORAGE_BACKEND=sqlite|memory (default sqlite); get_storage()
+returns the process-wide instance and set_storage() replaces it.
+"""
+import os
+import abc
+import json
+import bisect
+import sqlite3
+import threading
+from datetime import datetime, timedelta, date, timezone
+import database
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+
+class Storage(abc.ABC):
+    """
+    Operations the app needs from a backend. Dates follow database.py: week_start_date is a
+    date or ISO string, and entries come back as plain dicts (workout_date as a string).
+    A backend missing one of the abstract methods fails when it is created.
+    """
+
+    def setup(self):
+        """Creates whatever the backend needs. Safe to call more than once."""
+
+    @abc.abstractmethod
+    def get_user_settings(self, user_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_user_settings(self, user_id, settings_dict):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_workout_to_history(self, user_id, pillar, focus, muscles_worked, full_workout_text):
+        """Stores a workout and returns its id."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_workout_history(self, user_id, days=14):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_workout_from_history(self, workout_id, user_id=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_weekly_plan(self, user_id, week_start_date):
+        raise NotImplementedError
+
+    def replace_weekly_plan(self, user_id, week_start_date, plan_entries):
+        """Replaces a user's plan for one week with plan_entries, all or nothing."""
+        self.replace_weekly_plans(user_id, {week_start_date: plan_entries})
+
+    @abc.abstractmethod
+    def replace_weekly_plans(self, user_id, plans_by_week):
+        """Replaces several weeks ({week_start_date: plan_entries}) in one atomic step."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def apply_weekly_plan_changes(self, user_id, changes_by_week):
+        """
+        Applies a plan diff ({week_start_date: (updates, inserts)}) atomically and returns the
+        number of entries changed. updates carry the id of the entry to change and only apply
+        while that entry is still 'Planned'; inserts are new days.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_plan_entry_status(self, user_id, plan_entry_id, status, workout_id=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_weekly_summaries(self, user_id, start_week, end_week):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_generation_context(self, user_id, today=None, history_days=4, history_limit=3):
+        """Returns a database.GenerationContext."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_bootstrap_state(self, user_id, week_start_date, history_days=14):
+        """
+        {"settings", "weekly_plan", "workout_history", "versions"} for the first page load, read
+        from one consistent state of the backend.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_data_versions(self, user_id):
+        """
+        {kind: (version, updated_at)} for 'settings', 'history' and 'plan'. The version changes
+        on every write to that kind of data; kinds never written are (0, None).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_user_api_key(self, user_id, provider="gemini"):
+        """The user's own key for the AI provider, or None (see credentials.py)."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_user_api_key_version(self, user_id, provider="gemini"):
+        """A number that changes on every save and delete of the user's key; None if it was never saved."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_user_api_key(self, user_id, api_key, provider="gemini"):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_user_api_key(self, user_id, provider="gemini"):
+        raise NotImplementedError
+
+    def get_cache_stats(self):
+        return {}
+
+class SQLiteStorage(Storage):
+    """Storage backed by database.py."""
+
+    def setup(self):
+        database.setup_database()
+
+    def get_user_settings(self, user_id):
+        return database.get_user_settings(user_id)
+
+    def save_user_settings(self, user_id, settings_dict):
+        database.save_user_settings(user_id, settings_dict)
+
+    def save_workout_to_history(self, user_id, pillar, focus, muscles_worked, full_workout_text):
+        return database.save_workout_to_history(user_id, pillar, focus, muscles_worked, full_workout_text)
+
+    def get_workout_history(self, user_id, days=14):
+        return database.get_workout_history(user_id, days)
+
+    def delete_workout_from_history(self, workout_id, user_id=None):
+        database.delete_workout_from_history(workout_id, user_id)
+
+    def get_weekly_plan(self, user_id, week_start_date):
+        return database.get_weekly_plan(user_id, week_start_date)
+
+    def replace_weekly_plans(self, user_id, plans_by_week):
+        database.replace_weekly_plans(user_id, plans_by_week)
+
+    def apply_weekly_plan_changes(self, user_id, changes_by_week):
+        return database.apply_weekly_plan_changes(user_id, changes_by_week)
+
+    def update_plan_entry_status(self, user_id, plan_entry_id, status, workout_id=None):
+        return database.update_plan_entry_status(user_id, plan_entry_id, status, workout_id)
+
+    def get_weekly_summaries(self, user_id, start_week, end_week):
+        return database.get_weekly_summaries(user_id, start_week, end_week)
+
+    def get_generation_context(self, user_id, today=None, history_days=4, history_limit=3):
+        return database.get_generation_context(user_id, today, history_days, history_limit)
+
+    def get_bootstrap_state(self, user_id, week_start_date, history_days=14):
+        return database.get_bootstrap_state(user_id, week_start_date, history_days)
+
+    def get_data_versions(self, user_id):
+        return database.get_data_versions(user_id)
+
+    def get_user_api_key(self, user_id, provider="gemini"):
+        return database.get_user_api_key(user_id, provider)
+
+    def get_user_api_key_version(self, user_id, provider="gemini"):
+        return database.get_user_api_key_version(user_id, provider)
+
+    def save_user_api_key(self, user_id, api_key, provider="gemini"):
+        database.save_user_api_key(user_id, api_key, provider)
+
+    def delete_user_api_key(self, user_id, provider="gemini"):
+        database.delete_user_api_key(user_id, provider)
+
+    def get_cache_stats(self):
+        return {"user_settings": database.get_settings_cache_stats()}
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+def _week_start(workout_date):
+    day = date.fromisoformat(workout_date[:10])
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+# Same mapping as database._pillar_key_sql: history pillar names -> plan pillar names
+_PILLAR_KEYS = {"Zone2 Cardio": "Zone2", "Stability/Mobility": "Stability"}
+
+class InMemoryStorage(Storage):
+    """
+    Dict-backed storage. Each user's history is a list kept sorted by (workout_date, id), so
+    date-window reads are a bisect plus a slice. One lock serializes all access.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._settings = {}          # user_id -> settings dict
+        self._workouts = {}          # workout_id -> entry dict (with user_id)
+        self._history_index = {}     # user_id -> sorted [(workout_date, workout_id)]
+        self._plans = {}             # (user_id, week_start_date) -> [entry dict] by day_of_week
+        self._plan_entries = {}      # plan entry id -> entry dict
+        self._versions = {}          # (user_id, kind) -> (version, updated_at)
+        self._api_keys = {}          # (user_id, provider) -> (api_key or None once deleted, version)
+        self._next_workout_id = 1
+        self._next_plan_entry_id = 1
+
+    def _bump_version(self, user_id, kind):
+        version, _ = self._versions.get((user_id, kind), (0, None))
+        # Second resolution, like the SQLite trigger's CURRENT_TIMESTAMP
+        self._versions[(user_id, kind)] = (version + 1, datetime.now(timezone.utc).replace(microsecond=0))
+
+    def get_data_versions(self, user_id):
+        with self._lock:
+            return {kind: self._versions.get((user_id, kind), (0, None)) for kind in database.DATA_VERSION_TABLES}
+
+    def get_bootstrap_state(self, user_id, week_start_date, history_days=14):
+        with self._lock: # Reentrant, so the parts below see the same state
+            return {
+                "settings": self.get_user_settings(user_id),
+                "weekly_plan": self.get_weekly_plan(user_id, week_start_date),
+                "workout_history": self.get_workout_history(user_id, history_days),
+                "versions": self.get_data_versions(user_id),
+            }
+
+    def get_user_api_key(self, user_id, provider="gemini"):
+        with self._lock:
+            return self._api_keys.get((user_id, provider), (None, None))[0]
+
+    def get_user_api_key_version(self, user_id, provider="gemini"):
+        with self._lock:
+            return self._api_keys.get((user_id, provider), (None, None))[1]
+
+    def save_user_api_key(self, user_id, api_key, provider="gemini"):
+        with self._lock:
+            _, version = self._api_keys.get((user_id, provider), (None, 0))
+            self._api_keys[(user_id, provider)] = (api_key, version + 1)
+
+    def delete_user_api_key(self, user_id, provider="gemini"):
+        with self._lock:
+            if (user_id, provider) in self._api_keys:
+                self._api_keys[(user_id, provider)] = (None, self._api_keys[(user_id, provider)][1] + 1)
+
+    def get_user_settings(self, user_id):
+        with self._lock:
+            settings = self._settings.get(user_id)
+            if settings is None:
+                settings = database._parse_settings_row(None)[1]
+            return database._copy_settings(settings)
+
+    def save_user_settings(self, user_id, settings_dict):
+        with self._lock:
+            settings = self._settings.get(user_id) or database._parse_settings_row(None)[1]
+            settings = database._copy_settings(settings)
+            unknown = [key for key in settings_dict if key not in settings]
+            if unknown: # What SQLite says for a column that is not there
+                raise sqlite3.OperationalError(f"no such column: {unknown[0]}")
+            for key, value in settings_dict.items():
+                if key == 'focus_rotation' and isinstance(value, str):
+                    value = json.loads(value)
+                settings[key] = list(value) if key == 'focus_rotation' else value
+            self._settings[user_id] = settings
+            self._bump_version(user_id, "settings")
+
+    def save_workout_to_history(self, user_id, pillar, focus, muscles_worked, full_workout_text):
+        with self._lock:
+            workout_id = self._next_workout_id
+            self._next_workout_id += 1
+            workout_date = str(datetime.now()) # Same text form SQLite stores
+            self._workouts[workout_id] = {
+                "id": workout_id, "user_id": user_id, "pillar": pillar, "focus": focus,
+                "muscles_worked": list(muscles_worked or []), "workout_date": workout_date,
+                "full_workout_text": full_workout_text,
+            }
+            bisect.insort(self._history_index.setdefault(user_id, []), (workout_date, workout_id))
+            self._bump_version(user_id, "history")
+            return workout_id
+
+    def _history_since(self, user_id, start_date):
+        """Entries since start_date, newest first."""
+        index = self._history_index.get(user_id, [])
+        start = bisect.bisect_left(index, (str(start_date),))
+        return [self._workouts[workout_id] for _, workout_id in reversed(index[start:])]
+
+    def _public_entry(self, entry, full_text=True):
+        public = {key: value for key, value in entry.items() if key != 'user_id'}
+        public['muscles_worked'] = list(entry['muscles_worked'])
+        if not full_text:
+            del public['full_workout_text'], public['id']
+        return public
+
+    def get_workout_history(self, user_id, days=14):
+        with self._lock:
+            start_date = datetime.now() - timedelta(days=days)
+            return [self._public_entry(entry) for entry in self._history_since(user_id, start_date)]
+
+    def delete_workout_from_history(self, workout_id, user_id=None):
+        with self._lock:
+            entry = self._workouts.get(workout_id)
+            if entry is None or (user_id is not None and entry['user_id'] != user_id):
+                return
+            del self._workouts[workout_id]
+            self._history_index[entry['user_id']].remove((entry['workout_date'], workout_id))
+            self._bump_version(entry['user_id'], "history")
+
+    def get_weekly_plan(self, user_id, week_start_date):
+        with self._lock:
+            return [dict(entry) for entry in self._plans.get((user_id, _iso(week_start_date)), [])]
+
+    def replace_weekly_plans(self, user_id, plans_by_week):
+        with self._lock:
+            for week_start_date, plan_entries in plans_by_week.items():
+                key = (user_id, _iso(week_start_date))
+                for old_entry in self._plans.pop(key, []):
+                    del self._plan_entries[old_entry['id']]
+                self._plans[key] = self._add_plan_entries(user_id, key[1], plan_entries)
+            self._bump_version(user_id, "plan")
+
+    def _add_plan_entries(self, user_id, week_key, plan_entries, existing=()):
+        """Stores new plan entries and returns them merged with `existing`, sorted by day."""
+        entries = list(existing)
+        for plan_entry in plan_entries:
+            entry = {
+                "id": self._next_plan_entry_id, "user_id": user_id, "week_start_date": week_key,
+                "day_of_week": plan_entry['day_of_week'], "pillar_focus": plan_entry['pillar_focus'],
+                "workout_id": plan_entry.get('workout_id'), "status": plan_entry.get('status', 'Planned'),
+                "session_focus": plan_entry.get('session_focus'), "phase": plan_entry.get('phase'),
+                "load_factor": plan_entry.get('load_factor', 1.0),
+            }
+            self._next_plan_entry_id += 1
+            self._plan_entries[entry['id']] = entry
+            entries.append(entry)
+        entries.sort(key=lambda entry: entry['day_of_week'])
+        return entries
+
+    def apply_weekly_plan_changes(self, user_id, changes_by_week):
+        changed = 0
+        with self._lock:
+            for week_start_date, (updates, inserts) in changes_by_week.items():
+                for update in updates:
+                    entry = self._plan_entries.get(update['id'])
+                    if entry is None or entry['user_id'] != user_id or entry['status'] != 'Planned':
+                        continue
+                    for field in ("pillar_focus", "session_focus", "phase", "load_factor"):
+                        entry[field] = update.get(field)
+                    changed += 1
+                if inserts:
+                    key = (user_id, _iso(week_start_date))
+                    self._plans[key] = self._add_plan_entries(user_id, key[1], inserts, self._plans.get(key, []))
+                    changed += len(inserts)
+            if changed:
+                self._bump_version(user_id, "plan")
+        return changed
+
+    def update_plan_entry_status(self, user_id, plan_entry_id, status, workout_id=None):
+        with self._lock:
+            entry = self._plan_entries.get(plan_entry_id)
+            if entry is None or entry['user_id'] != user_id:
+                return False
+            entry['status'] = status
+            if workout_id is not None:
+                entry['workout_id'] = workout_id
+            self._bump_version(user_id, "plan")
+            return True
+
+    def get_weekly_summaries(self, user_id, start_week, end_week):
+        # Computed on read; there are no triggers to maintain a rollup here
+        start_week, end_week = _iso(start_week), _iso(end_week)
+        weeks = {}
+        def pillar_counts(week_start, pillar):
+            week = weeks.setdefault(week_start, {"week_start_date": week_start, "pillars": {}, "muscles": {}})
+            return week, week['pillars'].setdefault(pillar, {"sessions": 0, "planned": 0, "completed": 0, "skipped": 0})
+
+        with self._lock:
+            window_end = date.fromisoformat(end_week) + timedelta(days=7)
+            for entry in self._history_since(user_id, start_week):
+                week_start = _week_start(entry['workout_date'])
+                if week_start >= window_end.isoformat():
+                    continue
+                week, counts = pillar_counts(week_start, _PILLAR_KEYS.get(entry['pillar'], entry['pillar']))
+                counts['sessions'] += 1
+                for muscle in entry['muscles_worked']:
+                    week['muscles'][muscle] = week['muscles'].get(muscle, 0) + 1
+            for (plan_user_id, week_start), entries in self._plans.items():
+                if plan_user_id != user_id or not start_week <= week_start <= end_week:
+                    continue
+                for entry in entries:
+                    _, counts = pillar_counts(week_start, entry['pillar_focus'])
+                    counts['planned'] += 1
+                    counts['completed'] += entry['status'] == 'Completed'
+                    counts['skipped'] += entry['status'] == 'Skipped'
+
+        for week in weeks.values():
+            week['pillars'] = dict(sorted(week['pillars'].items()))
+            week['muscles'] = dict(sorted(week['muscles'].items()))
+        return [weeks[week_start] for week_start in sorted(weeks)]
+
+    def get_generation_context(self, user_id, today=None, history_days=4, history_limit=3):
+        plan_params, sessions_params = database._generation_context_params(user_id, today, history_days, history_limit)
+        _, week_start_date, day_of_week = plan_params
+        _, start_date, limit = sessions_params
+        with self._lock:
+            settings = self.get_user_settings(user_id)
+            plan_row = next((dict(entry) for entry in self._plans.get((user_id, week_start_date), [])
+                             if entry['day_of_week'] == day_of_week), None)
+            session_rows = [self._public_entry(entry, full_text=False) for entry in self._history_since(user_id, start_date)[:limit]]
+        for row in session_rows:
+            row['muscles_worked'] = json.dumps(row['muscles_worked']) # _build_generation_context parses rows
+        return database._build_generation_context(user_id, settings, plan_row, session_rows)
+
+_BACKENDS = {"sqlite": SQLiteStorage, "memory": InMemoryStorage}
+_storage = None
+_storage_lock = threading.Lock()
+
+def create_storage(backend=None):
+    backend = backend or STORAGE_BACKEND
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'. Choose from: {', '.join(_BACKENDS)}.")
+    return _BACKENDS[backend]()
+
+def get_storage():
+    """Returns the process-wide storage, creating it from STORAGE_BACKEND on first use."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = create_storage()
+        return _storage
+
+def set_storage(storage):
+    """Replaces the process-wide storage (e.g. with an InMemoryStorage in tests)."""
+    global _storage
+    with _storage_lock:
+        _storage = storage
@@ -0,0 +1,97 @@
+import unittest
+import os
+import sys
+import asyncio
+import importlib
+from unittest import mock
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import ai_provider
+from ai_provider import SimpleGeminiProvider
+
+class RequestSent(Exception):
+    pass
+
+def client_key(client):
+    return client._transport._credentials.token
+
+def generativelanguage():
+    return importlib.import_module("google.ai.generativelanguage")
+
+class TestProviderKeys(unittest.TestCase):
+
+    def test_each_provider_sends_requests_with_its_own_key(self):
+        with mock.patch.object(ai_provider._load_sdk(), "configure") as configure:
+            first = SimpleGeminiProvider({"gemini_api_key": "tenant-a-key"})
+            second = SimpleGeminiProvider({"gemini_api_key": "tenant-b-key"})
+        configure.assert_not_called()
+        self.assertEqual(client_key(first.model._client), "tenant-a-key")
+        self.assertEqual(client_key(second.model._client), "tenant-b-key")
+
+        # The first provider's request goes out on its own client, after the second was created
+        with mock.patch.object(first.model._client, "generate_content", side_effect=RequestSent) as sent:
+            with self.assertRaises(RequestSent):
+                first.model.generate_content("prompt")
+        sent.assert_called_once()
+
+    def test_clients_are_shared_per_key(self):
+        first = SimpleGeminiProvider({"gemini_api_key": "tenant-a-key"})
+        again = SimpleGeminiProvider({"gemini_api_key": "tenant-a-key", "model_id": "gemini-1.5-flash-latest"})
+        self.assertIs(first.model._client, again.model._client)
+
+    def test_checking_options_creates_no_client(self):
+        clients = dict(ai_provider._clients)
+        ai_provider.check_provider_options({"gemini_api_key": "unchecked-key"})
+        with self.assertRaises(ValueError):
+            ai_provider.check_provider_options({"gemini_api_key": ""})
+        with self.assertRaises(ValueError):
+            ai_provider.check_provider_options({"gemini_api_key": "unchecked-key", "model_id": "no-such-model"})
+        self.assertEqual(dict(ai_provider._clients), clients)
+
+    def test_sdk_models_take_their_clients_from_the_bound_attributes(self):
+        # The SDK has no per-model client option; this pins the private attributes _bind_client relies on
+        model = ai_provider._load_sdk().GenerativeModel(ai_provider.DEFAULT_MODEL_ID)
+        self.assertIsNone(model._client)
+        self.assertIsNone(model._async_client)
+        with self.assertRaises(RuntimeError):
+            ai_provider._bind_client(object(), mock.Mock())
+
+class TestClientCache(unittest.TestCase):
+
+    def setUp(self):
+        # Real gRPC clients would start gRPC's asyncio runtime, which does not survive the fork tests
+        for name, close in (("GenerativeServiceClient", mock.Mock), ("GenerativeServiceAsyncClient", mock.AsyncMock)):
+            patcher = mock.patch.object(generativelanguage(), name,
+                                        side_effect=lambda close=close, **kwargs: mock.Mock(**{"transport.close": close()}))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(ai_provider, "_clients", ai_provider.OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_least_recently_used_clients_are_closed(self):
+        with mock.patch.object(ai_provider, "CLIENT_CACHE_SIZE", 2):
+            first = ai_provider._generative_client("key-1")
+            second = ai_provider._generative_client("key-2")
+            self.assertIs(ai_provider._generative_client("key-1"), first) # key-2 is now the oldest
+            ai_provider._generative_client("key-3")
+        self.assertEqual([api_key for api_key, _ in ai_provider._clients], ["key-1", "key-3"])
+        second.transport.close.assert_called_once()
+        first.transport.close.assert_not_called()
+
+    def test_async_clients_belong_to_their_event_loop(self):
+        provider = SimpleGeminiProvider({"gemini_api_key": "tenant-c-key"})
+        async def generate():
+            with mock.patch.object(provider.model, "generate_content_async", mock.AsyncMock(return_value="reply")):
+                self.assertEqual(await provider.generate_content_async("prompt"), "reply")
+            return provider.model._async_client, asyncio.get_running_loop()
+
+        first_loop_client, _ = asyncio.run(generate())
+        second_loop_client, second_loop = asyncio.run(generate())
+        self.assertIsNot(first_loop_client, second_loop_client)
+        generativelanguage().GenerativeServiceAsyncClient.assert_called_with(client_options={"api_key": "tenant-c-key"})
+        # The first loop's client left the cache when the next client was added after its loop closed
+        self.assertEqual([loop for _, loop in ai_provider._clients], [None, second_loop])
+
+if __name__ == '__main__':
+    unittest.main()
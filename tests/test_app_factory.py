@@ -0,0 +1,127 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import app as app_module
+import database
+import query_stats
+import storage as storage_backends
+from weekly_planner import replan_scheduler
+
+def fake_generator(user_data, settings, api_key):
+    return {"pillar": "Strength", "focus": "Full Body", "muscles_worked": ["Quads"], "workout_text": "## Workout"}
+
+class AppFactoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.original = (database.DB_FILE, database.SHARD_COUNT, database.WRITE_BATCHING, database.SETTINGS_CACHE)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, "factory_test.db")
+        patcher = mock.patch.object(app_module, "load_gemini_api_key", return_value="test-key")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        db_file, shard_count, write_batching, settings_cache = self.original
+        database.configure(db_file=db_file, shard_count=shard_count, write_batching=write_batching, settings_cache=settings_cache)
+        storage_backends.set_storage(None)
+        self.temp_dir.cleanup()
+
+    def create_app(self, **config):
+        return app_module.create_app({"DB_FILE": self.db_file, "STORAGE_BACKEND": "sqlite", **config})
+
+class TestCreateApp(AppFactoryTestCase):
+
+    def test_config_is_applied_and_schema_created(self):
+        app = self.create_app(DB_SETTINGS_CACHE=False, INLINE_BOOTSTRAP_STATE=False)
+        self.assertEqual(database.DB_FILE, self.db_file)
+        self.assertFalse(database.SETTINGS_CACHE)
+        self.assertTrue(os.path.exists(self.db_file))
+
+        response = app.test_client().get("/get_user_settings")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("primary_goal", response.get_json())
+
+    def test_generator_comes_from_config(self):
+        app = self.create_app(GENERATE_WORKOUT=fake_generator)
+        response = app.test_client().post("/generate_workout", json={"workout_pillar": "Strength"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["workout_text"], "## Workout")
+        self.assertEqual(len(database.get_workout_history(1, days=1)), 1)
+
+    def test_generation_is_rate_limited(self):
+        app = self.create_app(GENERATE_WORKOUT=fake_generator, RATE_LIMIT_WAIT_SECONDS=0)
+        client = app.test_client()
+        burst = app.extensions["rate_limiter"].limits_for("gemini-1.5-flash-latest")["userBurst"]
+        for _ in range(burst):
+            self.assertEqual(client.post("/generate_workout", json={"workout_pillar": "Strength"}).status_code, 200)
+        response = client.post("/generate_workout", json={"workout_pillar": "Strength"})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers["Retry-After"]), 1)
+        self.assertEqual(client.get("/get_rate_limit_stats").get_json()["rejected"]["user"], 1)
+
+class TestShutdown(AppFactoryTestCase):
+
+    def test_shutdown_waits_for_generations_and_refuses_new_ones(self):
+        started, release = threading.Event(), threading.Event()
+        def slow_generator(user_data, settings, api_key):
+            started.set()
+            release.wait(5)
+            return fake_generator(user_data, settings, api_key)
+
+        app = self.create_app(GENERATE_WORKOUT=slow_generator)
+        responses = []
+        request_thread = threading.Thread(target=lambda: responses.append(
+            app.test_client().post("/generate_workout", json={"workout_pillar": "Strength"})))
+        request_thread.start()
+        self.assertTrue(started.wait(5))
+
+        shutdown_thread = threading.Thread(target=app_module.shutdown, args=(app, 5))
+        shutdown_thread.start()
+        generations = app.extensions["generations"]
+        while not generations._draining:
+            time.sleep(0.001)
+        refused = app.test_client().post("/generate_workout", json={"workout_pillar": "Strength"})
+        self.assertEqual(refused.status_code, 503)
+        self.assertEqual(refused.headers["Retry-After"], str(app_module.DRAIN_RETRY_AFTER))
+        self.assertTrue(shutdown_thread.is_alive()) # Still waiting for the first generation
+
+        release.set()
+        request_thread.join(5)
+        shutdown_thread.join(5)
+        self.assertFalse(shutdown_thread.is_alive())
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(generations.in_flight, 0)
+
+    def test_drain_gives_up_after_timeout(self):
+        tracker = app_module.InFlightTracker()
+        with tracker.track():
+            self.assertFalse(tracker.drain(timeout=0.01))
+        self.assertTrue(tracker.drain(timeout=0.01))
+
+@unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+class TestAfterFork(unittest.TestCase):
+
+    def test_child_gets_fresh_locks_and_threads(self):
+        # Locks held by another parent thread at fork time would never be released in the child
+        with database._settings_cache_lock, query_stats._lock:
+            pid = os.fork()
+            if pid == 0:
+                ok = False
+                try:
+                    ok = (database._settings_cache_lock.acquire(timeout=1)
+                          and query_stats._lock.acquire(timeout=1)
+                          and database._history_writer is None)
+                    replan_scheduler.wait() # Its thread was started in this process
+                finally:
+                    os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import unittest
+import json
+import tempfile
+import datetime
+import sys
+import os
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import database
+import archive
+import manage
+
+class TestWorkoutHistoryArchival(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_db_file = database.DB_FILE
+        database.DB_FILE = os.path.join(self.tmp_dir.name, "test_training_app.db")
+        self.archive_path = os.path.join(self.tmp_dir.name, "test_archive.db")
+        database.setup_database()
+        self.user_id = 1
+
+        now = datetime.datetime.now()
+        conn = database.get_db_connection()
+        for days_ago, pillar in [(400, "Strength"), (200, "HIIT"), (10, "Zone2 Cardio"), (1, "Strength")]:
+            conn.execute('''
+                INSERT INTO workout_history (user_id, workout_date, pillar, focus, muscles_worked, full_workout_text)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (self.user_id, now - datetime.timedelta(days=days_ago), pillar, "Full Body", '["Quads"]', f"{pillar} workout " * 50))
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        database.DB_FILE = self.original_db_file
+        self.tmp_dir.cleanup()
+
+    def count_hot_entries(self):
+        conn = database.get_db_connection()
+        count = conn.execute("SELECT COUNT(*) FROM workout_history").fetchone()[0]
+        conn.close()
+        return count
+
+    def test_setup_enables_incremental_auto_vacuum(self):
+        conn = database.get_db_connection()
+        self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+        conn.close()
+
+    def test_dry_run_reports_without_moving(self):
+        report = archive.archive_workout_history(older_than_days=180, dry_run=True, archive_path=self.archive_path)
+        self.assertEqual(report['entries'], 2)
+        self.assertEqual(report['archived'], 0)
+        self.assertEqual(report['total_entries'], 4)
+        self.assertEqual(self.count_hot_entries(), 4)
+
+    def test_archival_moves_old_entries_and_union_view_spans_tiers(self):
+        report = archive.archive_workout_history(older_than_days=180, compress=True, archive_path=self.archive_path)
+        self.assertEqual(report['archived'], 2)
+        self.assertEqual(self.count_hot_entries(), 2)
+        # The 14-day history the UI shows is unaffected
+        self.assertEqual(len(database.get_workout_history(self.user_id, days=14)), 2)
+
+        full_history = archive.get_full_workout_history(self.user_id, archive_path=self.archive_path)
+        self.assertEqual([entry['pillar'] for entry in full_history], ["Strength", "Zone2 Cardio", "HIIT", "Strength"])
+        self.assertEqual([entry['archived'] for entry in full_history], [False, False, True, True])
+        self.assertTrue(full_history[-1]['full_workout_text'].startswith("Strength workout"))
+        self.assertEqual(full_history[-1]['muscles_worked'], ["Quads"])
+
+    def test_full_history_date_bounds_cross_the_tier_boundary(self):
+        archive.archive_workout_history(older_than_days=180, archive_path=self.archive_path)
+        start = datetime.datetime.now() - datetime.timedelta(days=300)
+        bounded = archive.get_full_workout_history(self.user_id, start_date=start, archive_path=self.archive_path)
+        self.assertEqual([entry['pillar'] for entry in bounded], ["Strength", "Zone2 Cardio", "HIIT"])
+
+    def test_archival_keeps_weekly_summary_counts(self):
+        def total_sessions():
+            start = datetime.date.today() - datetime.timedelta(weeks=60)
+            summaries = database.get_weekly_summaries(self.user_id, start, datetime.date.today())
+            return sum(p['sessions'] for week in summaries for p in week['pillars'].values())
+        self.assertEqual(total_sessions(), 4)
+        archive.archive_workout_history(older_than_days=180, archive_path=self.archive_path)
+        self.assertEqual(total_sessions(), 4)
+
+    def test_default_archive_sits_next_to_the_database(self):
+        archive.archive_workout_history(older_than_days=180)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, archive.ARCHIVE_DB_FILE)))
+        self.assertFalse(os.path.exists(archive.ARCHIVE_DB_FILE)) # Not in the working directory
+        full_history = archive.get_full_workout_history(self.user_id)
+        self.assertEqual([entry['archived'] for entry in full_history], [False, False, True, True])
+
+class TestShardedMaintenance(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original = (database.DB_FILE, database.SHARD_COUNT)
+        database.DB_FILE = os.path.join(self.tmp_dir.name, "test_training_app.db")
+        database.SHARD_COUNT = 3
+        database._shard_placement_cache.clear()
+        database.setup_database()
+        self.archive_path = os.path.join(self.tmp_dir.name, "test_archive.db")
+        self.user_ids = [database.create_user(f"user_{i}") for i in range(6)]
+        old_date = datetime.datetime.now() - datetime.timedelta(days=400)
+        for user_id in self.user_ids:
+            database.save_workout_to_history(user_id, "Strength", "Legs", ["Quads"], "recent")
+            conn = database.get_db_connection(user_id)
+            conn.execute('''
+                INSERT INTO workout_history (user_id, workout_date, pillar, focus, muscles_worked, full_workout_text)
+                VALUES (?, ?, 'HIIT', 'Full Body', '["Quads"]', 'old')
+            ''', (user_id, old_date))
+            conn.commit()
+            conn.close()
+
+    def tearDown(self):
+        database._shard_placement_cache.clear()
+        database.DB_FILE, database.SHARD_COUNT = self.original
+        self.tmp_dir.cleanup()
+
+    def test_archival_runs_on_every_shard(self):
+        report = archive.archive_workout_history(older_than_days=180, archive_path=self.archive_path)
+        self.assertEqual(report['shards'], 3)
+        self.assertEqual(report['archived'], 6)
+        self.assertEqual(report['users'], 6)
+        for user_id in self.user_ids:
+            full_history = archive.get_full_workout_history(user_id, archive_path=self.archive_path)
+            self.assertEqual([entry['archived'] for entry in full_history], [False, True])
+
+    def test_default_archives_sit_next_to_their_shards(self):
+        archive.archive_workout_history(older_than_days=180)
+        shard_dir = os.path.join(self.tmp_dir.name, database.SHARD_DIR)
+        self.assertEqual(sorted(name for name in os.listdir(shard_dir) if name.startswith("training_archive")),
+                         [f"training_archive_shard_{shard:03d}.db" # Shards with something to archive
+                          for shard in sorted({database.shard_for_user(user_id) for user_id in self.user_ids})])
+        for user_id in self.user_ids:
+            full_history = archive.get_full_workout_history(user_id)
+            self.assertEqual([entry['archived'] for entry in full_history], [False, True])
+
+    def test_export_covers_all_shards(self):
+        export_path = os.path.join(self.tmp_dir.name, "export.jsonl")
+        manage.cmd_export(manage.build_parser().parse_args(["export", "--output", export_path]))
+        with open(export_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        history_users = sorted(r['row']['user_id'] for r in records if r['table'] == "workout_history")
+        self.assertEqual(history_users, sorted(self.user_ids * 2))
+        self.assertEqual(len([r for r in records if r['table'] == "users"]), len(self.user_ids) + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import asyncio
+import tempfile
+import threading
+from unittest import mock
+import sys
+import os
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import database
+import async_database
+
+class TestAsyncDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_db_file = database.DB_FILE
+        database.DB_FILE = os.path.join(self.tmp_dir.name, "test_training_app.db")
+        database.invalidate_settings_cache()
+        database.setup_database()
+        self.user_id = 1
+
+    def tearDown(self):
+        database.invalidate_settings_cache()
+        database.DB_FILE = self.original_db_file
+        self.tmp_dir.cleanup()
+
+    def test_results_match_sync_layer(self):
+        async def scenario():
+            await async_database.save_user_settings(self.user_id, {"primary_goal": "Fat Loss", "focus_rotation": ["Push"]})
+            await asyncio.gather(*[
+                async_database.save_workout_to_history(self.user_id, "Strength", "Upper Body", ["Chest"], f"Workout {i}")
+                for i in range(5)
+            ])
+            return (await async_database.get_user_settings(self.user_id),
+                    await async_database.get_workout_history(self.user_id, days=14),
+                    await async_database.get_generation_context(self.user_id))
+
+        settings, history, context = asyncio.run(scenario())
+        self.assertEqual(settings, database.get_user_settings(self.user_id))
+        self.assertEqual(settings['focus_rotation'], ["Push"])
+        self.assertEqual(len(history), 5)
+        self.assertEqual(history, database.get_workout_history(self.user_id, days=14))
+        self.assertEqual(context, database.get_generation_context(self.user_id))
+
+    def test_cold_shard_lookup_runs_off_the_event_loop(self):
+        original_shard_count = database.SHARD_COUNT
+        database.SHARD_COUNT = 2
+        database._shard_placement_cache.clear()
+        self.addCleanup(database._shard_placement_cache.clear)
+        self.addCleanup(setattr, database, "SHARD_COUNT", original_shard_count)
+        database.setup_database()
+        user_id = database.create_user("sharded_user")
+        database._shard_placement_cache.clear()
+
+        lookup_threads = [] # Threads that queried the catalog
+        get_catalog_connection = database.get_catalog_connection
+        def recording_get_catalog_connection():
+            lookup_threads.append(threading.current_thread())
+            return get_catalog_connection()
+
+        async def scenario():
+            await async_database.save_workout_to_history(user_id, "Strength", "Upper Body", ["Chest"], "Workout")
+            return await async_database.get_workout_history(user_id, days=14)
+
+        with mock.patch.object(database, "get_catalog_connection", recording_get_catalog_connection):
+            history = asyncio.run(scenario())
+        self.assertEqual(len(history), 1)
+        self.assertEqual(len(lookup_threads), 1) # Cached after the first lookup
+        self.assertIsNot(lookup_threads[0], threading.main_thread())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+from unittest import mock
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from credentials import CredentialStore, write_json_atomically
+from storage import InMemoryStorage
+
+class TestCredentialStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.config_file = os.path.join(self.temp_dir.name, "user_config.json")
+        self.storage = InMemoryStorage()
+        self.store = CredentialStore(self.config_file, storage=self.storage)
+        env = mock.patch.dict(os.environ, {"GEMINI_API_KEY": "env-key"})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_global_key_falls_back_to_the_environment(self):
+        self.assertEqual(self.store.global_api_key(), "env-key")
+        with open(self.config_file, "w", encoding="utf-8") as f:
+            f.write("{not json")
+        self.assertEqual(self.store.global_api_key(), "env-key")
+
+    def test_config_file_is_read_again_only_when_it_changes(self):
+        self.store.save_global_api_key("file-key-1")
+        for _ in range(3):
+            self.assertEqual(self.store.global_api_key(), "file-key-1")
+        self.assertEqual(self.store.get_cache_stats()["file_reads"], 1)
+
+        # Written by another process
+        write_json_atomically(self.config_file, {"GEMINI_API_KEY": "file-key-2"})
+        self.assertEqual(self.store.global_api_key(), "file-key-2")
+        self.assertEqual(self.store.get_cache_stats()["file_reads"], 2)
+
+    def test_atomic_write_keeps_other_settings_and_leaves_no_temp_files(self):
+        write_json_atomically(self.config_file, {"OTHER": 1})
+        self.store.save_global_api_key("file-key")
+        with open(self.config_file, encoding="utf-8") as f:
+            self.assertEqual(json.load(f), {"OTHER": 1, "GEMINI_API_KEY": "file-key"})
+        self.assertEqual(os.listdir(self.temp_dir.name), ["user_config.json"])
+        self.assertEqual(os.stat(self.config_file).st_mode & 0o777, 0o600)
+
+    def test_failed_write_leaves_the_old_file(self):
+        self.store.save_global_api_key("file-key")
+        with self.assertRaises(TypeError):
+            write_json_atomically(self.config_file, {"GEMINI_API_KEY": object()})
+        self.assertEqual(self.store.global_api_key(), "file-key")
+        self.assertEqual(os.listdir(self.temp_dir.name), ["user_config.json"])
+
+    def test_user_key_takes_precedence_and_is_cached(self):
+        self.assertEqual(self.store.api_key_for(1), "env-key")
+        self.store.save_user_api_key(1, "user-key")
+        self.assertEqual(self.store.api_key_for(1), "user-key")
+        with mock.patch.object(self.storage, "get_user_api_key") as get_user_api_key:
+            self.assertEqual(self.store.api_key_for(1), "user-key")
+            get_user_api_key.assert_not_called()
+        self.assertEqual(self.store.api_key_for(2), "env-key")
+        self.store.delete_user_api_key(1)
+        self.assertEqual(self.store.api_key_for(1), "env-key")
+
+    def test_user_keys_written_elsewhere_are_seen_on_the_next_lookup(self):
+        self.assertEqual(self.store.api_key_for(1), "env-key")
+        self.storage.save_user_api_key(1, "user-key") # Another worker
+        self.assertEqual(self.store.api_key_for(1), "user-key")
+        self.storage.save_user_api_key(1, "new-user-key")
+        self.assertEqual(self.store.api_key_for(1), "new-user-key")
+        self.storage.delete_user_api_key(1)
+        self.assertEqual(self.store.api_key_for(1), "env-key")
+        self.storage.save_user_api_key(1, "user-key-again") # Saved after a delete: still a new version
+        self.assertEqual(self.store.api_key_for(1), "user-key-again")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import unittest
+import datetime
+import dataclasses
+import tempfile
+import sqlite3
+import sys
+import os
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import database
+
+class DatabaseTestCase(unittest.TestCase):
+    """Points database.py at a throwaway SQLite file for each test."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_db_file = database.DB_FILE
+        database.DB_FILE = os.path.join(self.tmp_dir.name, "test_training_app.db")
+        database.invalidate_settings_cache()
+        database.setup_database()
+        self.user_id = 1 # default_user created by setup_database
+
+    def tearDown(self):
+        database.invalidate_settings_cache()
+        database.DB_FILE = self.original_db_file
+        self.tmp_dir.cleanup()
+
+class TestUserSettingsCache(DatabaseTestCase):
+
+    def test_second_read_is_served_from_cache(self):
+        before = database.get_settings_cache_stats()
+        first = database.get_user_settings(self.user_id)
+        second = database.get_user_settings(self.user_id)
+        after = database.get_settings_cache_stats()
+        self.assertEqual(first, second)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_returned_settings_are_copies(self):
+        settings = database.get_user_settings(self.user_id)
+        settings['focus_rotation'].append("Legs")
+        settings['primary_goal'] = "Mutated"
+        fresh = database.get_user_settings(self.user_id)
+        self.assertNotIn("Legs", fresh['focus_rotation'])
+        self.assertEqual(fresh['primary_goal'], "Balanced Fitness")
+
+    def test_save_invalidates_cached_settings(self):
+        database.get_user_settings(self.user_id)
+        database.save_user_settings(self.user_id, {"strength_freq": 4, "focus_rotation": ["Push", "Pull"]})
+        settings = database.get_user_settings(self.user_id)
+        self.assertEqual(settings['strength_freq'], 4)
+        self.assertEqual(settings['focus_rotation'], ["Push", "Pull"])
+
+    def test_write_from_another_process_is_detected(self):
+        database.get_user_settings(self.user_id)
+        # Simulate another worker process: it bumps the version without touching our cache.
+        conn = sqlite3.connect(database.DB_FILE)
+        conn.execute("UPDATE user_settings SET primary_goal = 'Longevity', settings_version = settings_version + 1 WHERE user_id = ?", (self.user_id,))
+        conn.commit()
+        conn.close()
+        self.assertEqual(database.get_user_settings(self.user_id)['primary_goal'], "Longevity")
+
+    def test_unknown_user_gets_defaults_without_caching(self):
+        settings = database.get_user_settings(999)
+        self.assertEqual(settings['primary_goal'], "Balanced Fitness")
+        self.assertEqual(database.get_settings_cache_stats()['size'], 0)
+
+class TestGenerationContext(DatabaseTestCase):
+
+    def test_context_contains_settings_plan_and_summarized_history(self):
+        today = datetime.date.today()
+        week_start = today - datetime.timedelta(days=today.weekday())
+        database.save_daily_plan_entry({
+            "user_id": self.user_id, "week_start_date": week_start, "day_of_week": today.weekday(),
+            "pillar_focus": "HIIT", "status": "Planned", "workout_id": None
+        })
+        for pillar in ["Strength", "Zone2 Cardio", "HIIT", "Strength"]:
+            database.save_workout_to_history(self.user_id, pillar, "Upper Body", ["Chest", "Triceps"], "Full text")
+
+        context = database.get_generation_context(self.user_id)
+        self.assertEqual(context.settings['primary_goal'], "Balanced Fitness")
+        self.assertEqual(context.todays_plan_entry['pillar_focus'], "HIIT")
+        self.assertEqual(context.todays_planned_pillar, "Today's Planned Pillar: HIIT")
+        self.assertEqual(len(context.recent_sessions), 3)
+        self.assertNotIn('full_workout_text', context.recent_sessions[0])
+        self.assertIn("Muscles: Chest, Triceps", context.recent_history)
+
+    def test_context_without_plan_or_history(self):
+        context = database.get_generation_context(self.user_id)
+        self.assertIsNone(context.todays_plan_entry)
+        self.assertIn("Not specifically planned", context.todays_planned_pillar)
+        self.assertEqual(context.recent_history, "Recent Training History: No recent workouts logged.")
+
+    def test_context_is_immutable(self):
+        context = database.get_generation_context(self.user_id)
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            context.user_id = 2
+        with self.assertRaises(TypeError):
+            context.settings['primary_goal'] = "Longevity"
+
+class TestWeeklySummaries(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.week_start = datetime.date(2024, 7, 15) # A Monday
+        conn = database.get_db_connection()
+        for day_offset, pillar, muscles in [(0, "Strength", '["Chest", "Triceps"]'), (2, "Zone2 Cardio", '["Cardio"]'),
+                                            (6, "Strength", '["Quads"]'), (7, "HIIT", '["Quads"]')]:
+            workout_date = datetime.datetime.combine(self.week_start + datetime.timedelta(days=day_offset), datetime.time(9, 30))
+            conn.execute('''
+                INSERT INTO workout_history (user_id, workout_date, pillar, focus, muscles_worked, full_workout_text)
+                VALUES (?, ?, ?, 'Full Body', ?, 'text')
+            ''', (self.user_id, workout_date, pillar, muscles))
+        conn.commit()
+        conn.close()
+        for day, pillar in enumerate(["Strength", "Zone2", "Strength", "Rest", "HIIT", "Rest", "Rest"]):
+            database.save_daily_plan_entry({
+                "user_id": self.user_id, "week_start_date": self.week_start, "day_of_week": day,
+                "pillar_focus": pillar, "status": "Planned", "workout_id": None
+            })
+
+    def summaries(self):
+        return database.get_weekly_summaries(self.user_id, self.week_start, self.week_start + datetime.timedelta(weeks=1))
+
+    def test_triggers_maintain_summary_on_insert(self):
+        first_week, second_week = self.summaries()
+        self.assertEqual(first_week['week_start_date'], "2024-07-15")
+        self.assertEqual(first_week['pillars']['Strength'], {"sessions": 2, "planned": 2, "completed": 0, "skipped": 0})
+        self.assertEqual(first_week['pillars']['Zone2']['sessions'], 1) # 'Zone2 Cardio' maps to the plan pillar
+        self.assertEqual(first_week['pillars']['Rest']['planned'], 3)
+        self.assertEqual(first_week['muscles'], {"Cardio": 1, "Chest": 1, "Quads": 1, "Triceps": 1})
+        self.assertEqual(second_week['week_start_date'], "2024-07-22") # Sunday/Monday boundary
+        self.assertEqual(second_week['pillars'], {"HIIT": {"sessions": 1, "planned": 0, "completed": 0, "skipped": 0}})
+
+    def test_status_change_and_delete_update_summary(self):
+        plan = database.get_weekly_plan(self.user_id, self.week_start)
+        database.update_plan_entry_status(self.user_id, plan[0]['id'], "Completed")
+        database.update_plan_entry_status(self.user_id, plan[2]['id'], "Skipped")
+        zone2_entry = [entry for entry in database.get_workout_history(self.user_id, days=100000) if entry['pillar'] == "Zone2 Cardio"][0]
+        database.delete_workout_from_history(zone2_entry['id'])
+
+        first_week = self.summaries()[0]
+        self.assertEqual(first_week['pillars']['Strength'], {"sessions": 2, "planned": 2, "completed": 1, "skipped": 1})
+        self.assertEqual(first_week['pillars']['Zone2']['sessions'], 0)
+        self.assertNotIn("Cardio", first_week['muscles'])
+
+    def test_rebuild_matches_incremental_maintenance(self):
+        database.clear_weekly_plan(self.user_id, self.week_start)
+        incremental = self.summaries()
+        database.rebuild_weekly_summaries(self.user_id)
+        self.assertEqual(self.summaries(), incremental)
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original = (database.DB_FILE, database.SHARD_COUNT)
+        database.DB_FILE = os.path.join(self.tmp_dir.name, "test_training_app.db")
+        database.SHARD_COUNT = 4
+        database._shard_placement_cache.clear()
+        database.invalidate_settings_cache()
+        database.setup_database()
+        self.user_ids = [database.create_user(f"user_{i}") for i in range(12)]
+
+    def tearDown(self):
+        database._shard_placement_cache.clear()
+        database.invalidate_settings_cache()
+        database.DB_FILE, database.SHARD_COUNT = self.original
+        self.tmp_dir.cleanup()
+
+    def test_users_are_spread_over_shards_and_placement_is_stable(self):
+        placements = {user_id: database.shard_for_user(user_id) for user_id in self.user_ids}
+        self.assertGreater(len(set(placements.values())), 1)
+        database._shard_placement_cache.clear()
+        database.SHARD_COUNT = 8 # Growing the shard count must not move existing users
+        self.assertEqual({user_id: database.shard_for_user(user_id) for user_id in self.user_ids}, placements)
+
+    def test_user_data_lives_only_on_its_shard(self):
+        for user_id in self.user_ids:
+            database.save_workout_to_history(user_id, "Strength", "Legs", ["Quads"], f"Workout for {user_id}")
+        for user_id in self.user_ids:
+            history = database.get_workout_history(user_id)
+            self.assertEqual([entry['full_workout_text'] for entry in history], [f"Workout for {user_id}"])
+
+        counts = database.for_each_shard(lambda conn, path: conn.execute("SELECT COUNT(*) FROM workout_history").fetchone()[0])
+        self.assertEqual(len(counts), 4)
+        self.assertEqual(sum(counts), len(self.user_ids))
+
+    def test_connection_without_user_is_rejected(self):
+        with self.assertRaises(ValueError):
+            database.get_db_connection()
+
+    def test_settings_and_summaries_work_per_shard(self):
+        user_id = self.user_ids[-1]
+        database.save_user_settings(user_id, {"strength_freq": 5})
+        self.assertEqual(database.get_user_settings(user_id)['strength_freq'], 5)
+        database.save_workout_to_history(user_id, "HIIT", "Full Body", ["Quads"], "text")
+        database.rebuild_weekly_summaries() # Cross-shard rebuild
+        today = datetime.date.today()
+        summaries = database.get_weekly_summaries(user_id, today - datetime.timedelta(days=7), today)
+        self.assertEqual(sum(week['pillars'].get('HIIT', {}).get('sessions', 0) for week in summaries), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import os
+import sys
+import io
+import json
+import logging
+from unittest import mock
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+import tracing
+from tests.test_app_factory import AppFactoryTestCase, fake_generator
+
+class LoggingTestCase(unittest.TestCase):
+    """Routes logging through the queue into a buffer; read_records() drains it."""
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        logging_config.configure_logging(level="INFO", fmt="json", stream=self.stream)
+        self.logger = logging.getLogger("tests.logging_config")
+
+    def tearDown(self):
+        logging_config.stop_logging()
+
+    def read_records(self):
+        logging_config.stop_logging() # Writes everything still queued
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+class TestStructuredRecords(LoggingTestCase):
+
+    def test_record_is_json_with_fields(self):
+        self.logger.info("Saved %s rows", 3, extra={"fields": {"user_id": 7}})
+        self.logger.debug("Below the level")
+        [record] = self.read_records()
+        self.assertEqual(record["level"], "INFO")
+        self.assertEqual(record["logger"], "tests.logging_config")
+        self.assertEqual(record["message"], "Saved 3 rows")
+        self.assertEqual(record["user_id"], 7)
+        self.assertIsNone(record["request_id"])
+
+    def test_request_id_is_the_trace_id(self):
+        original = tracing.TRACING
+        tracing.configure(enabled=True)
+        self.addCleanup(tracing.configure, enabled=original)
+        root, token = tracing.begin_trace("GET /x")
+        self.logger.info("Inside the request")
+        tracing.end_trace(root, token)
+        [record] = self.read_records()
+        self.assertEqual(record["request_id"], root.trace_id)
+
+    def test_exception_is_kept_apart_from_the_message(self):
+        try:
+            raise ValueError("bad input")
+        except ValueError:
+            self.logger.error("Saving failed", exc_info=True)
+        [record] = self.read_records()
+        self.assertEqual(record["message"], "Saving failed")
+        self.assertIn("ValueError: bad input", record["exception"])
+
+class TestPayloads(LoggingTestCase):
+
+    def log(self, level, payload, sample_rate=1.0, full=False):
+        with mock.patch.multiple(logging_config, LOG_PAYLOAD_SAMPLE_RATE=sample_rate, LOG_FULL_PROMPTS=full,
+                                 LOG_MAX_FIELD_CHARS=10):
+            logging_config.log_payload(self.logger, level, "Payload", payload, pillar="HIIT")
+
+    def test_strings_are_truncated(self):
+        self.log(logging.INFO, {"notes": "x" * 25, "days": [1, 2], "recent": ["y" * 12]})
+        [record] = self.read_records()
+        self.assertEqual(record["pillar"], "HIIT")
+        self.assertEqual(record["payload"], {"notes": "xxxxxxxxxx... [15 more chars]", "days": [1, 2],
+                                             "recent": ["yyyyyyyyyy... [2 more chars]"]})
+
+    def test_sampling_below_warning_only(self):
+        self.log(logging.INFO, "dropped", sample_rate=0.0)
+        self.log(logging.ERROR, "kept", sample_rate=0.0)
+        self.assertEqual([record["payload"] for record in self.read_records()], ["kept"])
+
+    def test_full_prompts_are_written_whole(self):
+        prompt = "p" * 50
+        self.log(logging.INFO, prompt, sample_rate=0.0, full=True)
+        [record] = self.read_records()
+        self.assertEqual(record["payload"], prompt)
+
+class TestAppLogging(LoggingTestCase, AppFactoryTestCase):
+
+    def setUp(self):
+        LoggingTestCase.setUp(self)
+        AppFactoryTestCase.setUp(self)
+
+    def tearDown(self):
+        AppFactoryTestCase.tearDown(self)
+        LoggingTestCase.tearDown(self)
+
+    def test_request_logs_carry_the_response_trace_id(self):
+        app = self.create_app(GENERATE_WORKOUT=fake_generator, CONFIGURE_LOGGING=False)
+        response = app.test_client().post("/generate_workout", json={"workout_pillar": "Strength"})
+        self.assertEqual(response.status_code, 200)
+        saved = [record for record in self.read_records() if record["message"].startswith("Workout saved to history")]
+        self.assertEqual([record["request_id"] for record in saved], [response.headers[tracing.TRACE_ID_HEADER]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import json
+import tempfile
+import datetime
+import contextlib
+import io
+import sys
+import os
+from unittest import mock
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import database
+import manage
+
+class TestReplan(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original = (database.DB_FILE, database.SHARD_COUNT)
+        database.DB_FILE = os.path.join(self.tmp_dir.name, "test_training_app.db")
+        database.SHARD_COUNT = 2
+        database._shard_placement_cache.clear()
+        database.setup_database()
+        self.checkpoint = os.path.join(self.tmp_dir.name, "replan.checkpoint.json")
+        self.week = datetime.date(2024, 7, 22)
+        self.user_ids = [database.create_user(f"user_{i}") for i in range(5)]
+        for user_id in self.user_ids:
+            database.save_user_settings(user_id, {"strength_freq": 3, "zone2_freq": 2, "hiit_freq": 1})
+        self.total = len(self.user_ids) + 1 # setup_database also creates default_user with settings
+
+    def tearDown(self):
+        database._shard_placement_cache.clear()
+        database.DB_FILE, database.SHARD_COUNT = self.original
+        self.tmp_dir.cleanup()
+
+    def replan(self, *extra):
+        args = manage.build_parser().parse_args(["replan", "--week-start", self.week.isoformat(), "--workers", "1",
+                                                 "--batch-size", "2", "--checkpoint", self.checkpoint, "--json", *extra])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            exit_code = manage.cmd_replan(args)
+        return exit_code, json.loads(output.getvalue()[output.getvalue().index("{"):])
+
+    def test_plans_every_user_and_continues_the_cycle(self):
+        exit_code, stats = self.replan()
+        self.assertEqual(exit_code, 0)
+        self.assertEqual((stats['planned'], stats['failed'], stats['shards']), (self.total, 0, 2))
+        for user_id in self.user_ids:
+            plan = database.get_weekly_plan(user_id, self.week)
+            self.assertEqual(len(plan), 7)
+            self.assertEqual({entry['phase'] for entry in plan}, {"Build"})
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        # The following week continues from the one just planned
+        self.week += datetime.timedelta(weeks=1)
+        self.replan()
+        loads = {entry['load_factor'] for entry in database.get_weekly_plan(self.user_ids[0], self.week)}
+        self.assertEqual(loads, {1.05})
+
+    def test_skips_planned_users_unless_forced(self):
+        self.replan()
+        _, stats = self.replan()
+        self.assertEqual((stats['planned'], stats['already_planned']), (0, self.total))
+        _, stats = self.replan("--force")
+        self.assertEqual(stats['planned'], self.total)
+
+    def test_force_keeps_completed_and_skipped_days(self):
+        self.replan()
+        user_id = self.user_ids[0]
+        before = database.get_weekly_plan(user_id, self.week)
+        database.update_plan_entry_status(user_id, before[0]['id'], "Completed", workout_id=42)
+        database.update_plan_entry_status(user_id, before[1]['id'], "Skipped")
+        database.save_user_settings(user_id, {"strength_freq": 0, "zone2_freq": 0, "hiit_freq": 0, "stability_freq": 0})
+
+        exit_code, stats = self.replan("--force")
+        self.assertEqual((exit_code, stats['planned']), (0, self.total))
+        after = database.get_weekly_plan(user_id, self.week)
+        self.assertEqual(after[:2], [dict(before[0], status="Completed", workout_id=42), dict(before[1], status="Skipped")])
+        self.assertEqual([entry['id'] for entry in after], [entry['id'] for entry in before]) # Changed in place
+        self.assertEqual({entry['pillar_focus'] for entry in after[2:]}, {"Rest"})
+
+    def test_resumes_from_checkpoint(self):
+        manage._save_checkpoint(self.checkpoint, self.week.isoformat(), self.user_ids[:3])
+        _, stats = self.replan()
+        self.assertEqual((stats['planned'], stats['resumed']), (self.total - 3, 3))
+        self.assertEqual(database.get_weekly_plan(self.user_ids[0], self.week), [])
+        self.assertEqual(len(database.get_weekly_plan(self.user_ids[4], self.week)), 7)
+
+    def test_checkpoint_from_another_week_is_ignored(self):
+        manage._save_checkpoint(self.checkpoint, "2024-07-15", self.user_ids)
+        _, stats = self.replan()
+        self.assertEqual((stats['planned'], stats['resumed']), (self.total, 0))
+
+    def test_process_pool(self):
+        args = manage.build_parser().parse_args(["replan", "--week-start", self.week.isoformat(), "--workers", "2",
+                                                 "--checkpoint", self.checkpoint])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(manage.cmd_replan(args), 0)
+        for user_id in self.user_ids:
+            self.assertEqual(len(database.get_weekly_plan(user_id, self.week)), 7)
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original = (database.DB_FILE, database.SHARD_COUNT)
+        database.configure(shard_count=0)
+        self.db_file = os.path.join(self.tmp_dir.name, "manage_test.db")
+
+    def tearDown(self):
+        database.configure(db_file=self.original[0], shard_count=self.original[1])
+        self.tmp_dir.cleanup()
+
+    def main(self, *argv):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return manage.main(["--db", self.db_file, *argv])
+
+    def test_db_option_configures_the_database(self):
+        with mock.patch.object(database, "configure", wraps=database.configure) as configure:
+            self.assertEqual(self.main("rebuild-summaries", "--skip-archive"), 0)
+        configure.assert_called_once_with(db_file=self.db_file)
+        self.assertEqual(database.list_users()[0]['username'], "default_user")
+
+    def test_read_only_commands_leave_the_schema_alone(self):
+        self.assertEqual(self.main("archive", "--dry-run"), 2) # No database yet, and none is created
+        self.assertFalse(os.path.exists(self.db_file))
+
+        self.main("rebuild-summaries", "--skip-archive")
+        with mock.patch.object(database, "setup_database") as setup_database:
+            self.assertEqual(self.main("archive", "--dry-run", "--json"), 0)
+            self.assertEqual(self.main("export", "--output", os.path.join(self.tmp_dir.name, "export.jsonl")), 0)
+        setup_database.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import unittest
+import os
+import sys
+import json
+import time
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import metrics
+from tests.test_app_factory import AppFactoryTestCase, fake_generator
+
+def sample_lines(text, name):
+    return [line for line in text.splitlines() if line.startswith(name)]
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("op_seconds", "Op latency.", ("op",), buckets=(0.1, 1), registry=self.registry)
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.labels("read").observe(value)
+        text = self.registry.render()
+        self.assertIn("# HELP op_seconds Op latency.\n# TYPE op_seconds histogram\n", text)
+        self.assertEqual(sample_lines(text, "op_seconds"), [
+            'op_seconds_bucket{op="read",le="0.1"} 2',
+            'op_seconds_bucket{op="read",le="1"} 3',
+            'op_seconds_bucket{op="read",le="+Inf"} 4',
+            'op_seconds_sum{op="read"} 3.65',
+            'op_seconds_count{op="read"} 4',
+        ])
+
+    def test_counter_and_label_escaping(self):
+        counter = metrics.Counter("errors_total", "Errors.", ("error",), registry=self.registry)
+        counter.labels('bad "quote"\\').inc()
+        counter.labels('bad "quote"\\').inc(2)
+        self.assertIn('errors_total{error="bad \\"quote\\"\\\\"} 3', self.registry.render())
+        with self.assertRaises(ValueError):
+            counter.labels("a", "b")
+
+    def test_collectors_are_read_at_scrape_time(self):
+        depth = [3]
+        collect = lambda: [("queue_depth", "gauge", "Queued.", [("queue_depth", {}, depth[0])])]
+        self.registry.register_collector(collect)
+        self.assertIn("queue_depth 3\n", self.registry.render())
+        depth[0] = 5
+        self.assertIn("queue_depth 5\n", self.registry.render())
+        self.registry.unregister_collector(collect)
+        self.assertNotIn("queue_depth", self.registry.render())
+
+    def test_record_ai_call(self):
+        usage = SimpleNamespace(prompt_token_count=120, candidates_token_count=30)
+        metrics.record_ai_call("test-model", time.perf_counter(), SimpleNamespace(usage_metadata=usage))
+        metrics.record_ai_call("test-model", time.perf_counter(), error=TimeoutError())
+        text = metrics.REGISTRY.render()
+        self.assertIn('ai_tokens_total{model="test-model",kind="input"}', text)
+        self.assertIn('ai_errors_total{model="test-model",error="TimeoutError"} 1', text)
+        self.assertIn('ai_request_duration_seconds_count{model="test-model",outcome="error"} 1', text)
+
+class TestMultiProcess(unittest.TestCase):
+    """Aggregation over worker processes through METRICS_MULTIPROC_DIR."""
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+        self.registry = metrics.Registry()
+        self.requests = metrics.Counter("requests_total", "Requests.", ("route",), registry=self.registry)
+        self.latency = metrics.Histogram("op_seconds", "Op latency.", buckets=(1,), registry=self.registry)
+        self.queued = metrics.Gauge("queued", "Queued.", registry=self.registry)
+        for name, value in (("REGISTRY", self.registry), ("_retired", False)):
+            patcher = mock.patch.object(metrics, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        metrics.configure(multiproc_dir=self.dir, snapshot_interval=60) # Snapshots written by the tests
+        self.addCleanup(metrics.configure, multiproc_dir="", snapshot_interval=metrics.SNAPSHOT_INTERVAL)
+
+    def write_other_worker(self, pid, requests, latency, queued):
+        other = metrics.Registry()
+        metrics.Counter("requests_total", "Requests.", ("route",), registry=other).labels("/").inc(requests)
+        metrics.Histogram("op_seconds", "Op latency.", buckets=(1,), registry=other).labels().observe(latency)
+        metrics.Gauge("queued", "Queued.", registry=other).labels().set(queued)
+        path = os.path.join(self.dir, f"metrics_{pid}.json")
+        with open(path, "w") as f:
+            json.dump([list(family) for family in other.families()], f)
+        return path
+
+    def test_counters_and_histograms_are_summed_and_gauges_kept_per_worker(self):
+        self.requests.labels("/").inc(2)
+        self.latency.labels().observe(0.5)
+        self.queued.labels().set(1)
+        self.write_other_worker(101, requests=3, latency=2, queued=4)
+        text = metrics.render()
+        self.assertIn('requests_total{route="/"} 5\n', text)
+        self.assertEqual(sample_lines(text, "op_seconds"), [
+            'op_seconds_bucket{le="1"} 1',
+            'op_seconds_bucket{le="+Inf"} 2',
+            "op_seconds_sum 2.5",
+            "op_seconds_count 2",
+        ])
+        self.assertEqual(sorted(sample_lines(text, "queued")), sorted([f'queued{{pid="{os.getpid()}"}} 1', 'queued{pid="101"} 4']))
+        self.assertEqual(text.count("# TYPE requests_total counter"), 1)
+
+    def test_gauges_of_dead_workers_are_left_out(self):
+        path = self.write_other_worker(102, requests=3, latency=2, queued=4)
+        stale = time.time() - 4 * metrics.SNAPSHOT_INTERVAL
+        os.utime(path, (stale, stale))
+        text = metrics.render()
+        self.assertNotIn('pid="102"', text)
+        self.assertIn('requests_total{route="/"} 3\n', text) # Its counts still happened
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+    def test_totals_keep_the_counts_of_exited_workers(self):
+        self.requests.labels("/").inc()
+        pid = os.fork()
+        if pid == 0:
+            try: # A worker: starts from zero, counts, snapshots, exits
+                self.requests.labels("/").inc(2)
+                self.queued.labels().set(7)
+                metrics.write_snapshot()
+                metrics.retire_process()
+                metrics.retire_process() # Counted once
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(sorted(os.listdir(self.dir)), [".lock", "retired.json"])
+        text = metrics.render()
+        self.assertIn('requests_total{route="/"} 3\n', text)
+        self.assertNotIn('queued{pid="' + str(pid), text) # Exited workers have no gauges
+
+class TestMetricsEndpoint(AppFactoryTestCase):
+
+    def test_metrics_cover_routes_stages_and_queues(self):
+        metrics.REGISTRY.reset()
+        app = self.create_app(GENERATE_WORKOUT=fake_generator)
+        client = app.test_client()
+        self.assertEqual(client.post("/generate_workout", json={"workout_pillar": "Strength"}).status_code, 200)
+        client.delete("/delete_workout/999999")
+
+        response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, metrics.CONTENT_TYPE)
+        text = response.get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_count{route="/generate_workout",method="POST",status="200"} 1', text)
+        self.assertIn('route="/delete_workout/<int:workout_id>"', text) # The template, not the path
+        for stage in ("context", "rate_limit", "save"):
+            self.assertIn(f'workout_generation_stage_seconds_count{{stage="{stage}"}} 1', text)
+        self.assertIn('db_operation_duration_seconds_count{operation="save_workout_to_history"}', text)
+        self.assertIn('cache_lookups_total{cache="credentials",result="hit"}', text)
+        self.assertIn('rate_limit_decisions_total{result="allowed"} 1', text)
+        self.assertIn("workout_generations_in_flight 0\n", text)
+
+        # A second app replaces the first one's collector instead of adding another
+        self.create_app()
+        self.assertEqual(metrics.REGISTRY.render().count("# TYPE workout_generations_in_flight gauge"), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import tempfile
+import json
+import time
+import sqlite3
+import sys
+import os
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import database
+import query_stats
+
+class TestQueryStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original = (database.DB_FILE, query_stats.SLOW_QUERY_MS, query_stats.SLOW_QUERY_LOG)
+        database.DB_FILE = os.path.join(self.tmp_dir.name, "test_training_app.db")
+        database.invalidate_settings_cache()
+        database.setup_database()
+        query_stats.reset_query_stats()
+
+    def tearDown(self):
+        database.DB_FILE, query_stats.SLOW_QUERY_MS, query_stats.SLOW_QUERY_LOG = self.original
+        database.invalidate_settings_cache()
+        query_stats.reset_query_stats()
+        self.tmp_dir.cleanup()
+
+    def test_queries_are_counted_per_operation(self):
+        database.save_workout_to_history(1, "Strength", "Legs", ["Quads"], "Squats")
+        database.get_workout_history(1)
+        database.get_workout_history(1)
+        operations = query_stats.get_query_stats()['operations']
+        self.assertEqual(operations['get_workout_history']['count'], 2)
+        self.assertEqual(operations['get_workout_history']['histogram']['le_inf'], 2)
+        self.assertIn('save_workout_to_history', operations)
+        self.assertNotIn('untagged', operations)
+
+    def test_nested_calls_count_towards_the_outer_operation(self):
+        database.replace_weekly_plan(1, "2024-07-15", [{"day_of_week": 0, "pillar_focus": "Strength"}])
+        operations = query_stats.get_query_stats()['operations']
+        self.assertEqual(list(operations), ['replace_weekly_plan'])
+
+    def test_slow_queries_are_logged_with_their_plan(self):
+        query_stats.SLOW_QUERY_MS = 0 # Everything counts as slow
+        query_stats.SLOW_QUERY_LOG = os.path.join(self.tmp_dir.name, "slow.log")
+        database.get_workout_history(1)
+        slow = query_stats.get_query_stats()['slow_queries']
+        self.assertEqual(slow[-1]['operation'], 'get_workout_history')
+        [query] = slow[-1]['queries']
+        self.assertTrue(any("idx_workout_history_user_date" in step for step in query['plan']))
+        with open(query_stats.SLOW_QUERY_LOG, encoding="utf-8") as f:
+            self.assertEqual(json.loads(f.readlines()[-1])['queries'], slow[-1]['queries'])
+
+    def test_executemany_is_explained_with_its_first_parameters(self):
+        database.replace_weekly_plan(1, "2024-07-15", [{"day_of_week": 0, "pillar_focus": "Strength"}])
+        entry = database.get_weekly_plan(1, "2024-07-15")[0]
+        query_stats.SLOW_QUERY_MS = 0
+        database.apply_weekly_plan_changes(1, {"2024-07-15": ([dict(entry, pillar_focus="HIIT")], [])})
+        [slow] = [entry for entry in query_stats.get_query_stats()['slow_queries'] if entry['operation'] == 'apply_weekly_plan_changes']
+        [update] = [query for query in slow['queries'] if query['sql'].startswith("UPDATE weekly_plan")]
+        self.assertTrue(any(step.startswith("SEARCH weekly_plan") for step in update['plan']), update['plan'])
+
+    def test_operation_time_includes_fetching_rows(self):
+        conn = sqlite3.connect(database.DB_FILE, factory=query_stats.InstrumentedConnection)
+        conn.create_function("slow", 1, lambda value: time.sleep(0.01) or value)
+        @query_stats.operation("fetch_many_rows")
+        def fetch_many_rows():
+            with query_stats.capture_queries() as captured:
+                rows = conn.execute("SELECT slow(value) FROM json_each('[1, 2, 3, 4, 5, 6]')").fetchall()
+            return rows, captured
+        try:
+            rows, [statement] = fetch_many_rows()
+        finally:
+            conn.close()
+        self.assertEqual(len(rows), 6)
+        operation = query_stats.get_query_stats()['operations']['fetch_many_rows']
+        self.assertEqual(operation['count'], 1)
+        self.assertGreaterEqual(operation['total_ms'], 60) # Every row, not only the first that execute() steps to
+        self.assertLess(statement['ms'], 50)
+
+    def test_capture_is_scoped_to_the_context(self):
+        with query_stats.capture_queries() as captured:
+            database.get_user_settings(1)
+        database.get_workout_history(1)
+        self.assertTrue(captured)
+        self.assertEqual({query['operation'] for query in captured}, {'get_user_settings'})
+
+    def test_lock_errors_are_counted_per_operation(self):
+        holder = sqlite3.connect(database.DB_FILE)
+        holder.execute("BEGIN IMMEDIATE") # Holds the write lock
+        try:
+            conn = sqlite3.connect(database.DB_FILE, timeout=0, factory=query_stats.InstrumentedConnection)
+            @query_stats.operation("contended_write")
+            def write():
+                conn.execute("BEGIN IMMEDIATE")
+            with self.assertRaises(sqlite3.OperationalError):
+                write()
+            conn.close()
+        finally:
+            holder.rollback()
+            holder.close()
+        self.assertEqual(query_stats.get_query_stats()['lock_errors'], {'contended_write': 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import asyncio
+import os
+import sys
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from rate_limit import RateLimiter, RateLimited
+
+MODELS = {
+    "fast": {"requestsPerMinute": 600, "maxConcurrent": 4, "userRequestsPerMinute": 60, "userBurst": 2},
+    "slow": {"requestsPerMinute": 6, "maxConcurrent": 1, "userRequestsPerMinute": 600, "userBurst": 10},
+    "single": {"requestsPerMinute": 600, "maxConcurrent": 1, "userRequestsPerMinute": 600, "userBurst": 10},
+}
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 3))
+        self.now += seconds
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def make_limiter(self, wait_budget=5, processes=1, enabled=True):
+        return RateLimiter(MODELS, wait_budget=wait_budget, processes=processes, enabled=enabled,
+                           clock=self.clock, sleep=self.clock.sleep)
+
+    def test_user_burst_then_queued_at_the_refill_rate(self):
+        limiter = self.make_limiter()
+        for _ in range(4):
+            limiter.acquire(1, "fast")()
+        self.assertEqual(self.clock.sleeps, [1.0, 1.0]) # Burst of 2, then one per second
+        self.assertEqual(limiter.get_stats()["delayed"], 2)
+
+    def test_rejected_beyond_the_wait_budget_without_using_a_token(self):
+        limiter = self.make_limiter(wait_budget=0.5)
+        limiter.acquire(1, "fast")()
+        limiter.acquire(1, "fast")()
+        with self.assertRaises(RateLimited) as raised:
+            limiter.acquire(1, "fast")
+        self.assertEqual(raised.exception.scope, "user")
+        self.assertEqual(raised.exception.retry_after_header, "1")
+        self.clock.now += 1.0
+        limiter.acquire(1, "fast")() # The rejected request did not take the refilled token
+        limiter.acquire(2, "fast")() # Other users have their own bucket
+        self.assertEqual(limiter.get_stats()["rejected"]["user"], 1)
+
+    def test_switching_models_does_not_reset_the_users_budget(self):
+        models = {"flash": {"userRequestsPerMinute": 60, "userBurst": 2},
+                  "pro": {"userRequestsPerMinute": 30, "userBurst": 2}}
+        limiter = RateLimiter(models, wait_budget=0.5, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(limiter.user_limits(), (60, 2))
+        limiter.acquire(1, "flash")()
+        limiter.acquire(1, "flash")()
+        with self.assertRaises(RateLimited) as raised:
+            limiter.acquire(1, "pro") # Its own bucket is full, but the user's budget is spent
+        self.assertEqual(raised.exception.scope, "user")
+        self.clock.now += 1.0
+        limiter.acquire(1, "pro")()
+        with self.assertRaises(RateLimited):
+            limiter.acquire(1, "flash") # The pro request came out of the shared budget too
+        limiter.acquire(2, "pro")()
+
+    def test_global_limit_applies_across_users(self):
+        limiter = self.make_limiter(wait_budget=0)
+        limiter.acquire(1, "slow")()
+        with self.assertRaises(RateLimited) as raised:
+            limiter.acquire(2, "slow")
+        self.assertEqual(raised.exception.scope, "global")
+        self.assertAlmostEqual(raised.exception.retry_after, 10.0)
+
+    def test_concurrency_limit(self):
+        limiter = self.make_limiter(wait_budget=0)
+        release = limiter.acquire(1, "slow")
+        self.clock.now += 10.0
+        with self.assertRaises(RateLimited) as raised:
+            limiter.acquire(2, "slow")
+        self.assertEqual(raised.exception.scope, "concurrency")
+        release()
+        limiter.acquire(2, "slow")() # Its tokens were refunded
+
+    def test_global_limits_are_split_between_processes(self):
+        limiter = self.make_limiter(processes=4)
+        self.assertEqual(limiter._buckets(1, "fast", self.clock())[-1].rate, 600 / 4 / 60)
+        self.assertEqual(limiter._slots["fast"]._initial_value, 1)
+
+    def test_unknown_models_use_the_default_model_limits(self):
+        limiter = RateLimiter()
+        self.assertEqual(limiter.limits_for("no-such-model"), limiter.limits_for("gemini-2.0-flash-001"))
+
+    def test_disabled(self):
+        limiter = self.make_limiter(wait_budget=0, enabled=False)
+        for _ in range(10):
+            limiter.acquire(1, "slow")
+        self.assertEqual(limiter.get_stats()["allowed"], 0)
+
+    def test_async_acquire_waits_for_a_slot(self):
+        limiter = RateLimiter(MODELS, wait_budget=1)
+        async def scenario():
+            release = await limiter.acquire_async(1, "single")
+            asyncio.get_running_loop().call_later(0.1, release)
+            (await limiter.acquire_async(2, "single"))()
+        asyncio.run(scenario())
+        self.assertEqual(limiter.get_stats()["allowed"], 2)
+
+if __name__ == '__main__':
+    unittest.main()
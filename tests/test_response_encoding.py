@@ -0,0 +1,59 @@
+import unittest
+import gzip
+import json
+import datetime
+import sys
+import os
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from flask import Flask, jsonify, request
+import response_encoding
+
+PAYLOAD = {"b": [1, 2.5, None, True], "a": "Squats é  ", "when": datetime.date(2024, 7, 15)}
+
+class TestFastJSON(unittest.TestCase):
+
+    def test_encoders_match_the_stdlib_provider(self):
+        app = Flask(__name__)
+        expected = json.loads(app.json.dumps(PAYLOAD))
+        for name, (module, _) in response_encoding.ENCODERS.items():
+            if module is None or name == "msgspec": # msgspec writes dates as ISO 8601
+                continue
+            _, encode = response_encoding.make_encoder(name)
+            self.assertEqual(json.loads(encode(PAYLOAD)), expected, name)
+
+    def test_unknown_encoder_is_rejected(self):
+        with self.assertRaises(ValueError):
+            response_encoding.make_encoder("pickle")
+
+    def test_jsonify_uses_the_fast_provider(self):
+        app = Flask(__name__)
+        app.json = response_encoding.FastJSONProvider(app)
+        with app.test_request_context():
+            response = jsonify(PAYLOAD)
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual(json.loads(response.get_data()), json.loads(Flask(__name__).json.dumps(PAYLOAD)))
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.after_request(lambda response: response_encoding.compress_response(response, request))
+        self.app.add_url_rule("/big", "big", lambda: jsonify([{"full_workout_text": "## Warm-up\n" * 500}]))
+        self.app.add_url_rule("/small", "small", lambda: jsonify({"ok": True}))
+        self.client = self.app.test_client()
+
+    def test_large_responses_are_gzipped_when_accepted(self):
+        response = self.client.get("/big", headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(int(response.headers["Content-Length"]), len(response.data))
+        self.assertEqual(json.loads(gzip.decompress(response.data))[0]["full_workout_text"], "## Warm-up\n" * 500)
+
+    def test_small_or_unaccepted_responses_are_sent_as_is(self):
+        self.assertNotIn("Content-Encoding", self.client.get("/small", headers={"Accept-Encoding": "gzip"}).headers)
+        self.assertNotIn("Content-Encoding", self.client.get("/big").headers)
+        self.assertNotIn("Content-Encoding", self.client.get("/big", headers={"Accept-Encoding": "gzip;q=0"}).headers)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import unittest
+import datetime
+import tempfile
+import sys
+import os
+import sqlite3
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import database
+from storage import Storage, SQLiteStorage, InMemoryStorage, create_storage
+
+class StorageContract:
+    """Behaviour every Storage backend must share; mixed into one TestCase per backend."""
+
+    def make_storage(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.storage = self.make_storage()
+        self.storage.setup()
+        self.user_id = 1
+        today = datetime.date.today()
+        self.week_start = today - datetime.timedelta(days=today.weekday())
+
+    def test_settings_default_and_round_trip(self):
+        self.assertEqual(self.storage.get_user_settings(self.user_id)['primary_goal'], "Balanced Fitness")
+        self.storage.save_user_settings(self.user_id, {"strength_freq": 4, "focus_rotation": ["Push", "Pull"]})
+        settings = self.storage.get_user_settings(self.user_id)
+        self.assertEqual(settings['strength_freq'], 4)
+        self.assertEqual(settings['focus_rotation'], ["Push", "Pull"])
+        settings['focus_rotation'].append("Legs") # Returned settings are copies
+        self.assertEqual(self.storage.get_user_settings(self.user_id)['focus_rotation'], ["Push", "Pull"])
+
+    def test_unknown_settings_are_rejected(self):
+        self.storage.save_user_settings(self.user_id, {"strength_freq": 4})
+        with self.assertRaises(sqlite3.OperationalError):
+            self.storage.save_user_settings(self.user_id, {"strength_freq": 5, "no_such_setting": 1})
+        self.assertEqual(self.storage.get_user_settings(self.user_id)['strength_freq'], 4)
+
+    def test_history_is_newest_first_and_deletable(self):
+        first = self.storage.save_workout_to_history(self.user_id, "Strength", "Legs", ["Quads"], "Squats")
+        second = self.storage.save_workout_to_history(self.user_id, "Zone2 Cardio", "Cardio", ["Cardio"], "Run")
+        self.storage.save_workout_to_history(2, "HIIT", "Full Body", ["Quads"], "Other user")
+        history = self.storage.get_workout_history(self.user_id)
+        self.assertEqual([entry['id'] for entry in history], [second, first])
+        self.assertEqual(history[1]['muscles_worked'], ["Quads"])
+        self.assertEqual(history[1]['full_workout_text'], "Squats")
+
+        self.storage.delete_workout_from_history(second, user_id=2) # Not this user's entry
+        self.assertEqual(len(self.storage.get_workout_history(self.user_id)), 2)
+        self.storage.delete_workout_from_history(second, user_id=self.user_id)
+        self.assertEqual([entry['id'] for entry in self.storage.get_workout_history(self.user_id)], [first])
+
+    def test_replace_plan_status_and_summaries(self):
+        pillars = ["Strength", "Zone2", "HIIT", "Rest", "Strength", "Rest", "Rest"]
+        self.storage.replace_weekly_plan(self.user_id, self.week_start, [{"day_of_week": 6, "pillar_focus": "HIIT"}])
+        self.storage.replace_weekly_plan(self.user_id, self.week_start,
+                                         [{"day_of_week": day, "pillar_focus": pillar} for day, pillar in enumerate(pillars)])
+        plan = self.storage.get_weekly_plan(self.user_id, self.week_start)
+        self.assertEqual([entry['pillar_focus'] for entry in plan], pillars)
+        self.assertEqual(plan[0]['status'], "Planned")
+
+        workout_id = self.storage.save_workout_to_history(self.user_id, "Strength", "Legs", ["Quads", "Glutes"], "Squats")
+        self.assertTrue(self.storage.update_plan_entry_status(self.user_id, plan[0]['id'], "Completed", workout_id))
+        week = self.storage.get_weekly_summaries(self.user_id, self.week_start, self.week_start)[0]
+        self.assertEqual(week['pillars']['Strength'], {"sessions": 1, "planned": 2, "completed": 1, "skipped": 0})
+        self.assertEqual(week['pillars']['Rest']['planned'], 3)
+        self.assertEqual(week['muscles'], {"Glutes": 1, "Quads": 1})
+
+    def test_status_updates_only_touch_the_users_own_entries(self):
+        self.storage.replace_weekly_plan(self.user_id, self.week_start, [{"day_of_week": 0, "pillar_focus": "Strength"}])
+        entry = self.storage.get_weekly_plan(self.user_id, self.week_start)[0]
+        versions = self.storage.get_data_versions(self.user_id)
+        self.assertFalse(self.storage.update_plan_entry_status(2, entry['id'], "Skipped", 99)) # Not this user's entry
+        entry = self.storage.get_weekly_plan(self.user_id, self.week_start)[0]
+        self.assertEqual((entry['status'], entry['workout_id']), ("Planned", None))
+        self.assertEqual(self.storage.get_data_versions(self.user_id)['plan'], versions['plan'])
+        self.assertEqual(self.storage.get_data_versions(2)['plan'], (0, None))
+
+    def test_multi_week_replace_keeps_periodization_fields(self):
+        next_week = self.week_start + datetime.timedelta(weeks=1)
+        self.storage.replace_weekly_plans(self.user_id, {
+            self.week_start: [{"day_of_week": 0, "pillar_focus": "Strength", "session_focus": "Upper Body", "phase": "Build", "load_factor": 1.05}],
+            next_week: [{"day_of_week": 0, "pillar_focus": "Zone2", "phase": "Deload", "load_factor": 0.6}],
+        })
+        entry = self.storage.get_weekly_plan(self.user_id, self.week_start)[0]
+        self.assertEqual((entry['session_focus'], entry['phase'], entry['load_factor']), ("Upper Body", "Build", 1.05))
+        self.assertEqual(self.storage.get_weekly_plan(self.user_id, next_week)[0]['phase'], "Deload")
+        context = self.storage.get_generation_context(self.user_id, today=self.week_start)
+        self.assertEqual(context.todays_planned_pillar, "Today's Planned Pillar: Strength (Upper Body, Build week, load x1.05)")
+
+    def test_apply_plan_changes_skips_entries_no_longer_planned(self):
+        self.storage.replace_weekly_plan(self.user_id, self.week_start, [
+            {"day_of_week": 0, "pillar_focus": "Strength"}, {"day_of_week": 1, "pillar_focus": "Zone2"}])
+        monday, tuesday = self.storage.get_weekly_plan(self.user_id, self.week_start)
+        self.storage.update_plan_entry_status(self.user_id, monday['id'], "Completed")
+        changed = self.storage.apply_weekly_plan_changes(self.user_id, {self.week_start: (
+            [{"id": monday['id'], "day_of_week": 0, "pillar_focus": "HIIT"},
+             {"id": tuesday['id'], "day_of_week": 1, "pillar_focus": "HIIT", "phase": "Build", "load_factor": 1.05}],
+            [{"day_of_week": 2, "pillar_focus": "Rest"}],
+        )})
+        self.assertEqual(changed, 2)
+        plan = self.storage.get_weekly_plan(self.user_id, self.week_start)
+        self.assertEqual([entry['pillar_focus'] for entry in plan], ["Strength", "HIIT", "Rest"])
+        self.assertEqual((plan[0]['status'], plan[1]['id'], plan[1]['load_factor']), ("Completed", tuesday['id'], 1.05))
+        week = self.storage.get_weekly_summaries(self.user_id, self.week_start, self.week_start)[0]
+        self.assertEqual(week['pillars']['HIIT']['planned'], 1)
+        self.assertNotIn('Zone2', week['pillars'])
+
+    def test_data_versions_change_with_each_kind_of_write(self):
+        versions = self.storage.get_data_versions(self.user_id)
+        self.assertEqual(versions['history'], (0, None))
+        self.storage.save_workout_to_history(self.user_id, "Strength", "Legs", ["Quads"], "Squats")
+        self.storage.replace_weekly_plan(self.user_id, self.week_start, [{"day_of_week": 0, "pillar_focus": "Rest"}])
+        after_writes = self.storage.get_data_versions(self.user_id)
+        self.assertGreater(after_writes['history'][0], 0)
+        self.assertGreater(after_writes['plan'][0], 0)
+        self.assertEqual(after_writes['settings'], versions['settings'])
+        self.assertIsNotNone(after_writes['plan'][1].tzinfo)
+
+        entry = self.storage.get_weekly_plan(self.user_id, self.week_start)[0]
+        self.storage.update_plan_entry_status(self.user_id, entry['id'], "Skipped")
+        self.storage.save_user_settings(self.user_id, {"ai_model_id": "other-model"})
+        latest = self.storage.get_data_versions(self.user_id)
+        self.assertGreater(latest['plan'][0], after_writes['plan'][0])
+        self.assertGreater(latest['settings'][0], versions['settings'][0])
+        self.assertEqual(self.storage.get_data_versions(2)['plan'], (0, None)) # Per user
+
+    def test_bootstrap_state_matches_the_individual_reads(self):
+        self.storage.save_user_settings(self.user_id, {"strength_freq": 4})
+        self.storage.save_workout_to_history(self.user_id, "Strength", "Legs", ["Quads"], "Squats")
+        self.storage.replace_weekly_plan(self.user_id, self.week_start, [{"day_of_week": 0, "pillar_focus": "Strength"}])
+        state = self.storage.get_bootstrap_state(self.user_id, self.week_start, history_days=14)
+        self.assertEqual(state['settings'], self.storage.get_user_settings(self.user_id))
+        self.assertEqual(state['weekly_plan'], self.storage.get_weekly_plan(self.user_id, self.week_start))
+        self.assertEqual(state['workout_history'], self.storage.get_workout_history(self.user_id, 14))
+        self.assertEqual(state['versions'], self.storage.get_data_versions(self.user_id))
+
+    def test_user_api_keys(self):
+        self.assertIsNone(self.storage.get_user_api_key(self.user_id))
+        self.storage.save_user_api_key(self.user_id, "key-1")
+        self.storage.save_user_api_key(self.user_id, "key-2")
+        self.assertEqual(self.storage.get_user_api_key(self.user_id), "key-2")
+        self.assertIsNone(self.storage.get_user_api_key(self.user_id, provider="other"))
+        self.assertIsNone(self.storage.get_user_api_key(2))
+        versions = [self.storage.get_user_api_key_version(self.user_id)]
+        self.storage.delete_user_api_key(self.user_id)
+        self.assertIsNone(self.storage.get_user_api_key(self.user_id))
+        versions.append(self.storage.get_user_api_key_version(self.user_id))
+        self.storage.save_user_api_key(self.user_id, "key-1")
+        versions.append(self.storage.get_user_api_key_version(self.user_id))
+        self.assertEqual(versions, sorted(set(versions))) # Every change is a new version, deletes included
+        self.assertIsNone(self.storage.get_user_api_key_version(2))
+
+    def test_generation_context(self):
+        today = datetime.date.today()
+        self.storage.replace_weekly_plan(self.user_id, self.week_start, [{"day_of_week": today.weekday(), "pillar_focus": "HIIT"}])
+        for pillar in ["Strength", "Zone2 Cardio", "HIIT", "Strength"]:
+            self.storage.save_workout_to_history(self.user_id, pillar, "Upper Body", ["Chest"], "Full text")
+        context = self.storage.get_generation_context(self.user_id)
+        self.assertEqual(context.todays_planned_pillar, "Today's Planned Pillar: HIIT")
+        self.assertEqual([session['pillar'] for session in context.recent_sessions], ["Strength", "HIIT", "Zone2 Cardio"])
+        self.assertNotIn('full_workout_text', context.recent_sessions[0])
+        self.assertIn("Muscles: Chest", context.recent_history)
+
+class TestSQLiteStorage(StorageContract, unittest.TestCase):
+
+    def make_storage(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_db_file = database.DB_FILE
+        database.DB_FILE = os.path.join(self.tmp_dir.name, "test_training_app.db")
+        database.invalidate_settings_cache()
+        return SQLiteStorage()
+
+    def tearDown(self):
+        database.invalidate_settings_cache()
+        database.DB_FILE = self.original_db_file
+        self.tmp_dir.cleanup()
+
+class TestInMemoryStorage(StorageContract, unittest.TestCase):
+
+    def make_storage(self):
+        return InMemoryStorage()
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            create_storage("postgres")
+
+    def test_incomplete_backend_cannot_be_created(self):
+        class SettingsOnlyStorage(Storage):
+            def get_user_settings(self, user_id):
+                return {}
+        with self.assertRaises(TypeError):
+            SettingsOnlyStorage()
+
+if __name__ == '__main__':
+    unittest.main()
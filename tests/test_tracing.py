@@ -0,0 +1,145 @@
+import unittest
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import threading
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import tracing
+import database
+from weekly_planner import replan_scheduler
+from tests.test_app_factory import AppFactoryTestCase, fake_generator
+
+def read_spans(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+class TracingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.original_tracing = (tracing.TRACING, tracing.TRACE_SAMPLE_RATE, tracing.TRACE_FILE)
+        self.trace_dir = tempfile.TemporaryDirectory()
+        self.trace_file = os.path.join(self.trace_dir.name, "traces.jsonl")
+        tracing.configure(enabled=True, sample_rate=1.0, trace_file=self.trace_file)
+
+    def tearDown(self):
+        enabled, sample_rate, trace_file = self.original_tracing
+        tracing.configure(enabled=enabled, sample_rate=sample_rate, trace_file=trace_file)
+        self.trace_dir.cleanup()
+
+class TestSpans(TracingTestCase):
+
+    def test_spans_nest_under_the_root(self):
+        root, token = tracing.begin_trace("GET /x")
+        with tracing.span("outer") as outer:
+            with tracing.span("inner", rows=3):
+                pass
+        with self.assertRaises(ValueError):
+            with tracing.span("failing"):
+                raise ValueError("bad input")
+        tracing.end_trace(root, token)
+        self.assertIsNone(tracing.current_span())
+
+        spans = {span["name"]: span for span in read_spans(self.trace_file)}
+        self.assertEqual(set(spans), {"GET /x", "outer", "inner", "failing"})
+        self.assertEqual({span["traceId"] for span in spans.values()}, {root.trace_id})
+        self.assertEqual(spans["outer"]["parentSpanId"], root.span_id)
+        self.assertEqual(spans["inner"]["parentSpanId"], outer.span_id)
+        self.assertEqual(spans["inner"]["attributes"], {"rows": 3})
+        self.assertEqual(spans["failing"]["status"], {"code": "ERROR", "message": "ValueError: bad input"})
+        self.assertEqual(spans["GET /x"]["parentSpanId"], "")
+
+    def test_unsampled_trace_records_nothing(self):
+        tracing.configure(sample_rate=0.0)
+        root, token = tracing.begin_trace("GET /x")
+        with tracing.span("outer") as outer:
+            self.assertIsNone(outer)
+        tracing.end_trace(root, token)
+        self.assertEqual(len(root.trace_id), 32) # Still has an id for the response header
+        self.assertEqual(read_spans(self.trace_file), [])
+
+    def test_traceparent_joins_the_callers_trace_and_decision(self):
+        tracing.configure(sample_rate=0.0)
+        traceparent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+        root, token = tracing.begin_trace("GET /x", traceparent)
+        tracing.end_trace(root, token)
+        [span] = read_spans(self.trace_file)
+        self.assertEqual(span["traceId"], "0af7651916cd43dd8448eb211c80319c")
+        self.assertEqual(span["parentSpanId"], "b7ad6b7169203331")
+
+        root, token = tracing.begin_trace("GET /x", traceparent[:-2] + "00") # Caller did not sample
+        tracing.end_trace(root, token)
+        self.assertEqual(len(read_spans(self.trace_file)), 1)
+
+    def test_bind_carries_the_span_to_another_thread(self):
+        root, token = tracing.begin_trace("POST /job")
+        def job():
+            with tracing.span("background"):
+                pass
+        thread = threading.Thread(target=tracing.bind(job))
+        thread.start()
+        thread.join()
+        tracing.end_trace(root, token)
+        spans = {span["name"]: span for span in read_spans(self.trace_file)}
+        self.assertEqual(spans["background"]["parentSpanId"], root.span_id)
+
+class TestRequestTracing(TracingTestCase, AppFactoryTestCase):
+
+    def setUp(self):
+        TracingTestCase.setUp(self)
+        AppFactoryTestCase.setUp(self)
+
+    def tearDown(self):
+        AppFactoryTestCase.tearDown(self)
+        TracingTestCase.tearDown(self)
+
+    def test_generation_is_traced_end_to_end(self):
+        app = self.create_app(GENERATE_WORKOUT=fake_generator, TRACE_FILE=self.trace_file)
+        response = app.test_client().post("/generate_workout", json={"workout_pillar": "Strength"})
+        self.assertEqual(response.status_code, 200)
+        trace_id = response.headers[tracing.TRACE_ID_HEADER]
+
+        spans = [span for span in read_spans(self.trace_file) if span["traceId"] == trace_id]
+        by_name = {span["name"]: span for span in spans}
+        root = by_name["POST /generate_workout"]
+        self.assertEqual(root["attributes"]["http.status_code"], 200)
+        for name in ("db.get_generation_context", "rate_limit", "db.save_workout_to_history"):
+            self.assertEqual(by_name[name]["parentSpanId"], root["spanId"])
+
+    def test_replan_joins_the_settings_save_trace(self):
+        app = self.create_app(TRACE_FILE=self.trace_file)
+        response = app.test_client().post("/save_user_settings", json={"strength_freq": 4})
+        self.assertTrue(response.get_json()["replan_scheduled"])
+        response.close()
+        replan_scheduler.wait()
+        spans = [span for span in read_spans(self.trace_file) if span["traceId"] == response.headers[tracing.TRACE_ID_HEADER]]
+        by_name = {span["name"]: span for span in spans}
+        self.assertEqual(by_name["replan"]["parentSpanId"], by_name["POST /save_user_settings"]["spanId"])
+
+    def test_trace_id_header_without_sampling(self):
+        app = self.create_app(TRACE_SAMPLE_RATE=0.0, TRACE_FILE=self.trace_file)
+        response = app.test_client().get("/get_user_settings")
+        self.assertEqual(len(response.headers[tracing.TRACE_ID_HEADER]), 32)
+        self.assertEqual(read_spans(self.trace_file), [])
+
+    def test_asgi_replan_joins_the_settings_save_trace(self):
+        import asgi_app
+        database.configure(db_file=self.db_file)
+
+        async def save_settings():
+            async with asgi_app.app.test_app() as test_app:
+                response = await test_app.test_client().post("/save_user_settings", json={"strength_freq": 4})
+                return response.headers[tracing.TRACE_ID_HEADER], await response.get_json()
+
+        trace_id, body = asyncio.run(save_settings())
+        self.assertTrue(body["replan_scheduled"])
+        replan_scheduler.wait()
+        by_name = {span["name"]: span for span in read_spans(self.trace_file) if span["traceId"] == trace_id}
+        self.assertEqual(by_name["replan"]["parentSpanId"], by_name["POST /save_user_settings"]["spanId"])
+
+if __name__ == '__main__':
+    unittest.main()
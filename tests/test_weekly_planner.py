@@ -1,119 +1,170 @@
 import unittest
-from unittest.mock import MagicMock, patch, call
+from unittest.mock import MagicMock, patch
 import datetime
+import threading
 # Assuming weekly_planner.py is in the root directory /app
 # and tests/ is a subdirectory. If running from /app, this should work.
 import sys
 import os
 # Add the parent directory (/app) to sys.path to find weekly_planner and database
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from weekly_planner import generate_and_save_weekly_plan
-# database module will be mocked, so direct import isn't strictly needed in test file
-# but weekly_planner itself imports it.
+from weekly_planner import (generate_and_save_weekly_plan, get_or_create_current_plan, build_weekly_plans,
+                            changed_plan_settings, replan_with_settings, ReplanScheduler)
+from storage import InMemoryStorage
 
 class TestWeeklyPlanner(unittest.TestCase):
 
-    def mock_db_connection(self):
-        # Create a mock connection and cursor
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_conn.cursor.return_value = mock_cursor
-        mock_cursor.lastrowid = 1 # Example
-        return mock_conn
-
-    @patch('weekly_planner.database') # Mock the entire database module used by weekly_planner
-    def test_generate_and_save_weekly_plan_normal_distribution(self, mock_db_module):
-        # mock_conn = self.mock_db_connection() # Not strictly needed if db_connection_func is also mocked
-        # mock_db_module.get_db_connection.return_value = mock_conn
-
-        # Mock the db_connection_func directly if it's passed in
-        mock_db_connection_func = MagicMock()
-        mock_conn_instance = self.mock_db_connection()
-        mock_db_connection_func.return_value = mock_conn_instance
-
-
-        user_id = 1
-        user_settings = {
-            "strength_freq": 2, "zone2_freq": 2, "hiit_freq": 1,
-            "stability_freq": 1, "primary_goal": "Balanced Fitness"
-            # Total 6 workout days, 1 rest day
-        }
-
-        # We need to control the date for consistent testing of clear_weekly_plan args
+    def generate_plan(self, user_settings, storage=None):
+        """Runs the planner on a fixed Monday and returns the pillars saved for that week."""
+        storage = storage or InMemoryStorage()
         fixed_today = datetime.date(2024, 7, 15) # A Monday
         with patch('weekly_planner.datetime.date') as mock_date:
             mock_date.today.return_value = fixed_today
             mock_date.side_effect = lambda *args, **kw: datetime.date(*args, **kw) # Allow date object creation
+            generate_and_save_weekly_plan(1, user_settings, storage)
+        plan = storage.get_weekly_plan(1, fixed_today)
+        self.assertEqual([entry['day_of_week'] for entry in plan], list(range(7)))
+        return [entry['pillar_focus'] for entry in plan]
 
-            generate_and_save_weekly_plan(user_id, user_settings, mock_db_connection_func)
-
-            # Assert clear_weekly_plan was called
-            # The first argument to clear_weekly_plan is user_id, second is week_start_date (which is fixed_today)
-            # The third is the connection object from mock_db_connection_func
-            mock_db_module.clear_weekly_plan.assert_called_once_with(user_id, fixed_today, conn=mock_conn_instance)
-
-            # Assert save_daily_plan_entry was called 7 times (6 workouts + 1 rest)
-            self.assertEqual(mock_db_module.save_daily_plan_entry.call_count, 7)
-
-            # Example: check that pillar distribution seems plausible
-            calls_to_save = mock_db_module.save_daily_plan_entry.call_args_list
-            pillars_saved = [c.args[0]['pillar_focus'] for c in calls_to_save]
-            self.assertEqual(pillars_saved.count("Strength"), 2)
-            self.assertEqual(pillars_saved.count("Zone2"), 2)
-            self.assertEqual(pillars_saved.count("HIIT"), 1)
-            self.assertEqual(pillars_saved.count("Stability"), 1)
-            self.assertEqual(pillars_saved.count("Rest"), 1)
-
-
-    @patch('weekly_planner.database')
-    def test_generate_and_save_weekly_plan_overflow_frequency(self, mock_db_module):
-        mock_db_connection_func = MagicMock()
-        mock_conn_instance = self.mock_db_connection()
-        mock_db_connection_func.return_value = mock_conn_instance
-
-        user_id = 1
-        user_settings = { # Total 9, should be capped at 7
+    def test_generate_and_save_weekly_plan_normal_distribution(self):
+        pillars_saved = self.generate_plan({
+            "strength_freq": 2, "zone2_freq": 2, "hiit_freq": 1,
+            "stability_freq": 1, "primary_goal": "Balanced Fitness"
+            # Total 6 workout days, 1 rest day
+        })
+        self.assertEqual(pillars_saved.count("Strength"), 2)
+        self.assertEqual(pillars_saved.count("Zone2"), 2)
+        self.assertEqual(pillars_saved.count("HIIT"), 1)
+        self.assertEqual(pillars_saved.count("Stability"), 1)
+        self.assertEqual(pillars_saved.count("Rest"), 1)
+
+    def test_plan_avoids_back_to_back_hard_days(self):
+        pillars_saved = self.generate_plan({"strength_freq": 2, "zone2_freq": 2, "hiit_freq": 1, "stability_freq": 1})
+        for day in range(6):
+            self.assertFalse({pillars_saved[day], pillars_saved[day + 1]} <= {"Strength", "HIIT"}, pillars_saved)
+
+    def test_generate_and_save_weekly_plan_overflow_frequency(self):
+        pillars_saved = self.generate_plan({ # Total 9, should be capped at 7
             "strength_freq": 3, "zone2_freq": 3, "hiit_freq": 2, "stability_freq": 1
-        }
-        fixed_today = datetime.date(2024, 7, 15) # A Monday
-        with patch('weekly_planner.datetime.date') as mock_date:
-            mock_date.today.return_value = fixed_today
-            mock_date.side_effect = lambda *args, **kw: datetime.date(*args, **kw)
-
-            generate_and_save_weekly_plan(user_id, user_settings, mock_db_connection_func)
-
-            self.assertEqual(mock_db_module.save_daily_plan_entry.call_count, 7)
-            # Check prioritization (Strength > HIIT > Zone2 > Stability)
-            calls_to_save = mock_db_module.save_daily_plan_entry.call_args_list
-            pillars_saved = [c.args[0]['pillar_focus'] for c in calls_to_save]
-            self.assertEqual(pillars_saved.count("Strength"), 3)
-            self.assertEqual(pillars_saved.count("HIIT"), 2)
-            self.assertEqual(pillars_saved.count("Zone2"), 2) # 3+2+2=7
-            self.assertEqual(pillars_saved.count("Stability"), 0) # Stability gets cut
-            self.assertEqual(pillars_saved.count("Rest"), 0)
-
-
-    @patch('weekly_planner.database')
-    def test_generate_and_save_weekly_plan_zero_frequency(self, mock_db_module):
-        mock_db_connection_func = MagicMock()
-        mock_conn_instance = self.mock_db_connection()
-        mock_db_connection_func.return_value = mock_conn_instance
-
-        user_id = 1
-        user_settings = {
+        })
+        # Check prioritization (Strength > HIIT > Zone2 > Stability)
+        self.assertEqual(pillars_saved.count("Strength"), 3)
+        self.assertEqual(pillars_saved.count("HIIT"), 2)
+        self.assertEqual(pillars_saved.count("Zone2"), 2) # 3+2+2=7
+        self.assertEqual(pillars_saved.count("Stability"), 0) # Stability gets cut
+        self.assertEqual(pillars_saved.count("Rest"), 0)
+
+    def test_generate_and_save_weekly_plan_zero_frequency(self):
+        pillars_saved = self.generate_plan({
             "strength_freq": 0, "zone2_freq": 0, "hiit_freq": 0, "stability_freq": 0
-        }
-        fixed_today = datetime.date(2024, 7, 15) # A Monday
+        })
+        self.assertEqual(pillars_saved.count("Rest"), 7)
+
+    def test_regenerating_replaces_the_week(self):
+        storage = InMemoryStorage()
+        self.generate_plan({"strength_freq": 7}, storage)
+        self.assertEqual(self.generate_plan({"hiit_freq": 1}, storage).count("Rest"), 6)
+
+    def test_plan_is_saved_through_the_storage_interface(self):
+        storage = MagicMock()
+        generate_and_save_weekly_plan(1, {"strength_freq": 1}, storage, weeks=3)
+        storage.replace_weekly_plans.assert_called_once() # All weeks in one atomic write
+        user_id, plans_by_week = storage.replace_weekly_plans.call_args.args
+        self.assertEqual(user_id, 1)
+        self.assertEqual(len(plans_by_week), 3)
+        self.assertTrue(all(len(entries) == 7 for entries in plans_by_week.values()))
+
+    def test_periodized_plan_builds_then_deloads_and_rotates_focus(self):
+        storage = InMemoryStorage()
+        settings = {"strength_freq": 2, "hiit_freq": 2, "zone2_freq": 1, "focus_rotation": ["Upper Body", "Lower Body", "Full Body"]}
+        fixed_today = datetime.date(2024, 7, 17) # A Wednesday; plans start on that week's Monday
         with patch('weekly_planner.datetime.date') as mock_date:
             mock_date.today.return_value = fixed_today
-            mock_date.side_effect = lambda *args, **kw: datetime.date(*args, **kw)
-
-            generate_and_save_weekly_plan(user_id, user_settings, mock_db_connection_func)
-
-            self.assertEqual(mock_db_module.save_daily_plan_entry.call_count, 7)
-            calls_to_save = mock_db_module.save_daily_plan_entry.call_args_list
-            pillars_saved = [c.args[0]['pillar_focus'] for c in calls_to_save]
-            self.assertEqual(pillars_saved.count("Rest"), 7)
+            generate_and_save_weekly_plan(1, settings, storage, weeks=5)
+        weeks = [storage.get_weekly_plan(1, datetime.date(2024, 7, 15) + datetime.timedelta(weeks=i)) for i in range(5)]
+        self.assertEqual([week[0]['phase'] for week in weeks], ["Build", "Build", "Build", "Deload", "Build"])
+        self.assertEqual([week[0]['load_factor'] for week in weeks], [1.0, 1.05, 1.1, 0.6, 1.0])
+
+        deload = [entry['pillar_focus'] for entry in weeks[3]]
+        self.assertEqual((deload.count("HIIT"), deload.count("Strength"), deload.count("Zone2")), (0, 1, 3))
+        strength_focus = [entry['session_focus'] for week in weeks for entry in week if entry['pillar_focus'] == "Strength"]
+        self.assertEqual(strength_focus[:4], ["Upper Body", "Lower Body", "Full Body", "Upper Body"])
+        self.assertTrue(all(entry['session_focus'] is None for entry in weeks[0] if entry['pillar_focus'] != "Strength"))
+
+    def test_empty_current_week_is_generated_on_read(self):
+        storage = InMemoryStorage()
+        storage.save_user_settings(1, {"strength_freq": 3, "hiit_freq": 1})
+        plan = get_or_create_current_plan(1, storage, weeks=2)
+        self.assertEqual([entry['pillar_focus'] for entry in plan].count("Strength"), 3)
+        next_monday = datetime.date.today() - datetime.timedelta(days=datetime.date.today().weekday()) + datetime.timedelta(weeks=1)
+        self.assertEqual(len(storage.get_weekly_plan(1, next_monday)), 7)
+
+class TestSettingsReplan(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = InMemoryStorage()
+        self.week_start = datetime.date(2024, 7, 15)
+        self.today = datetime.date(2024, 7, 17) # Wednesday
+        self.settings = {"strength_freq": 3, "zone2_freq": 2, "hiit_freq": 1, "stability_freq": 1}
+        # A horizon that started two weeks earlier: this week is the last Build week, next week deloads
+        self.storage.replace_weekly_plans(1, build_weekly_plans(self.settings, self.week_start, weeks=2, cycle_position=2))
+
+    def plan(self, week_offset=0):
+        return self.storage.get_weekly_plan(1, self.week_start + datetime.timedelta(weeks=week_offset))
+
+    def test_only_plan_settings_count_as_changes(self):
+        self.assertEqual(changed_plan_settings(self.settings, dict(self.settings, ai_model_id="x", recovery_freq=3)), [])
+        self.assertEqual(changed_plan_settings({"focus_rotation": '["Push", "Pull"]'}, {"focus_rotation": ["Push", "Pull"]}), [])
+        self.assertEqual(changed_plan_settings(self.settings, dict(self.settings, hiit_freq=2, primary_goal="Longevity")),
+                         ["hiit_freq", "primary_goal"])
+
+    def test_unchanged_settings_change_nothing(self):
+        self.assertEqual(replan_with_settings(1, self.settings, self.storage, weeks=2, today=self.today), 0)
+
+    def test_replan_keeps_completed_and_past_days_and_the_cycle(self):
+        before = self.plan()
+        self.storage.update_plan_entry_status(1, before[4]['id'], "Completed", workout_id=42)
+        rest_week = dict(self.settings, strength_freq=0, zone2_freq=0, hiit_freq=0, stability_freq=0)
+
+        changed = replan_with_settings(1, rest_week, self.storage, weeks=2, today=self.today)
+        after = self.plan()
+        self.assertEqual([entry['id'] for entry in after], [entry['id'] for entry in before]) # Updated in place
+        self.assertEqual(after[:2], before[:2]) # Monday and Tuesday are past
+        self.assertEqual((after[4]['pillar_focus'], after[4]['status'], after[4]['workout_id']), (before[4]['pillar_focus'], "Completed", 42))
+        self.assertTrue(all(after[day]['pillar_focus'] == "Rest" for day in (2, 3, 5, 6)))
+        self.assertEqual([(entry['phase'], entry['load_factor']) for entry in (after[2], self.plan(1)[0])], [("Build", 1.1), ("Deload", 0.6)])
+        expected = sum(before[day]['pillar_focus'] != "Rest" for day in (2, 3, 5, 6))
+        expected += sum(entry['pillar_focus'] != "Rest" for entry in build_weekly_plans(self.settings, self.week_start, 2, 2)[self.week_start + datetime.timedelta(weeks=1)])
+        self.assertEqual(changed, expected)
+
+    def test_replan_keeps_the_focus_rotation_of_a_continued_week(self):
+        # This week continues the rotation from last week (e.g. written by plan_following_week)
+        self.storage.replace_weekly_plans(1, build_weekly_plans(self.settings, self.week_start, weeks=2,
+                                                                cycle_position=2, rotation_position=1))
+        strength_days = lambda week: [entry for entry in week if entry['pillar_focus'] == "Strength"]
+        before = self.plan()
+
+        changed = replan_with_settings(1, dict(self.settings, zone2_freq=1), self.storage, weeks=2, today=self.today)
+        after = self.plan()
+        self.assertGreater(changed, 0)
+        self.assertEqual(after[6]['pillar_focus'], "Rest")
+        self.assertEqual(strength_days(after), strength_days(before)) # Same days, splits and ids
+
+    def test_scheduler_coalesces_pending_replans(self):
+        scheduler = ReplanScheduler()
+        blocker = threading.Event()
+        scheduler._executor.submit(blocker.wait) # Hold the replan thread so both requests queue up
+        first = scheduler.schedule(1, dict(self.settings, hiit_freq=2), self.storage)
+        second = scheduler.schedule(1, dict(self.settings, hiit_freq=0), self.storage)
+        self.assertIsNotNone(first)
+        self.assertIsNone(second)
+        blocker.set()
+        scheduler.wait()
+        scheduler.shutdown()
+        today = datetime.date.today()
+        plan = self.storage.get_weekly_plan(1, today - datetime.timedelta(days=today.weekday()))
+        self.assertEqual(len(plan), 7)
+        self.assertEqual([entry['pillar_focus'] for entry in plan].count("HIIT"), 0) # Latest settings won
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import itertools
+import json
+import sys
+import os
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import weekly_scheduler
+
+def adjacent_pairs(week):
+    return [(week[day], week[(day + 1) % 7]) for day in range(7)]
+
+class TestWeeklyScheduler(unittest.TestCase):
+
+    def test_shipped_table_is_current_and_complete(self):
+        with open(weekly_scheduler.LAYOUTS_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+        self.assertEqual(data['version'], weekly_scheduler.SCORING_VERSION)
+        self.assertEqual(len(data['tables']), len(weekly_scheduler.PROFILE_WEIGHTS) * 2)
+        for table in data['tables'].values():
+            self.assertEqual(len(table), 330) # Every (s, z, h, m) with s + z + h + m <= 7
+
+    def test_layout_keeps_frequencies(self):
+        for counts in [(0, 0, 0, 0), (2, 2, 1, 1), (7, 0, 0, 0), (1, 3, 0, 2)]:
+            week = weekly_scheduler.best_layout(*counts)
+            self.assertEqual(len(week), 7)
+            self.assertEqual((week.count("Strength"), week.count("Zone2"), week.count("HIIT"), week.count("Stability")), counts)
+            self.assertEqual(week.count("Rest"), 7 - sum(counts))
+
+    def test_hard_days_are_not_back_to_back_when_avoidable(self):
+        week = weekly_scheduler.best_layout(2, 2, 1, 1)
+        for first, second in adjacent_pairs(week):
+            self.assertFalse({first, second} <= {"Strength", "HIIT"}, week)
+        week = weekly_scheduler.best_layout(0, 1, 3, 0, primary_goal="VO2 Max Improvement")
+        self.assertNotIn(("HIIT", "HIIT"), adjacent_pairs(week))
+
+    def test_table_matches_brute_force_optimum(self):
+        for counts, goal, rotation in [((2, 2, 1, 1), "Balanced Fitness", None),
+                                       ((3, 1, 2, 0), "Strength Focus", ["Upper Body", "Lower Body"]),
+                                       ((1, 2, 2, 0), "Longevity", None)]:
+            pool = ["Strength"] * counts[0] + ["Zone2"] * counts[1] + ["HIIT"] * counts[2] + ["Stability"] * counts[3]
+            pool += ["Rest"] * (7 - len(pool))
+            optimum = min(weekly_scheduler.score_layout(week, goal, rotation) for week in set(itertools.permutations(pool)))
+            chosen = weekly_scheduler.best_layout(*counts, primary_goal=goal, focus_rotation=rotation)
+            self.assertAlmostEqual(weekly_scheduler.score_layout(chosen, goal, rotation), optimum)
+
+    def test_split_rotation_and_goal_select_tables(self):
+        self.assertTrue(weekly_scheduler.has_split_rotation('["Upper Body", "Lower Body"]'))
+        self.assertFalse(weekly_scheduler.has_split_rotation(["Full Body"]))
+        # Unknown goals fall back to the balanced profile
+        self.assertEqual(weekly_scheduler.best_layout(3, 1, 1, 0, primary_goal="Something New"),
+                         weekly_scheduler.best_layout(3, 1, 1, 0, primary_goal="Balanced Fitness"))
+
+    def test_invalid_frequencies_are_rejected(self):
+        with self.assertRaises(ValueError):
+            weekly_scheduler.best_layout(4, 4, 0, 0)
+
+if __name__ == '__main__':
+    unittest.main()
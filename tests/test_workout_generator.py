@@ -1,9 +1,12 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 import sys
 import os
+import asyncio
+import subprocess
 # Add the parent directory (/app) to sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import workout_generator
 from workout_generator import generate_workout_plan
 
 class TestWorkoutGeneratorPrompts(unittest.TestCase):
@@ -52,6 +55,30 @@ class TestWorkoutGeneratorPrompts(unittest.TestCase):
         with self.assertRaisesRegex(ValueError, "'workout_pillar' is a required field"):
             generate_workout_plan(user_data, self.common_settings(), "fake_api_key")
 
+    def test_missing_experience_or_equipment_raises_error(self):
+        user_data = self.common_user_data("Strength")
+        user_data["equipment"] = []
+        with self.assertRaisesRegex(ValueError, "Missing one or more required fields"):
+            generate_workout_plan(user_data, self.common_settings(), "fake_api_key")
+        self.mock_model.generate_content.assert_not_called()
+
+    def test_strength_nudge_emphasizes_one_sub_muscle_of_the_focus(self):
+        anatomy = {"Upper Body": {"Chest": ["Pectoralis Major"], "Back": {"Width": ["Latissimus Dorsi"]}}}
+        with patch.object(workout_generator, "get_anatomy_data", return_value=anatomy), \
+             patch.object(workout_generator.random, "sample", return_value=[0, 1]):
+            generate_workout_plan(self.common_user_data("Strength", focus="Upper Body"), self.common_settings(), "fake_api_key")
+        prompt = self.get_generated_prompt()
+        self.assertIn("primary stimulus on the **Pectoralis Major**", prompt)
+        self.assertIn("less direct volume to the **Latissimus Dorsi**", prompt)
+
+    def test_strength_nudge_with_a_single_sub_muscle(self):
+        anatomy = {"Upper Body": {"Chest": ["Pectoralis Major"]}}
+        with patch.object(workout_generator, "get_anatomy_data", return_value=anatomy):
+            generate_workout_plan(self.common_user_data("Strength", focus="Upper Body"), self.common_settings(), "fake_api_key")
+        prompt = self.get_generated_prompt()
+        self.assertIn("primary stimulus on the **Pectoralis Major**", prompt)
+        self.assertIn("less direct volume to the **other muscle groups**", prompt)
+
     def test_strength_prompt_bodyweight_build_muscle(self):
         user_data = self.common_user_data("Strength", strength_style="Build Muscle", equipment=["Bodyweight only"])
         generate_workout_plan(user_data, self.common_settings(), "fake_api_key")
@@ -131,6 +158,15 @@ class TestWorkoutGeneratorPrompts(unittest.TestCase):
         self.assertIn("Stationary Bike", prompt) # Dumbbells are not cardio machines
         self.assertNotIn("Bodyweight Training Principles", prompt)
 
+    def test_async_variant_sends_the_same_prompt_and_parses_alike(self):
+        user_data = self.common_user_data("HIIT", experience="Beginner")
+        with patch('workout_generator.random.choice', side_effect=lambda options: options[0]):
+            result = generate_workout_plan(user_data, self.common_settings(), "fake_api_key")
+            self.mock_provider_instance.generate_content_async = AsyncMock(return_value=self.mock_ai_response)
+            async_result = asyncio.run(workout_generator.generate_workout_plan_async(user_data, self.common_settings(), "fake_api_key"))
+        self.assertEqual(async_result, result)
+        self.mock_provider_instance.generate_content_async.assert_awaited_once_with(self.get_generated_prompt())
+
     def test_stability_mobility_prompt_bodyweight(self):
         user_data = self.common_user_data("Stability/Mobility", equipment=["Bodyweight only"], focus="Core")
         generate_workout_plan(user_data, self.common_settings(), "fake_api_key")
@@ -140,5 +176,19 @@ class TestWorkoutGeneratorPrompts(unittest.TestCase):
         self.assertIn("Bodyweight Training Principles (Stability/Mobility)", prompt)
         self.assertIn("Tempo and Holds", prompt)
 
+class TestLazyLoading(unittest.TestCase):
+
+    def test_importing_the_app_does_not_load_the_gemini_sdk(self):
+        code = "import sys, app; print('google.generativeai' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "False")
+
+    def test_anatomy_is_loaded_once_on_first_use(self):
+        with patch.object(workout_generator, "_anatomy_data", None):
+            first = workout_generator.get_anatomy_data()
+            self.assertIn("Upper Body", first)
+            self.assertIs(workout_generator.get_anatomy_data(), first)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import datetime
+import tempfile
+import sqlite3
+import sys
+import os
+# Add the parent directory (/app) to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import database
+from write_batcher import GroupCommitWriter
+
+class TestGroupCommitWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "batch.db")
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+        conn.commit()
+        conn.close()
+        # A long window so everything submitted below lands in one batch
+        self.writer = GroupCommitWriter(max_batch_size=10, max_delay=0.2)
+
+    def tearDown(self):
+        self.writer.close()
+        self.tmp_dir.cleanup()
+
+    def count_items(self):
+        conn = sqlite3.connect(self.db_path)
+        count = conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        conn.close()
+        return count
+
+    def test_futures_resolve_after_one_group_commit(self):
+        futures = [self.writer.submit(self.db_path, "INSERT INTO items (name) VALUES (?)", (f"item {i}",)) for i in range(5)]
+        row_ids = [future.result(timeout=5) for future in futures]
+        self.assertEqual(row_ids, [1, 2, 3, 4, 5])
+        self.assertEqual(self.count_items(), 5)
+        self.assertEqual(self.writer.stats["batches"], 1)
+
+    def test_failing_write_does_not_fail_the_batch(self):
+        good = self.writer.submit(self.db_path, "INSERT INTO items (name) VALUES (?)", ("a",))
+        duplicate = self.writer.submit(self.db_path, "INSERT INTO items (name) VALUES (?)", ("a",))
+        other = self.writer.submit(self.db_path, "INSERT INTO items (name) VALUES (?)", ("b",))
+        self.assertIsInstance(good.result(timeout=5), int)
+        self.assertIsInstance(other.result(timeout=5), int)
+        with self.assertRaises(sqlite3.IntegrityError):
+            duplicate.result(timeout=5)
+        self.assertEqual(self.count_items(), 2)
+
+    def test_close_flushes_queued_writes(self):
+        futures = [self.writer.submit(self.db_path, "INSERT INTO items (name) VALUES (?)", (f"item {i}",)) for i in range(3)]
+        self.writer.close()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(self.count_items(), 3)
+        with self.assertRaises(RuntimeError):
+            self.writer.submit(self.db_path, "INSERT INTO items (name) VALUES ('late')")
+
+class TestBatchedHistorySaves(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original = (database.DB_FILE, database.WRITE_BATCHING)
+        database.DB_FILE = os.path.join(self.tmp_dir.name, "test_training_app.db")
+        database.WRITE_BATCHING = True
+        database.setup_database()
+
+    def tearDown(self):
+        database.close_history_writer()
+        database.DB_FILE, database.WRITE_BATCHING = self.original
+        self.tmp_dir.cleanup()
+
+    def test_save_waits_for_commit_and_returns_id(self):
+        workout_id = database.save_workout_to_history(1, "Strength", "Legs", ["Quads"], "Squats")
+        history = database.get_workout_history(1)
+        self.assertEqual([entry['id'] for entry in history], [workout_id])
+
+    def test_submitted_saves_feed_weekly_summary_triggers(self):
+        futures = [database.submit_workout_to_history(1, "HIIT", "Full Body", ["Quads"], f"Round {i}") for i in range(4)]
+        for future in futures:
+            future.result(timeout=5)
+        today = datetime.date.today()
+        summaries = database.get_weekly_summaries(1, today - datetime.timedelta(days=7), today)
+        self.assertEqual(sum(week['pillars']['HIIT']['sessions'] for week in summaries), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+"""
+Request tracing: spans for the steps of a request, written to a JSON lines file.
+
+The app starts a trace for every request (begin_trace) and sends its id in the X-Trace-Id
+response header, so a slow or failed request a user reports can be found. Only a sample of
+traces record spans (TRACE_SAMPLE_RATE); a request carrying a W3C traceparent header follows
+the caller's decision and joins the caller's trace instead.
+
+Inside a sampled trace, span(name) times a block as a child of the current span: the app, the
+workout generator (prompt, ai_call, parse) and every tagged database.py operation
+(query_stats.operation) open spans. Outside a sampled trace span() does nothing beyond one
+context variable lookup. The current span is a context variable, so it follows asyncio tasks
+on its own; work handed to another thread or a background job takes it along with bind().
+
+Each finished span is one line of TRACE_FILE, with OTLP's span field names:
+    {"traceId", "spanId", "parentSpanId", "name", "startTimeUnixNano", "endTimeUnixNano",
+     "attributes": {...}, "status": {"code": "OK" | "ERROR", "message"}}
+Spans are written as they end, so a background job's span may follow its request's root span.
+
+Environment:
+    TRACING=0               no trace ids and no spans
+    TRACE_SAMPLE_RATE=0.01  fraction of requests whose spans are recorded
+    TRACE_FILE=traces.jsonl where spans are appended
+"""
+import os
+import re
+import json
+import time
+import random
+import logging
+import threading
+import contextlib
+import contextvars
+
+TRACING = os.getenv("TRACING", "1") == "1"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_ID_HEADER = "X-Trace-Id"
+
+logger = logging.getLogger(__name__)
+
+# "00-<trace id>-<parent span id>-<flags>"; flag 01 means the caller sampled the trace
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current = contextvars.ContextVar("trace_span", default=None)
+_file = None # TRACE_FILE, opened on the first span written
+_file_lock = threading.Lock()
+
+def configure(enabled=None, sample_rate=None, trace_file=None):
+    """Sets the module configuration (create_app calls this); None leaves a setting as it is."""
+    global TRACING, TRACE_SAMPLE_RATE, TRACE_FILE, _file
+    if enabled is not None:
+        TRACING = enabled
+    if sample_rate is not None:
+        TRACE_SAMPLE_RATE = sample_rate
+    if trace_file is not None and trace_file != TRACE_FILE:
+        with _file_lock:
+            if _file is not None:
+                _file.close()
+                _file = None
+            TRACE_FILE = trace_file
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "sampled", "attributes",
+                 "start_ns", "end_ns", "error")
+
+    def __init__(self, trace_id, parent_id, name, sampled, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.sampled = sampled
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self.sampled:
+            _export(self)
+
+    def to_dict(self):
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attributes,
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+        }
+
+def _export(span):
+    global _file
+    line = json.dumps(span.to_dict(), default=str) + "\n"
+    try:
+        with _file_lock:
+            if _file is None:
+                _file = open(TRACE_FILE, "a", encoding="utf-8")
+            _file.write(line)
+            _file.flush() # Nothing left buffered for a forked child to write again
+    except OSError as e:
+        logger.error(f"Could not write trace span: {e}")
+
+def current_span():
+    return _current.get()
+
+def begin_trace(name, traceparent=None, **attributes):
+    """
+    Starts a request's root span and makes it current. Returns (span, token) for end_trace, or
+    (None, None) with tracing off. traceparent is the incoming header, if any.
+    """
+    if not TRACING:
+        return None, None
+    match = TRACEPARENT.match(traceparent or "")
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        sampled = bool(int(flags, 16) & 1)
+    else:
+        trace_id, parent_id = os.urandom(16).hex(), None
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    root = Span(trace_id, parent_id, name, sampled, attributes)
+    return root, _current.set(root)
+
+def end_trace(root, token, error=None):
+    if root is not None:
+        _current.reset(token)
+        root.end(error)
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Times the block as a child of the current span. Yields the Span, or None when not recording."""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        yield None
+        return
+    child = Span(parent.trace_id, parent.span_id, name, True, attributes)
+    token = _current.set(child)
+    error = None
+    try:
+        yield child
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        child.end(error)
+
+def bind(func):
+    """func, run with the caller's current span, for handing work to another thread or a job queue."""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return func
+    def run(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+def _reset_after_fork():
+    global _file, _file_lock
+    _file_lock = threading.Lock()
+    _file = None # The parent's file object; each process opens its own (appends are atomic per line)
+
+os.register_at_fork(after_in_child=_reset_after_fork)
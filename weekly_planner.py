@@ -1,10 +1,13 @@
 import datetime
+import logging
+
+logger = logging.getLogger(__name__)
 
 def generate_and_save_weekly_plan(user_id, user_settings, db_connection_func):
     """
     Generates a weekly workout plan based on user settings and saves it to the database.
     """
-    print(f"Generating weekly plan for user_id: {user_id} with settings: {user_settings}")
+    logger.debug(f"Generating weekly plan for user_id: {user_id} with settings: {user_settings}")
 
     strength_freq = user_settings.get('strength_freq', 0)
     zone2_freq = user_settings.get('zone2_freq', 0)
@@ -14,7 +17,7 @@ def generate_and_save_weekly_plan(user_id, user_settings, db_connection_func):
     # For now, we calculate rest days based on the sum of other activities.
 
     primary_goal = user_settings.get('primary_goal', 'Balanced Fitness')
-    print(f"Primary Goal for plan generation: {primary_goal}")
+    logger.debug(f"Primary Goal for plan generation: {primary_goal}")
 
     pillars = []
     pillars.extend(['Strength'] * strength_freq)
@@ -27,7 +30,7 @@ def generate_and_save_weekly_plan(user_id, user_settings, db_connection_func):
     if total_workout_days > 7:
         # Handle error: total frequency exceeds 7 days.
         # For now, we'll just log it and cap the workouts.
-        print(f"Warning: Total workout frequency ({total_workout_days}) exceeds 7 days. Capping at 7.")
+        logger.warning(f"Total workout frequency ({total_workout_days}) exceeds 7 days. Capping at 7.")
         pillars = pillars[:7]
         total_workout_days = 7
 
@@ -52,23 +55,44 @@ def generate_and_save_weekly_plan(user_id, user_settings, db_connection_func):
             weekly_distribution[i] = 'Rest'
 
 
-    print(f"Generated weekly distribution: {weekly_distribution}")
-
-import database # Assuming database.py is in the same directory or accessible via PYTHONPATH
-
-def generate_and_save_weekly_plan(user_id, user_settings, db_connection_func):
-    """
-    Generates a weekly workout plan based on user settings and saves it to the database.
-    Uses functions from the database module.
-    """
-    print(f"Generating weekly plan for user_id: {user_id} with settings: {user_settings}")
-
+    logger.debug(f"Generated weekly distribution: {weekly_distribution}")
+
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import weekly_scheduler
+import tracing
+
+# Weeks written ahead each time a plan is generated, so next Monday already has a plan
+PLAN_HORIZON_WEEKS = int(os.getenv("PLAN_HORIZON_WEEKS", 4))
+# One mesocycle: three build weeks of rising load, then a deload week
+MESOCYCLE = [("Build", 1.0), ("Build", 1.05), ("Build", 1.1), ("Deload", 0.6)]
+DEFAULT_FOCUS_ROTATION = ["Upper Body", "Lower Body", "Push", "Pull"]
+# Settings the plan is built from; recovery_freq, ai_model_id etc. do not change it
+PLAN_SETTINGS = ("strength_freq", "zone2_freq", "hiit_freq", "stability_freq", "primary_goal", "focus_rotation")
+# Fields a replan may rewrite on a day that is still 'Planned'
+PLAN_ENTRY_FIELDS = ("pillar_focus", "session_focus", "phase", "load_factor")
+
+def _deload_counts(strength, zone2, hiit, stability):
+    """Deload week: HIIT days become easy Zone2 and one Strength session is dropped (never the last)."""
+    return max(strength - 1, min(strength, 1)), zone2 + hiit, 0, stability
+
+def _focus_rotation(user_settings):
+    focus_rotation = user_settings.get('focus_rotation') or DEFAULT_FOCUS_ROTATION
+    if isinstance(focus_rotation, str):
+        try:
+            focus_rotation = json.loads(focus_rotation)
+        except json.JSONDecodeError:
+            focus_rotation = DEFAULT_FOCUS_ROTATION
+    return focus_rotation or DEFAULT_FOCUS_ROTATION
+
+def _capped_pillar_counts(user_settings):
+    """(strength, zone2, hiit, stability) sessions per week, capped at 7 days by priority."""
     strength_freq = user_settings.get('strength_freq', 0)
     zone2_freq = user_settings.get('zone2_freq', 0)
     hiit_freq = user_settings.get('hiit_freq', 0)
     stability_freq = user_settings.get('stability_freq', 0)
-    primary_goal = user_settings.get('primary_goal', 'Balanced Fitness')
-    print(f"Primary Goal for plan generation: {primary_goal}")
 
     pillars = []
     pillars.extend(['Strength'] * strength_freq)
@@ -79,7 +103,7 @@ def generate_and_save_weekly_plan(user_id, user_settings, db_connection_func):
     total_workout_days = len(pillars)
 
     if total_workout_days > 7:
-        print(f"Warning: Total workout frequency ({total_workout_days}) exceeds 7 days. Capping at 7 and prioritizing.")
+        logger.warning(f"Total workout frequency ({total_workout_days}) exceeds 7 days. Capping at 7 and prioritizing.")
         # Basic prioritization: Strength, HIIT, Zone2, Stability. Can be more sophisticated.
         prioritized_pillars = []
         temp_pillars = {
@@ -98,69 +122,238 @@ def generate_and_save_weekly_plan(user_id, user_settings, db_connection_func):
             if len(prioritized_pillars) == 7:
                 break
         pillars = prioritized_pillars
-        total_workout_days = len(pillars)
-
-    rest_days = 7 - total_workout_days
-    pillars.extend(['Rest'] * rest_days)
 
-    # Simple sequential distribution for now.
-    weekly_distribution = [pillars[i] if i < len(pillars) else 'Rest' for i in range(7)]
-    print(f"Generated weekly distribution: {weekly_distribution}")
-
-    # Database interaction
-    conn = None
-    try:
-        conn = db_connection_func() # Use the passed-in function to get a connection
+    return pillars.count('Strength'), pillars.count('Zone2'), pillars.count('HIIT'), pillars.count('Stability')
 
-        today = datetime.date.today()
-        week_start_date = today - datetime.timedelta(days=today.weekday())
-        print(f"Week start date: {week_start_date}")
+def build_weekly_plans(user_settings, week_start_date, weeks=1, cycle_position=0, rotation_position=0):
+    """
+    Computes `weeks` weeks of plan entries starting at week_start_date, without saving them.
+    cycle_position is where the first week sits in MESOCYCLE and rotation_position is the next
+    focus_rotation entry for Strength days, so a plan can continue an earlier one.
+    Returns {week_start_date: [plan entry dicts]}.
+    """
+    counts = _capped_pillar_counts(user_settings)
+    primary_goal = user_settings.get('primary_goal', 'Balanced Fitness')
+    focus_rotation = _focus_rotation(user_settings)
+
+    plans_by_week = {}
+    strength_sessions = rotation_position # Position in focus_rotation, carried across weeks
+    for week_index in range(weeks):
+        phase, load_factor = MESOCYCLE[(cycle_position + week_index) % len(MESOCYCLE)]
+        week_counts = _deload_counts(*counts) if phase == "Deload" else counts
+        # Lay the (capped) sessions out over the week: spaced out, no back-to-back hard days where
+        # avoidable, rest spread evenly. This is a lookup in weekly_scheduler's precomputed table.
+        weekly_distribution = weekly_scheduler.best_layout(*week_counts, primary_goal, focus_rotation)
+
+        plan_entries = []
+        for day_of_week, pillar_focus in enumerate(weekly_distribution):
+            session_focus = None
+            if pillar_focus == 'Strength':
+                session_focus = focus_rotation[strength_sessions % len(focus_rotation)]
+                strength_sessions += 1
+            plan_entries.append({
+                "day_of_week": day_of_week, "pillar_focus": pillar_focus, "status": "Planned", "workout_id": None,
+                "session_focus": session_focus, "phase": phase, "load_factor": load_factor,
+            })
+        plans_by_week[week_start_date + datetime.timedelta(weeks=week_index)] = plan_entries
+    return plans_by_week
+
+def _session_focuses(week_entries):
+    """The session_focus of the week's Strength days, in day order."""
+    return [entry['session_focus'] for entry in sorted(week_entries, key=lambda entry: entry['day_of_week'])
+            if entry.get('session_focus')]
+
+def plan_following_week(user_settings, previous_week, week_start_date):
+    """
+    Plans the single week at week_start_date as the continuation of previous_week (that week's
+    plan entries, possibly empty): the next MESOCYCLE phase and the next focus_rotation split.
+    Returns that week's plan entries.
+    """
+    cycle_position, rotation_position = 0, 0
+    if previous_week:
+        phase_key = (previous_week[0].get('phase'), previous_week[0].get('load_factor'))
+        if phase_key in MESOCYCLE:
+            cycle_position = MESOCYCLE.index(phase_key) + 1
+        focus_rotation = _focus_rotation(user_settings)
+        last_focus = _session_focuses(previous_week)
+        if last_focus and last_focus[-1] in focus_rotation:
+            rotation_position = focus_rotation.index(last_focus[-1]) + 1
+    plans_by_week = build_weekly_plans(user_settings, week_start_date, 1, cycle_position, rotation_position)
+    return plans_by_week[week_start_date]
+
+def generate_and_save_weekly_plan(user_id, user_settings, storage, weeks=1):
+    """
+    Generates `weeks` weeks of plan, starting with the current one, based on user settings and
+    saves them through storage (any storage.Storage backend) in one atomic step.
+    Weeks follow MESOCYCLE (progressive load, then a deload week), and Strength days
+    continue the focus_rotation from one week into the next.
+    """
+    logger.debug(f"Generating {weeks}-week plan for user_id: {user_id} with settings: {user_settings}")
+    logger.debug(f"Primary Goal for plan generation: {user_settings.get('primary_goal', 'Balanced Fitness')}")
 
-        # Clear existing plan for that user and week using database function
-        database.clear_weekly_plan(user_id, week_start_date, conn=conn)
-        # The print statement is already in clear_weekly_plan
+    today = datetime.date.today()
+    week_start_date = today - datetime.timedelta(days=today.weekday())
+    logger.debug(f"Week start date: {week_start_date}")
 
-        # Save the new plan using database function
-        for day_of_week, pillar_focus in enumerate(weekly_distribution):
-            plan_entry_data = {
-                "user_id": user_id,
-                "week_start_date": week_start_date, # Pass as date object
-                "day_of_week": day_of_week,
-                "pillar_focus": pillar_focus,
-                "status": "Planned",
-                "workout_id": None
-            }
-            database.save_daily_plan_entry(plan_entry_data, conn=conn)
-            # print(f"Saved plan entry: {plan_entry_data}") # save_daily_plan_entry can be verbose if needed
-
-        conn.commit() # Commit once after all entries are saved successfully
-        print("Weekly plan generated and saved successfully.")
+    plans_by_week = build_weekly_plans(user_settings, week_start_date, weeks)
+    for week_start, plan_entries in plans_by_week.items():
+        logger.debug(f"Week of {week_start} ({plan_entries[0]['phase']}, load {plan_entries[0]['load_factor']}): "
+                     f"{[entry['pillar_focus'] for entry in plan_entries]}")
 
+    try:
+        storage.replace_weekly_plans(user_id, plans_by_week)
+        logger.info("Weekly plan generated and saved successfully.")
     except Exception as e:
-        if conn:
-            conn.rollback()
-        print(f"Error generating or saving weekly plan: {e}")
+        logger.error(f"Error generating or saving weekly plan: {e}")
         # Consider re-raising or specific error handling based on error type
-    finally:
-        if conn:
-            conn.close()
 
-if __name__ == '__main__':
-    # This example usage will now try to use the actual database.py
-    # Ensure training_app.db can be created/accessed from where this is run.
-    # And that database.py is in python path.
+def get_or_create_current_plan(user_id, storage, weeks=None):
+    """
+    Returns this week's plan. If the week has none yet (the generated horizon ran out), a new
+    horizon is generated from the stored settings first, so the current week is never empty.
+    """
+    today = datetime.date.today()
+    week_start_date = today - datetime.timedelta(days=today.weekday())
+    plan = storage.get_weekly_plan(user_id, week_start_date)
+    if not plan:
+        generate_and_save_weekly_plan(user_id, storage.get_user_settings(user_id), storage, weeks or PLAN_HORIZON_WEEKS)
+        plan = storage.get_weekly_plan(user_id, week_start_date)
+    return plan
+
+def changed_plan_settings(old_settings, new_settings):
+    """Names of the PLAN_SETTINGS that differ between two settings dicts (focus_rotation as list or JSON)."""
+    def normalized(settings, key):
+        return _focus_rotation(settings) if key == 'focus_rotation' else settings.get(key)
+    return [key for key in PLAN_SETTINGS if normalized(old_settings, key) != normalized(new_settings, key)]
+
+def diff_week_plan(existing_entries, planned_entries, locked_before_day=0):
+    """
+    Compares a stored week with a freshly planned one. Days that are no longer 'Planned'
+    (completed or skipped) or come before locked_before_day (already past) are left alone, as
+    are days whose planned fields did not change. Returns (updates, inserts): updates are
+    planned entries carrying the id of the stored entry they replace, inserts are days the
+    stored week lacks.
+    """
+    existing_by_day = {entry['day_of_week']: entry for entry in existing_entries}
+    updates, inserts = [], []
+    for planned in planned_entries:
+        day = planned['day_of_week']
+        existing = existing_by_day.get(day)
+        if existing is None:
+            inserts.append(planned)
+        elif existing.get('status', 'Planned') != 'Planned' or day < locked_before_day:
+            continue
+        elif any(existing.get(field) != planned.get(field) for field in PLAN_ENTRY_FIELDS):
+            updates.append(dict(planned, id=existing['id']))
+    return updates, inserts
+
+def replan_with_settings(user_id, user_settings, storage, weeks=None, today=None):
+    """
+    Brings the stored plan horizon (this week plus the following weeks) in line with new
+    settings by changing only the days that differ. Completed, skipped and past days keep
+    their entries, and the horizon keeps its place in MESOCYCLE and focus_rotation, so changing
+    e.g. the HIIT frequency neither restarts periodization nor reshuffles the Strength splits.
+    Returns the number of entries changed.
+    """
+    weeks = weeks or PLAN_HORIZON_WEEKS
+    today = today or datetime.date.today()
+    week_start_date = today - datetime.timedelta(days=today.weekday())
+    week_starts = [week_start_date + datetime.timedelta(weeks=i) for i in range(weeks)]
+    existing_by_week = {week_start: storage.get_weekly_plan(user_id, week_start) for week_start in week_starts}
+
+    cycle_position, rotation_position = 0, 0
+    current_week = existing_by_week[week_start_date]
+    if current_week:
+        phase_key = (current_week[0].get('phase'), current_week[0].get('load_factor'))
+        cycle_position = MESOCYCLE.index(phase_key) if phase_key in MESOCYCLE else 0
+        # Where this week entered focus_rotation: a week that continues the previous one (see
+        # plan_following_week) does not start at its beginning
+        focus_rotation = _focus_rotation(user_settings)
+        first_focus = _session_focuses(current_week)
+        if first_focus and first_focus[0] in focus_rotation:
+            rotation_position = focus_rotation.index(first_focus[0])
+    planned_by_week = build_weekly_plans(user_settings, week_start_date, weeks, cycle_position, rotation_position)
+
+    changes_by_week = {}
+    for week_start, planned_entries in planned_by_week.items():
+        locked_before_day = today.weekday() if week_start == week_start_date else 0
+        updates, inserts = diff_week_plan(existing_by_week[week_start], planned_entries, locked_before_day)
+        if updates or inserts:
+            changes_by_week[week_start] = (updates, inserts)
+    if not changes_by_week:
+        return 0
+    return storage.apply_weekly_plan_changes(user_id, changes_by_week)
+
+class ReplanScheduler:
+    """
+    Runs replan_with_settings on one background thread so a settings save does not wait for
+    it. Replans for the same user coalesce: if one is still queued when another is scheduled,
+    only the latest settings are planned.
+    """
+
+    def __init__(self):
+        self._start()
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="replan")
+        self._pending = {} # user_id -> (user_settings, storage) of the queued replan
+        self._lock = threading.Lock()
+
+    def reset_after_fork(self):
+        """
+        In a forked child the parent's replan thread does not exist: start a fresh executor.
+        Replans the parent had queued are the parent's to run.
+        """
+        self._start()
+
+    def schedule(self, user_id, user_settings, storage):
+        """Queues a replan. Returns its Future, or None when it joined one already queued."""
+        with self._lock:
+            already_queued = user_id in self._pending
+            self._pending[user_id] = (user_settings, storage)
+        if already_queued:
+            return None
+        # The replan's spans join the trace of the request that scheduled it
+        return self._executor.submit(tracing.bind(self._run), user_id)
+
+    def _run(self, user_id):
+        with self._lock:
+            user_settings, storage = self._pending.pop(user_id)
+        try:
+            with tracing.span("replan", user_id=user_id):
+                changed = replan_with_settings(user_id, user_settings, storage)
+            logger.info(f"Replanned user_id {user_id} after a settings change: {changed} plan entries changed.")
+            return changed
+        except Exception as e:
+            logger.error(f"Error replanning user_id {user_id} after a settings change: {e}")
+            raise
+
+    @property
+    def pending(self):
+        """Replans queued and not yet started."""
+        return len(self._pending)
+
+    def wait(self):
+        """Blocks until every replan scheduled so far has run."""
+        self._executor.submit(lambda: None).result()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+replan_scheduler = ReplanScheduler()
+os.register_at_fork(after_in_child=replan_scheduler.reset_after_fork)
 
-    # For a true standalone test, we might need to adjust PYTHONPATH or run as a module
-    # For now, assuming it can import database if in the same directory.
+if __name__ == '__main__':
+    # Runs against the configured backend (STORAGE_BACKEND, SQLite by default).
+    # Use STORAGE_BACKEND=memory to try it without touching training_app.db.
+    from storage import get_storage
 
-    # Setup database if it doesn't exist (or tables are missing)
     print("Running weekly_planner.py standalone test...")
-    print("Attempting to set up database for test...")
+    store = get_storage()
     try:
-        database.setup_database() # Make sure tables exist
+        store.setup() # Make sure tables exist
     except Exception as e:
-        print(f"Error setting up database for test: {e}")
-        print("Please ensure database.py is accessible and can connect/create training_app.db")
+        print(f"Error setting up storage for test: {e}")
         exit(1)
 
     print("\n--- Test Case 1: Standard Frequencies ---")
@@ -168,26 +361,12 @@ if __name__ == '__main__':
         "strength_freq": 3, "zone2_freq": 2, "hiit_freq": 1,
         "stability_freq": 1, "primary_goal": "Balanced Fitness"
     }
-    # Ensure user 1 exists or create them (simplified for test)
-    try:
-        conn_test = database.get_db_connection()
-        cursor_test = conn_test.cursor()
-        cursor_test.execute("INSERT OR IGNORE INTO users (id, username) VALUES (?, ?)", (1, 'test_user_1_planner'))
-        cursor_test.execute("INSERT OR IGNORE INTO users (id, username) VALUES (?, ?)", (2, 'test_user_2_planner'))
-        cursor_test.execute("INSERT OR IGNORE INTO users (id, username) VALUES (?, ?)", (3, 'test_user_3_planner'))
-        conn_test.commit()
-    except Exception as e_user:
-        print(f"Error ensuring test users exist: {e_user}")
-    finally:
-        if conn_test:
-            conn_test.close()
-
-    generate_and_save_weekly_plan(1, sample_user_settings_1, database.get_db_connection)
+    generate_and_save_weekly_plan(1, sample_user_settings_1, store)
 
     # Verify by fetching
     today = datetime.date.today()
     week_start_date_test = today - datetime.timedelta(days=today.weekday())
-    plan_1 = database.get_weekly_plan(1, week_start_date_test)
+    plan_1 = store.get_weekly_plan(1, week_start_date_test)
     print(f"Fetched plan for user 1: {plan_1}")
     assert len(plan_1) == 7, f"Expected 7 days in plan, got {len(plan_1)}"
     assert [p['pillar_focus'] for p in plan_1].count('Rest') == 0 # 3+2+1+1 = 7
@@ -197,8 +376,8 @@ if __name__ == '__main__':
         "strength_freq": 4, "zone2_freq": 2, "hiit_freq": 2,
         "stability_freq": 1, "primary_goal": "Strength Focus" # Total 9
     }
-    generate_and_save_weekly_plan(2, sample_user_settings_2, database.get_db_connection)
-    plan_2 = database.get_weekly_plan(2, week_start_date_test)
+    generate_and_save_weekly_plan(2, sample_user_settings_2, store)
+    plan_2 = store.get_weekly_plan(2, week_start_date_test)
     print(f"Fetched plan for user 2 (overflow): {plan_2}")
     assert len(plan_2) == 7, f"Expected 7 days in plan for overflow, got {len(plan_2)}"
     # Check if it capped at 7 workout days (0 rest days)
@@ -217,8 +396,8 @@ if __name__ == '__main__':
         "strength_freq": 1, "zone2_freq": 1, "hiit_freq": 0,
         "stability_freq": 1, "primary_goal": "Longevity" # Total 3
     }
-    generate_and_save_weekly_plan(3, sample_user_settings_3, database.get_db_connection)
-    plan_3 = database.get_weekly_plan(3, week_start_date_test)
+    generate_and_save_weekly_plan(3, sample_user_settings_3, store)
+    plan_3 = store.get_weekly_plan(3, week_start_date_test)
     print(f"Fetched plan for user 3 (few): {plan_3}")
     assert len(plan_3) == 7, f"Expected 7 days in plan for few, got {len(plan_3)}"
     assert [p['pillar_focus'] for p in plan_3].count('Rest') == 4, \
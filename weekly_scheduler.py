@@ -0,0 +1,184 @@
+"""
+Constraint-aware layout of a week's pillars.
+
+Every possible week (5 day types over 7 days, 5**7 = 78125 sequences) is scored on:
+
+* back-to-back high-intensity days (Strength/HIIT next to each other, HIIT on
+  consecutive days; consecutive Strength days cost less when focus_rotation
+  alternates body parts, e.g. Upper Body / Lower Body),
+* spacing: how evenly each pillar's sessions (and the rest days) spread over the week,
+* long runs of training days without rest, and recovery days after HIIT,
+* a small preference to start the week training and finish it resting.
+
+The week wraps around (Sunday is followed by next Monday). Each goal profile weights
+these terms differently. For each (strength, zone2, hiit, stability) frequency
+combination the lowest-scoring sequence is stored in a lookup table, so choosing a
+layout during planning is a dict lookup.
+
+The tables ship as weekly_layouts.json. Regenerate them after changing the scoring
+(and bump SCORING_VERSION):
+
+    python weekly_scheduler.py --generate
+"""
+import os
+import sys
+import json
+import logging
+import itertools
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCORING_VERSION = 1
+LAYOUTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "weekly_layouts.json")
+
+# One letter per day type in the generated table
+PILLAR_CODES = {"Strength": "S", "Zone2": "Z", "HIIT": "H", "Stability": "M", "Rest": "R"}
+CODE_PILLARS = {code: pillar for pillar, code in PILLAR_CODES.items()}
+HIGH_INTENSITY = {"S", "H"}
+RECOVERY = {"Z", "M", "R"}
+
+# primary_goal -> scoring profile; unknown goals use "balanced"
+GOAL_PROFILES = {
+    "Balanced Fitness": "balanced",
+    "Strength Focus": "strength",
+    "Hypertrophy Focus": "strength",
+    "VO2 Max Improvement": "endurance",
+    "Fat Loss": "endurance",
+    "Longevity": "longevity",
+}
+
+# Penalty weights per profile (recovery_after_hiit is a bonus, hence negative)
+PROFILE_WEIGHTS = {
+    "balanced":  {"hi_adjacent": 4, "strength_adjacent": 3, "hiit_adjacent": 6, "long_runs": 2, "recovery_after_hiit": -1.0,
+                  "spacing": {"S": 1.0, "H": 1.0, "Z": 0.5, "M": 0.25, "R": 1.0}},
+    "strength":  {"hi_adjacent": 4, "strength_adjacent": 5, "hiit_adjacent": 6, "long_runs": 2, "recovery_after_hiit": -0.5,
+                  "spacing": {"S": 2.0, "H": 0.5, "Z": 0.25, "M": 0.25, "R": 1.0}},
+    "endurance": {"hi_adjacent": 3, "strength_adjacent": 3, "hiit_adjacent": 8, "long_runs": 1.5, "recovery_after_hiit": -2.0,
+                  "spacing": {"S": 0.5, "H": 2.0, "Z": 1.0, "M": 0.25, "R": 0.75}},
+    "longevity": {"hi_adjacent": 6, "strength_adjacent": 4, "hiit_adjacent": 8, "long_runs": 3, "recovery_after_hiit": -1.5,
+                  "spacing": {"S": 1.0, "H": 1.0, "Z": 0.5, "M": 0.5, "R": 2.0}},
+}
+SPLIT_ROTATION_FACTOR = 0.4 # Consecutive Strength days on alternating splits are mostly fine
+WEEK_SHAPE_WEIGHT = 0.1 # Starting on a training day / ending on rest only breaks ties
+
+_tables = None
+_tables_lock = threading.Lock()
+
+def _gaps(positions):
+    """Cyclic distances between consecutive occurrences (positions sorted)."""
+    return [(positions[(i + 1) % len(positions)] - positions[i]) % 7 or 7 for i in range(len(positions))]
+
+def _features(week):
+    """Raw, profile-independent measurements of one 7-letter week."""
+    pairs = [(week[day], week[(day + 1) % 7]) for day in range(7)]
+    features = {
+        "hi_adjacent": sum(1 for a, b in pairs if a in HIGH_INTENSITY and b in HIGH_INTENSITY and a != b),
+        "strength_adjacent": sum(1 for a, b in pairs if a == b == "S"),
+        "hiit_adjacent": sum(1 for a, b in pairs if a == b == "H"),
+        "recovery_after_hiit": sum(1 for a, b in pairs if a == "H" and b in RECOVERY),
+        "spacing": {},
+        "week_shape": (week[0] == "R") + (week[6] in HIGH_INTENSITY),
+    }
+    for code in PILLAR_CODES.values():
+        positions = [day for day, letter in enumerate(week) if letter == code]
+        if len(positions) >= 2:
+            ideal_gap = 7 / len(positions)
+            features["spacing"][code] = sum((gap - ideal_gap) ** 2 for gap in _gaps(positions))
+
+    # Training days in a row beyond three, following the wrap into next week
+    rest_days = [day for day, letter in enumerate(week) if letter == "R"]
+    if rest_days:
+        features["long_runs"] = sum(max(0, gap - 1 - 3) for gap in _gaps(rest_days))
+    else:
+        features["long_runs"] = 4 # Same for every arrangement without rest
+    return features
+
+def _score(features, profile, split_rotation):
+    weights = PROFILE_WEIGHTS[profile]
+    strength_weight = weights["strength_adjacent"] * (SPLIT_ROTATION_FACTOR if split_rotation else 1)
+    score = (weights["hi_adjacent"] * features["hi_adjacent"]
+             + strength_weight * features["strength_adjacent"]
+             + weights["hiit_adjacent"] * features["hiit_adjacent"]
+             + weights["long_runs"] * features["long_runs"]
+             + weights["recovery_after_hiit"] * features["recovery_after_hiit"]
+             + WEEK_SHAPE_WEIGHT * features["week_shape"])
+    for code, spread in features["spacing"].items():
+        score += weights["spacing"][code] * spread
+    return score
+
+def _table_key(profile, split_rotation):
+    return f"{profile}|{'split' if split_rotation else 'single'}"
+
+def _counts_key(strength, zone2, hiit, stability):
+    return f"{strength},{zone2},{hiit},{stability}"
+
+def build_tables():
+    """Scores every possible week once and keeps the best layout per frequency combination."""
+    best = {} # table key -> counts key -> (score, week)
+    variants = [(profile, split) for profile in PROFILE_WEIGHTS for split in (False, True)]
+    # Fixed letter order makes ties resolve the same way on every run
+    for letters in itertools.product("SHZMR", repeat=7):
+        week = "".join(letters)
+        counts = _counts_key(week.count("S"), week.count("Z"), week.count("H"), week.count("M"))
+        features = _features(week)
+        for profile, split in variants:
+            table = best.setdefault(_table_key(profile, split), {})
+            score = _score(features, profile, split)
+            if counts not in table or score < table[counts][0]:
+                table[counts] = (score, week)
+    return {table_key: {counts: week for counts, (_, week) in table.items()} for table_key, table in best.items()}
+
+def generate_layouts_file(path=LAYOUTS_FILE):
+    tables = build_tables()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": SCORING_VERSION, "tables": tables}, f, indent=0, sort_keys=True)
+    return tables
+
+def load_tables():
+    """Returns the layout tables, from weekly_layouts.json when it matches SCORING_VERSION."""
+    global _tables
+    with _tables_lock:
+        if _tables is None:
+            try:
+                with open(LAYOUTS_FILE, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") != SCORING_VERSION:
+                    raise ValueError(f"layout table version {data.get('version')} != {SCORING_VERSION}")
+                _tables = data["tables"]
+            except (OSError, ValueError) as e:
+                logger.warning(f"Precomputed weekly layouts unavailable ({e}); computing them now.")
+                _tables = build_tables()
+        return _tables
+
+def has_split_rotation(focus_rotation):
+    """True when the Strength focus alternates between different splits (e.g. Upper/Lower)."""
+    if isinstance(focus_rotation, str):
+        try:
+            focus_rotation = json.loads(focus_rotation)
+        except json.JSONDecodeError:
+            return False
+    return len(set(focus_rotation or [])) >= 2
+
+def best_layout(strength, zone2, hiit, stability, primary_goal="Balanced Fitness", focus_rotation=None):
+    """
+    Returns the best 7-day list of pillar names for these weekly frequencies (which must
+    add up to at most 7; the remaining days are Rest).
+    """
+    if min(strength, zone2, hiit, stability) < 0 or strength + zone2 + hiit + stability > 7:
+        raise ValueError(f"Frequencies must be non-negative and total at most 7, got {(strength, zone2, hiit, stability)}.")
+    profile = GOAL_PROFILES.get(primary_goal, "balanced")
+    table = load_tables()[_table_key(profile, has_split_rotation(focus_rotation))]
+    return [CODE_PILLARS[code] for code in table[_counts_key(strength, zone2, hiit, stability)]]
+
+def score_layout(pillars, primary_goal="Balanced Fitness", focus_rotation=None):
+    """Penalty score of a 7-day list of pillar names (lower is better)."""
+    week = "".join(PILLAR_CODES[pillar] for pillar in pillars)
+    return _score(_features(week), GOAL_PROFILES.get(primary_goal, "balanced"), has_split_rotation(focus_rotation))
+
+if __name__ == "__main__":
+    if "--generate" in sys.argv[1:]:
+        tables = generate_layouts_file()
+        print(f"Wrote {sum(len(table) for table in tables.values())} layouts in {len(tables)} tables to {LAYOUTS_FILE}.")
+    else:
+        print(__doc__)
@@ -1,24 +1,38 @@
+import os
 import random
 import json
 import logging
+import types
+import threading
+import time
+import contextlib
+import metrics
+import tracing
+from logging_config import log_payload
 from ai_provider import SimpleGeminiProvider, GEMINI_MODELS, DEFAULT_MODEL_ID
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-try:
-    with open("muscle_anatomy.json", "r", encoding="utf-8") as f:
-        anatomy_data = json.load(f)
-except FileNotFoundError:
-    anatomy_data = {}
-    logger.error("muscle_anatomy.json not found. Contextual nudge logic will be limited.")
-
-
-def generate_workout_plan(user_data, settings, api_key):
-    """
-    Generates a workout plan using the AI provider based on user inputs and settings.
-    """
+ANATOMY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "muscle_anatomy.json")
+_anatomy_data = None
+_anatomy_lock = threading.Lock()
+
+def get_anatomy_data():
+    """muscle_anatomy.json, loaded on first use (only Strength prompts need it)."""
+    global _anatomy_data
+    with _anatomy_lock:
+        if _anatomy_data is None:
+            try:
+                with open(ANATOMY_FILE, "r", encoding="utf-8") as f:
+                    _anatomy_data = json.load(f)
+            except FileNotFoundError:
+                _anatomy_data = {}
+                logger.error("muscle_anatomy.json not found. Contextual nudge logic will be limited.")
+        return _anatomy_data
+
+
+def _create_provider(settings, api_key):
+    """Initializes the Gemini provider for the user's selected model."""
     # --- User-specific Gemini Provider Initialization ---
     try:
         user_model_id = settings.get('ai_model_id', DEFAULT_MODEL_ID)
@@ -30,10 +44,16 @@ def generate_workout_plan(user_data, settings, api_key):
         }
         current_gemini_provider = SimpleGeminiProvider(provider_options)
         logger.info(f"Using model {user_model_id} for workout generation.")
+        return current_gemini_provider
     except Exception as e:
         logger.error(f"Failed to initialize user-specific Gemini provider: {e}")
         raise ValueError(f"Failed to initialize AI model: {e}")
 
+def build_workout_prompt(user_data, settings):
+    """
+    Builds the full prompt (system instruction + client-specific prompt) for a daily workout.
+    Raises ValueError when required user inputs are missing.
+    """
     # Extract new pillar-based inputs
     workout_pillar = user_data.get("workout_pillar")
     if not workout_pillar:
@@ -304,6 +324,7 @@ def generate_workout_plan(user_data, settings, api_key):
     if workout_pillar == "Strength":
         emphasized_sub_muscle = f"the main muscles of the {focus}" if focus else "the primary target muscles"
         de_emphasized_sub_muscle = "other muscle groups"
+        anatomy_data = get_anatomy_data() if focus else {}
         if focus and anatomy_data.get(focus): # Re-integrate contextual nudge for strength
             focus_anatomy_details = anatomy_data.get(focus)
             sub_muscles = []
@@ -389,13 +410,17 @@ def generate_workout_plan(user_data, settings, api_key):
 
     user_prompt = "\n".join(user_prompt_parts)
     logger.info(f"Generating workout with prompt length: {len(user_prompt)}")
-    
-    # Non-streaming call for JSON response
-    response = current_gemini_provider.model.generate_content(f"{system_instruction}\n\n{user_prompt}")
-    
+    prompt = f"{system_instruction}\n\n{user_prompt}"
+    log_payload(logger, logging.INFO, "Workout prompt", prompt, pillar=workout_pillar)
+    return prompt
+
+def parse_workout_response(response_text, user_data):
+    """Parses the model's JSON reply into the workout dict returned to the client."""
+    workout_pillar = user_data.get("workout_pillar")
+    focus = user_data.get("focus")
     try:
         # The response text should be a JSON string.
-        response_json = json.loads(response.text)
+        response_json = json.loads(response_text)
         full_workout_text = response_json.get("workout_text", "")
         muscles_worked = response_json.get("muscles_worked", []) # AI should provide this based on new prompts
         
@@ -421,5 +446,62 @@ def generate_workout_plan(user_data, settings, api_key):
 
     except (json.JSONDecodeError, ValueError) as e:
         logger.error(f"Failed to parse JSON response from Gemini: {e}")
-        logger.error(f"Raw response text: {response.text}")
-        raise ValueError("AI returned an invalid response format. Please try again.")
\ No newline at end of file
+        log_payload(logger, logging.ERROR, "Raw response text", response_text)
+        raise ValueError("AI returned an invalid response format. Please try again.")
+
+def generate_workout_plan(user_data, settings, api_key):
+    """
+    Generates a workout plan using the AI provider based on user inputs and settings.
+    """
+    current_gemini_provider, prompt = _prepare_generation(user_data, settings, api_key)
+    # Non-streaming call for JSON response
+    with _ai_call(settings, prompt) as call:
+        call.response = current_gemini_provider.model.generate_content(prompt)
+    return _parse_generation(call.response, user_data)
+
+async def generate_workout_plan_async(user_data, settings, api_key):
+    """
+    Async variant of generate_workout_plan for the ASGI app: the model call is awaited,
+    so the event loop can serve other requests while Gemini is generating.
+    """
+    current_gemini_provider, prompt = _prepare_generation(user_data, settings, api_key)
+    with _ai_call(settings, prompt) as call:
+        call.response = await current_gemini_provider.generate_content_async(prompt)
+    return _parse_generation(call.response, user_data)
+
+# The steps both variants share; only the model call itself differs.
+
+def _prepare_generation(user_data, settings, api_key):
+    """(provider, prompt) for one generation."""
+    current_gemini_provider = _create_provider(settings, api_key)
+    with tracing.span("prompt"), metrics.time_stage("prompt"):
+        return current_gemini_provider, build_workout_prompt(user_data, settings)
+
+@contextlib.contextmanager
+def _ai_call(settings, prompt):
+    """Traces, times and counts the model call made in the block, which sets call.response."""
+    model_id = settings.get('ai_model_id', DEFAULT_MODEL_ID)
+    call = types.SimpleNamespace(response=None)
+    with tracing.span("ai_call", model=model_id) as span:
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            metrics.record_ai_call(model_id, started, error=e)
+            raise
+        metrics.record_ai_call(model_id, started, call.response)
+        metrics.observe_stage("ai_call", time.perf_counter() - started)
+        _annotate_ai_span(span, prompt, call.response)
+
+def _parse_generation(response, user_data):
+    with tracing.span("parse"), metrics.time_stage("parse"):
+        return parse_workout_response(response.text, user_data)
+
+def _annotate_ai_span(span, prompt, response):
+    if span is None:
+        return
+    span.set_attribute("prompt_chars", len(prompt))
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        span.set_attribute("input_tokens", getattr(usage, "prompt_token_count", None))
+        span.set_attribute("output_tokens", getattr(usage, "candidates_token_count", None))
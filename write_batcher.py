@@ -0,0 +1,132 @@
+"""
+Group-commit writer for SQLite.
+
+Each commit in SQLite costs a journal write and an fsync, so many small writes spend
+most of their time committing. GroupCommitWriter funnels writes through one background
+thread that drains a queue, runs every write collected within a short window in a single
+transaction per database file, and commits once. Callers get a concurrent.futures.Future
+that resolves to the row id only after the commit, so a resolved future means the write
+is durable.
+
+The window closes when max_batch_size writes are queued or max_delay seconds have passed
+since the first one, whichever comes first. A larger window means fewer commits (more
+throughput) but a longer wait for each caller.
+"""
+import queue
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_STOP = object() # Queue sentinel that tells the writer thread to exit
+
+class GroupCommitWriter:
+
+    def __init__(self, max_batch_size=64, max_delay=0.005, connect=sqlite3.connect):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._connect = connect
+        self._queue = queue.Queue()
+        self._connections = {} # db_path -> connection, only touched by the writer thread
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self.stats = {"writes": 0, "batches": 0, "failed": 0}
+        self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """Writes queued and not yet taken into a batch."""
+        return self._queue.qsize()
+
+    def submit(self, db_path, sql, params=()):
+        """Queues one write. Returns a Future resolving to the cursor's lastrowid once committed."""
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("GroupCommitWriter is closed.")
+            self._queue.put((db_path, sql, params, future))
+        return future
+
+    def close(self, timeout=None):
+        """Commits everything already queued, then stops the writer thread."""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP) # Finish this batch, then stop
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = self._collect_batch(item)
+            by_path = {}
+            for entry in batch:
+                by_path.setdefault(entry[0], []).append(entry)
+            for db_path, writes in by_path.items():
+                self._commit_writes(db_path, writes)
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+
+    def _get_connection(self, db_path):
+        conn = self._connections.get(db_path)
+        if conn is None:
+            conn = self._connect(db_path)
+            self._connections[db_path] = conn
+        return conn
+
+    def _commit_writes(self, db_path, writes):
+        try:
+            conn = self._get_connection(db_path)
+        except sqlite3.Error as e:
+            self._fail(writes, e)
+            return
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row_ids = [conn.execute(sql, params).lastrowid for _, sql, params, _ in writes]
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            if len(writes) == 1:
+                self._fail(writes, e)
+                return
+            # Retry one by one so a single bad write does not fail the whole batch
+            for write in writes:
+                self._commit_writes(db_path, [write])
+            return
+
+        self.stats["writes"] += len(writes)
+        self.stats["batches"] += 1
+        for (_, _, _, future), row_id in zip(writes, row_ids):
+            future.set_result(row_id)
+
+    def _fail(self, writes, error):
+        logger.error(f"Database error in group commit: {error}")
+        self.stats["failed"] += len(writes)
+        for _, _, _, future in writes:
+            future.set_exception(error)
@@ -0,0 +1,13 @@
+"""
+Production WSGI entry point:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Any WSGI server can serve `app`. gunicorn.conf.py holds the tuned worker/thread counts and
+the shutdown hook; under other servers the atexit hook below drains generations instead.
+"""
+import atexit
+from app import create_app, shutdown
+
+app = create_app()
+atexit.register(shutdown, app)